@@ -2,165 +2,654 @@ import json
 import boto3
 import os
 import base64
-from datetime import datetime
+import math
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from decimal import Decimal
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import instrumentation as log
+from instrumentation import Metrics
+from record_format import unpack_record
+
+# WebSocket配信の設定
+BROADCAST_MAX_WORKERS = int(os.environ.get('BROADCAST_MAX_WORKERS', '32'))
+BROADCAST_SEND_TIMEOUT = float(os.environ.get('BROADCAST_SEND_TIMEOUT', '3'))
+
+# 接続一覧キャッシュの有効期間（秒）
+CONNECTION_CACHE_TTL_SECONDS = float(os.environ.get('CONNECTION_CACHE_TTL_SECONDS', '10'))
 
 # AWS サービスクライアント
 dynamodb = boto3.resource('dynamodb')
 apigateway_client = boto3.client('apigatewaymanagementapi',
-                                endpoint_url=os.environ['WEBSOCKET_ENDPOINT'])
+                                endpoint_url=os.environ['WEBSOCKET_ENDPOINT'],
+                                config=Config(
+                                    connect_timeout=BROADCAST_SEND_TIMEOUT,
+                                    read_timeout=BROADCAST_SEND_TIMEOUT,
+                                    retries={'total_max_attempts': 1},
+                                    max_pool_connections=BROADCAST_MAX_WORKERS
+                                ))
 
 # 環境変数
 ORDERS_TABLE_NAME = os.environ['ORDERS_TABLE_NAME']
 CONNECTIONS_TABLE_NAME = os.environ['CONNECTIONS_TABLE_NAME']
 AGGREGATION_TABLE_NAME = os.environ['AGGREGATION_TABLE_NAME']
+ROLLUP_TABLE_NAME = os.environ.get('ROLLUP_TABLE_NAME', '')
+GEO_TABLE_NAME = os.environ.get('GEO_TABLE_NAME', '')
+
+# 差分配信プロトコルの設定（レーンごとのバージョン・集計・差分履歴は集計テーブルに保存）
+# レーンはKinesisのシャードごとの系列。シャードは同時に1つの呼び出しでしか処理されないため、採番が競合しない
+LANE_KEY_PREFIX = '__lane__#'
+LANES_KEY = '__lanes__'
+DELTA_KEY_PREFIX = '__delta__#'
+DEFAULT_LANE = '0'  # シャードIDを含まないレコード（ローカルのツールなど）のレーン
+VERSION_ITEMS = 2  # 1トランザクションに含めるレーンのUpdateと差分履歴のPut
+DELTA_HISTORY_TTL_SECONDS = int(os.environ.get('DELTA_HISTORY_TTL_SECONDS', '3600'))
+
+# 時間窓ロールアップの設定（イベント時刻基準のタンブリングウィンドウ）
+ROLLUP_WINDOW_SECONDS = [int(size) for size in os.environ.get('ROLLUP_WINDOW_SECONDS', '10,60').split(',') if size.strip()]
+ROLLUP_ALLOWED_LATENESS_SECONDS = int(os.environ.get('ROLLUP_ALLOWED_LATENESS_SECONDS', '120'))
+ROLLUP_TTL_SECONDS = int(os.environ.get('ROLLUP_TTL_SECONDS', str(24 * 60 * 60)))
+
+# TransactWriteItemsの設定
+TRANSACTION_MAX_ITEMS = 100  # TransactWriteItemsの1リクエストあたりの上限
+TRANSACTION_MAX_RETRIES = int(os.environ.get('TRANSACTION_MAX_RETRIES', '5'))
+TRANSACTION_BASE_DELAY = float(os.environ.get('TRANSACTION_BASE_DELAY', '0.05'))
+TRANSACTION_MAX_DELAY = float(os.environ.get('TRANSACTION_MAX_DELAY', '1.0'))
+# 同じシャードを別の呼び出しが処理していて（常駐コンシューマーのリース移動など）レーンのバージョンが進んでいた場合の再試行回数
+VERSION_CONFLICT_MAX_RETRIES = int(os.environ.get('VERSION_CONFLICT_MAX_RETRIES', '5'))
 
 # DynamoDBテーブル
-orders_table = dynamodb.Table(ORDERS_TABLE_NAME)
 connections_table = dynamodb.Table(CONNECTIONS_TABLE_NAME)
 aggregation_table = dynamodb.Table(AGGREGATION_TABLE_NAME)
+rollup_table = dynamodb.Table(ROLLUP_TABLE_NAME) if ROLLUP_TABLE_NAME else None
+geo_table = dynamodb.Table(GEO_TABLE_NAME) if GEO_TABLE_NAME else None
+
+# TransactWriteItems（低レベルAPI）用のシリアライザー
+serializer = TypeSerializer()
+
+# 呼び出しごとのメトリクス（EMF形式で出力）
+metrics = Metrics()
+
+# ウォームコンテナ間で再利用する接続一覧キャッシュ
+connection_cache = {
+    'ids': set(),
+    'loaded_at': None
+}
+
+# レーンごとの最後に確定したバージョンと、レーン一覧に登録済みのレーン（ウォームコンテナ間で再利用）
+lane_state = {
+    'versions': {},
+    'registered': set()
+}
 
 def lambda_handler(event, context):
-    print(f'Received Kinesis event: {json.dumps(event)}')
+    log.debug('Received Kinesis event', payload=lambda: event)
+    started = time.perf_counter()
     
     try:
-        # Kinesisレコードを処理
-        for record in event['Records']:
-            # Base64デコードしてJSONパース
-            data = json.loads(base64.b64decode(record['kinesis']['data']).decode('utf-8'))
-            print(f'Processing order: {data}')
-            
-            # 注文データをDynamoDBに保存
-            save_order(data)
-            
-            # 集計データを更新
-            update_aggregation(data['product'])
-            
-            # WebSocket経由で全クライアントに更新を通知（新しい注文情報を含む）
-            notify_clients(data)
+        failed_sequence_numbers = process_records(event['Records'])
         
+        # 失敗したレコードだけをKinesisから再試行させる（ReportBatchItemFailures）
         return {
-            'statusCode': 200,
-            'body': json.dumps({'message': 'Successfully processed records'})
+            'batchItemFailures': [
+                {'itemIdentifier': sequence_number} for sequence_number in failed_sequence_numbers
+            ]
         }
         
     except Exception as error:
-        print(f'Error processing Kinesis records: {str(error)}')
+        log.error('Error processing Kinesis records', error=str(error))
         raise error
+    
+    finally:
+        metrics.put('HandlerTime', round((time.perf_counter() - started) * 1000, 3), 'Milliseconds')
+        metrics.flush()
 
-def save_order(order_data):
-    """注文データをDynamoDBに保存"""
-    try:
-        # TTL（24時間後に削除）
-        ttl = int(datetime.utcnow().timestamp()) + (24 * 60 * 60)
-        
-        # 保存するアイテムを準備
-        item = {
-            'orderId': order_data['orderId'],
-            'product': order_data['product'],
-            'timestamp': order_data['timestamp'],
-            'userId': order_data['userId'],
-            'ttl': ttl
-        }
-        
-        # 位置情報がある場合は追加（Float値をDecimalに変換）
-        if 'location' in order_data and order_data['location']:
-            location = order_data['location'].copy()
-            if 'lat' in location:
-                location['lat'] = Decimal(str(location['lat']))
-            if 'lng' in location:
-                location['lng'] = Decimal(str(location['lng']))
-            item['location'] = location
+def process_records(records):
+    """Kinesisレコードを集計・配信し、再試行が必要なシーケンス番号を返す
+
+    Lambdaのイベントソースマッピング以外（backend/stream-consumer）からも呼び出す。
+    """
+    metrics.put('RecordsPerBatch', len(records))
+    record_iterator_age(records)
+    
+    # Kinesisレコードを処理
+    with metrics.timer('DecodeTime'):
+        entries = decode_records(records)
+    
+    # 注文の保存・レーンの集計とバージョンの採番をトランザクションでまとめて反映（処理済みの注文は加算しない）
+    with metrics.timer('CommitTime'):
+        commits, failed_sequence_numbers = commit_orders(entries)
+    accepted_orders = [order_data for commit in commits for order_data in commit['orders']]
+    metrics.put('CommittedOrders', len(accepted_orders))
+    metrics.put('FailedRecords', len(failed_sequence_numbers))
+    
+    # 新規に確定した注文だけを時間窓ロールアップと地域別カウンターに反映
+    with metrics.timer('RollupTime'):
+        update_rollups(accepted_orders)
+    with metrics.timer('GeoTime'):
+        update_geo_counters(accepted_orders)
+    
+    # WebSocket経由で全クライアントに更新を通知（確定したバージョンの差分と新しい注文情報を送信）
+    if commits:
+        with metrics.timer('NotifyTime'):
+            notify_clients(commits)
+    
+    return failed_sequence_numbers
+
+def record_iterator_age(records):
+    """最も古いレコードのKinesis到着時刻からの経過時間をイテレーターエイジとして記録"""
+    arrivals = [
+        record['kinesis']['approximateArrivalTimestamp']
+        for record in records
+        if record['kinesis'].get('approximateArrivalTimestamp')
+    ]
+    if arrivals:
+        metrics.put('IteratorAge', max(0, round((time.time() - min(arrivals)) * 1000)), 'Milliseconds')
+
+def record_lane(record):
+    """レコードを読んだKinesisシャードのレーン（eventIDの shardId-000000000003 → "3"）"""
+    shard_id = record.get('eventID', '').split(':', 1)[0]
+    suffix = shard_id.rsplit('-', 1)[-1]
+    if suffix.isdigit():
+        return str(int(suffix))
+    return shard_id or DEFAULT_LANE
+
+def decode_records(records):
+    """Kinesisレコードをデコードし、(シーケンス番号, レーン, 注文データ, 保存するアイテム)の一覧を返す
+
+    複数の注文をまとめたレコード（record_format参照）は、同じシーケンス番号の注文として展開する。
+    保存するアイテムを組み立てられない不正な注文は、再試行しても成功せずシャードを止めるため、ここで破棄する。
+    """
+    entries = []
+    # TTL（24時間後に削除）はバッチ単位で1回だけ計算
+    ttl = int(datetime.utcnow().timestamp()) + (24 * 60 * 60)
+    # 同じ都市の位置情報はバッチ内で変換結果を使い回す
+    location_cache = {}
+    
+    for record in records:
+        sequence_number = record['kinesis']['sequenceNumber']
+        lane = record_lane(record)
+        try:
+            # Base64デコードしてパース（GetRecordsで直接読んだレコードはデコード済みのバイト列）
+            payload = record['kinesis']['data']
+            if isinstance(payload, str):
+                payload = base64.b64decode(payload)
+            orders = unpack_record(payload)
+        except ValueError as error:
+            # 再試行しても成功しないレコードはシャードを止めないよう破棄
+            log.warning('Skipping malformed record', sequenceNumber=sequence_number, error=str(error))
+            continue
         
-        orders_table.put_item(Item=item)
-        print(f'Order saved to DynamoDB: {order_data["orderId"]}')
+        for data in orders:
+            error = validate_order(data)
+            if error:
+                log.warning('Skipping invalid order record', sequenceNumber=sequence_number, error=error, payload=data)
+                continue
+            
+            try:
+                item = build_order_item(data, ttl, location_cache)
+            except TypeError as error:
+                # DynamoDBに保存できない値（NaNなど）を含む注文は、バッチ全体を失敗させないようここで破棄
+                log.warning('Skipping unserializable order', sequenceNumber=sequence_number, error=str(error), payload=data)
+                continue
+            
+            log.debug('Processing order', orderId=data['orderId'], payload=data)
+            entries.append((sequence_number, lane, data, item))
+    
+    metrics.put('OrdersPerBatch', len(entries))
+    return entries
+
+def validate_order(data):
+    """保存・集計に必要な項目を検証し、不正な場合は理由を返す（正しい場合はNone）"""
+    if not isinstance(data, dict):
+        return 'Order must be an object'
+    for field in ('orderId', 'product', 'timestamp', 'userId'):
+        if not isinstance(data.get(field), str) or not data[field]:
+            return f'Missing or invalid {field}'
+    
+    location = data.get('location')
+    if location is None:
+        return None
+    if not isinstance(location, dict):
+        return 'location must be an object'
+    for field in ('lat', 'lng'):
+        value = location.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return f'location.{field} must be a number'
+    for field in ('name', 'region'):
+        if location.get(field) is not None and not isinstance(location[field], str):
+            return f'location.{field} must be a string'
+    return None
+
+def commit_orders(entries):
+    """注文の条件付きPut・レーンの集計ADDとバージョンの採番を同じトランザクションで実行（orderIdで冪等）
+
+    確定したトランザクションごとの {"lane", "version", "deltas", "orders"} の一覧と、再試行が必要なシーケンス番号を返す。
+    """
+    commits = []
+    failed_sequence_numbers = []
+    if not entries:
+        return commits, failed_sequence_numbers
+    
+    # 注文Put + レーンのUpdate・差分PutがTransactWriteItemsの上限に収まるように、レーンごとに分割
+    chunks = [[]]
+    seen_order_ids = set()
+    for sequence_number, lane, order_data, item in entries:
+        if order_data['orderId'] in seen_order_ids:
+            # 同一バッチ内の重複は1トランザクションに含められないため除外
+            log.info('Skipping duplicate order in batch', orderId=order_data['orderId'])
+            continue
+        seen_order_ids.add(order_data['orderId'])
         
-    except Exception as error:
-        print(f'Error saving order: {str(error)}')
-        raise error
+        if chunks[-1] and (chunks[-1][0][1] != lane or len(chunks[-1]) + VERSION_ITEMS >= TRANSACTION_MAX_ITEMS):
+            chunks.append([])
+        chunks[-1].append((sequence_number, lane, order_data, item))
+    
+    for chunk in chunks:
+        commit, failed = write_order_transaction(chunk)
+        if commit:
+            commits.append(commit)
+        failed_sequence_numbers.extend(failed)
+    
+    # まとめたレコードの注文が複数のトランザクションに分かれた場合もシーケンス番号は1回だけ返す
+    failed_sequence_numbers = list(dict.fromkeys(failed_sequence_numbers))
+    log.info('Orders committed', committed=sum(len(commit['orders']) for commit in commits),
+             versions=[f"{commit['lane']}:{commit['version']}" for commit in commits], failed=len(failed_sequence_numbers))
+    return commits, failed_sequence_numbers
 
-def update_aggregation(product):
-    """集計データを更新"""
-    try:
-        response = aggregation_table.update_item(
-            Key={'product': product},
-            UpdateExpression='ADD #count :increment',
-            ExpressionAttributeNames={'#count': 'count'},
-            ExpressionAttributeValues={':increment': 1},
-            ReturnValues='ALL_NEW'
+def build_order_item(order_data, ttl, location_cache):
+    """保存するアイテムをDynamoDBの型付き形式で準備（保存できない値を含む場合はTypeError）"""
+    item = {
+        'orderId': order_data['orderId'],
+        'product': order_data['product'],
+        'timestamp': order_data['timestamp'],
+        'userId': order_data['userId'],
+        'ttl': ttl
+    }
+    
+    item = {key: serializer.serialize(value) for key, value in item.items()}
+    
+    # 位置情報がある場合は追加（緯度・経度以外の項目も含め、Float値をすべてDecimalに変換）
+    location = order_data.get('location')
+    if location:
+        # 全項目のJSONをキーにして、同じ地点の変換結果をバッチ内で使い回す
+        cache_key = json.dumps(location, sort_keys=True, separators=(',', ':'))
+        if cache_key not in location_cache:
+            location_cache[cache_key] = serializer.serialize(json.loads(cache_key, parse_float=Decimal))
+        item['location'] = location_cache[cache_key]
+    
+    return item
+
+def write_order_transaction(chunk):
+    """1トランザクション分の注文を書き込み、処理済みの注文を除外しながら再試行
+
+    バージョンはシャードごとのレーンで「現在の値+1」に更新する。レーンを書き込むのはそのシャードを処理している
+    呼び出しだけなので、他のシャードやコンテナとは競合しない（リースの移動などで重なった場合だけ読み直す）。
+    """
+    pending = list(chunk)
+    lane = pending[0][1]
+    attempt = 0
+    conflicts = 0
+    register_lane(lane)
+    version = get_committed_version(lane)
+    
+    while pending:
+        product_deltas = dict(Counter(order_data['product'] for _, _, order_data, _ in pending))
+        try:
+            with metrics.timer('DynamoDBLatency'):
+                dynamodb.meta.client.transact_write_items(
+                    TransactItems=build_transact_items(pending, lane, version, product_deltas)
+                )
+            lane_state['versions'][lane] = version + 1
+            return {
+                'lane': lane,
+                'version': version + 1,
+                'deltas': product_deltas,
+                'orders': [order_data for _, _, order_data, _ in pending]
+            }, []
+            
+        except ClientError as error:
+            reasons = error.response.get('CancellationReasons', [])
+            # レーンのバージョンが進んでいた場合は、条件チェック失敗時に返る現在の値から採番し直す
+            version_reason = reasons[len(pending)] if len(reasons) > len(pending) else {}
+            version_conflict = version_reason.get('Code') == 'ConditionalCheckFailed'
+            if version_conflict:
+                version = int(version_reason.get('Item', {}).get('version', {}).get('N', 0)) or read_version(lane)
+                lane_state['versions'][lane] = version
+            
+            # 条件チェックに失敗した注文は処理済み（Kinesisの再送）なので除外して再実行
+            duplicate_ids = {
+                pending[index][2]['orderId']
+                for index, reason in enumerate(reasons[:len(pending)])
+                if reason.get('Code') == 'ConditionalCheckFailed'
+            }
+            if duplicate_ids:
+                log.info('Skipping already committed orders', duplicates=len(duplicate_ids))
+                pending = [entry for entry in pending if entry[2]['orderId'] not in duplicate_ids]
+                continue
+            if version_conflict and conflicts < VERSION_CONFLICT_MAX_RETRIES:
+                # 読み直したバージョンで、短いジッターを挟んでやり直す
+                conflicts += 1
+                metrics.put('VersionConflicts', 1)
+                time.sleep(random.uniform(0, TRANSACTION_BASE_DELAY))
+                continue
+            
+            if attempt >= TRANSACTION_MAX_RETRIES:
+                log.error('Error committing orders', orders=len(pending), error=str(error))
+                return None, [sequence_number for sequence_number, _, _, _ in pending]
+            
+            # フルジッター付き指数バックオフ（競合・スロットリング）
+            delay = min(TRANSACTION_MAX_DELAY, TRANSACTION_BASE_DELAY * (2 ** attempt))
+            attempt += 1
+            log.warning('Retrying transaction', orders=len(pending), attempt=attempt, error=str(error))
+            time.sleep(random.uniform(0, delay))
+    
+    return None, []
+
+def register_lane(lane):
+    """スナップショットで読むレーンの一覧にレーンを追加（コンテナごとに初回だけ。ADDなので何度呼んでもよい）"""
+    if lane in lane_state['registered']:
+        return
+    with metrics.timer('DynamoDBLatency'):
+        aggregation_table.update_item(
+            Key={'product': LANES_KEY},
+            UpdateExpression='ADD #lanes :lane',
+            ExpressionAttributeNames={'#lanes': 'lanes'},
+            ExpressionAttributeValues={':lane': {lane}}
         )
-        print(f'Aggregation updated: {response["Attributes"]}')
-        return response['Attributes']
-        
-    except Exception as error:
-        print(f'Error updating aggregation: {str(error)}')
-        raise error
+    lane_state['registered'].add(lane)
 
-def get_current_aggregation():
-    """現在の集計データを取得"""
-    try:
-        response = aggregation_table.scan()
-        
-        aggregation = {
-            'kinoko': 0,
-            'takenoko': 0
+def get_committed_version(lane):
+    """レーンの最後に確定したバージョン（未取得の場合だけ読み込む）"""
+    if lane not in lane_state['versions']:
+        lane_state['versions'][lane] = read_version(lane)
+    return lane_state['versions'][lane]
+
+def read_version(lane):
+    """集計テーブルからレーンの現在のバージョンを読み込む"""
+    with metrics.timer('DynamoDBLatency'):
+        response = aggregation_table.get_item(Key={'product': f'{LANE_KEY_PREFIX}{lane}'}, ConsistentRead=True)
+    return int(response.get('Item', {}).get('version', 0))
+
+def build_transact_items(pending, lane, version, product_deltas):
+    """注文の条件付きPut、レーンの集計ADDとバージョンの更新、差分履歴のPutを組み立て
+
+    注文のPutを先頭に、次にレーンのUpdateを並べてCancellationReasonsの位置と対応させる。
+    レーンの集計とバージョンは同じアイテムの属性なので、レーンを1件読めば集計値とバージョンが必ず一致する。
+    """
+    transact_items = [
+        {
+            'Put': {
+                'TableName': ORDERS_TABLE_NAME,
+                'Item': item,
+                'ConditionExpression': 'attribute_not_exists(orderId)'
+            }
+        }
+        for _, _, _, item in pending
+    ]
+    
+    # 読み込んだバージョンから変わっていない場合だけ+1し、商品ごとの件数を加算（変わっていればCancellationReasonsで現在の値を返す）
+    names = {'#version': 'version'}
+    values = {':next': {'N': str(version + 1)}}
+    add_clauses = []
+    for index, (product, delta) in enumerate(product_deltas.items()):
+        names[f'#p{index}'] = product
+        values[f':d{index}'] = {'N': str(delta)}
+        add_clauses.append(f'#p{index} :d{index}')
+    if version:
+        values[':current'] = {'N': str(version)}
+    transact_items.append({
+        'Update': {
+            'TableName': AGGREGATION_TABLE_NAME,
+            'Key': {'product': {'S': f'{LANE_KEY_PREFIX}{lane}'}},
+            'UpdateExpression': 'SET #version = :next ADD ' + ', '.join(add_clauses),
+            'ConditionExpression': '#version = :current' if version else 'attribute_not_exists(#version)',
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+            'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
         }
+    })
+    # 追いつき用のバージョンごとの差分も同じトランザクションで保存
+    transact_items.append({
+        'Put': {
+            'TableName': AGGREGATION_TABLE_NAME,
+            'Item': {
+                'product': {'S': f'{DELTA_KEY_PREFIX}{lane}#{version + 1}'},
+                'deltas': serializer.serialize(product_deltas),
+                'ttl': {'N': str(int(time.time()) + DELTA_HISTORY_TTL_SECONDS)}
+            }
+        }
+    })
+    
+    return transact_items
+
+def update_rollups(orders):
+    """注文のイベント時刻で商品×時間窓の件数を集計し、窓ごとに1回だけ加算"""
+    if rollup_table is None or not orders:
+        return
+    
+    now = time.time()
+    # ウォーターマーク：これより前に終わった窓は確定済みとして遅延レコードを反映しない
+    watermark = now - ROLLUP_ALLOWED_LATENESS_SECONDS
+    window_deltas = Counter()
+    dropped = 0
+    
+    for order_data in orders:
+        event_time = parse_event_time(order_data.get('timestamp'), now)
+        for window_seconds in ROLLUP_WINDOW_SECONDS:
+            window_start = int(event_time // window_seconds) * window_seconds
+            if window_start + window_seconds <= watermark:
+                dropped += 1
+                continue
+            window_deltas[(order_data['product'], window_seconds, window_start)] += 1
+    
+    if dropped:
+        log.info('Dropped rollup updates beyond the lateness watermark', dropped=dropped)
+    
+    ttl = int(now) + ROLLUP_TTL_SECONDS
+    for (product, window_seconds, window_start), delta in window_deltas.items():
+        try:
+            with metrics.timer('DynamoDBLatency'):
+                rollup_table.update_item(
+                    Key={'series': f'{product}#{window_seconds}', 'windowStart': window_start},
+                    UpdateExpression='ADD #count :delta SET #ttl = :ttl',
+                    ExpressionAttributeNames={'#count': 'count', '#ttl': 'ttl'},
+                    ExpressionAttributeValues={':delta': delta, ':ttl': ttl}
+                )
+        except Exception as error:
+            # 注文と合計はコミット済みのため、ロールアップの失敗でバッチを再試行しない
+            log.error('Error updating rollup', series=f'{product}#{window_seconds}', windowStart=window_start, error=str(error))
+
+def update_geo_counters(orders):
+    """地方・都市ごとの商品別件数をバッチ単位で集計し、地点ごとに1回だけ加算"""
+    if geo_table is None or not orders:
+        return
+    
+    geo_deltas = {}
+    city_locations = {}
+    for order_data in orders:
+        location = order_data.get('location')
+        if not location or not location.get('name'):
+            continue
         
-        for item in response['Items']:
-            product = item['product']
-            count = int(item.get('count', 0))
-            aggregation[product] = count
+        keys = [('city', location['name'])]
+        if location.get('region'):
+            keys.append(('region', location['region']))
+        for key in keys:
+            geo_deltas.setdefault(key, Counter())[order_data['product']] += 1
+        city_locations[location['name']] = location
+    
+    for (level, name), product_deltas in geo_deltas.items():
+        # 商品ごとの件数は同じアイテムの属性として加算
+        names = {}
+        values = {}
+        add_clauses = []
+        for index, (product, delta) in enumerate(product_deltas.items()):
+            names[f'#p{index}'] = product
+            values[f':d{index}'] = delta
+            add_clauses.append(f'#p{index} :d{index}')
+        update_expression = 'ADD ' + ', '.join(add_clauses)
         
-        return aggregation
+        # 都市は地図描画用の座標と地方名も保持
+        location = city_locations.get(name) if level == 'city' else None
+        if location and 'lat' in location and 'lng' in location:
+            values[':lat'] = Decimal(str(location['lat']))
+            values[':lng'] = Decimal(str(location['lng']))
+            values[':region'] = location.get('region', '')
+            update_expression += ' SET lat = if_not_exists(lat, :lat), lng = if_not_exists(lng, :lng), #region = if_not_exists(#region, :region)'
+            names['#region'] = 'region'
         
-    except Exception as error:
-        print(f'Error getting current aggregation: {str(error)}')
-        return {'kinoko': 0, 'takenoko': 0}
+        try:
+            with metrics.timer('DynamoDBLatency'):
+                geo_table.update_item(
+                    Key={'level': level, 'name': name},
+                    UpdateExpression=update_expression,
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+        except Exception as error:
+            # 注文と合計はコミット済みのため、地域別カウンターの失敗でバッチを再試行しない
+            log.error('Error updating geo counter', level=level, name=name, error=str(error))
 
-def notify_clients(new_order=None):
-    """WebSocket経由で全クライアントに通知"""
+def parse_event_time(timestamp, default):
+    """ISO形式の注文タイムスタンプをエポック秒に変換（タイムゾーンなしはUTCとみなす）"""
     try:
-        # 現在の集計データを取得
-        aggregation = get_current_aggregation()
-        
-        # 接続中のクライアント一覧を取得
-        connections_response = connections_table.scan()
-        
-        # 各クライアントにメッセージを送信
-        message_data = {
-            'type': 'update',
-            'data': aggregation,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        
-        # 新しい注文情報がある場合は追加
-        if new_order:
-            message_data['data']['newOrder'] = new_order
+        event_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return default
+    if event_time.tzinfo is None:
+        event_time = event_time.replace(tzinfo=timezone.utc)
+    return event_time.timestamp()
+
+def notify_clients(commits):
+    """WebSocket経由で全クライアントに差分を通知（確定したレーンのバージョンごとに1回だけ配信）
+
+    バージョンと差分履歴はコミット時に保存済みのため、配信に失敗したクライアントもレーンの次のバージョンの欠けから追いつける。
+    """
+    try:
+        # 接続中のクライアント一覧を取得（キャッシュ優先）
+        connection_ids = get_connection_ids()
         
-        message = json.dumps(message_data, cls=DecimalEncoder)
+        for commit in commits:
+            # 差分メッセージ（短いキーで送信量を削減）
+            message = json.dumps({
+                't': 'd',
+                'l': commit['lane'],
+                'v': commit['version'],
+                'd': commit['deltas'],
+                'o': [compact_order(order_data) for order_data in commit['orders']]
+            }, cls=DecimalEncoder, ensure_ascii=False, separators=(',', ':'))
+            
+            stats = broadcast(connection_ids, message)
+            metrics.put('FanOutSize', len(connection_ids))
+            metrics.put('BroadcastSent', stats['sent'])
+            metrics.put('BroadcastFailed', stats['failed'])
+            metrics.put('BroadcastPruned', stats['pruned'])
+            metrics.put('MessageBytes', len(message.encode('utf-8')), 'Bytes')
+            
+            log.info('Notifications sent', lane=commit['lane'], version=commit['version'], **stats)
         
-        for connection in connections_response['Items']:
-            connection_id = connection['connectionId']
-            try:
+    except Exception as error:
+        log.error('Error notifying clients', error=str(error))
+
+def compact_order(order_data):
+    """地図表示用に注文を [商品, 都市, 地方, 緯度, 経度] の配列へ圧縮"""
+    location = order_data.get('location') or {}
+    return [
+        order_data['product'],
+        location.get('name'),
+        location.get('region'),
+        location.get('lat'),
+        location.get('lng')
+    ]
+
+def get_connection_ids():
+    """接続IDの一覧を取得（TTL内はキャッシュを返し、期限切れ時はページングしながら全件スキャン）"""
+    loaded_at = connection_cache['loaded_at']
+    if loaded_at is not None and time.monotonic() - loaded_at < CONNECTION_CACHE_TTL_SECONDS:
+        return list(connection_cache['ids'])
+    
+    connection_ids = set()
+    scan_kwargs = {
+        'ProjectionExpression': '#id',
+        'ExpressionAttributeNames': {'#id': 'connectionId'}
+    }
+    while True:
+        with metrics.timer('DynamoDBLatency'):
+            response = connections_table.scan(**scan_kwargs)
+        connection_ids.update(item['connectionId'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    connection_cache['ids'] = connection_ids
+    connection_cache['loaded_at'] = time.monotonic()
+    log.info('Connection cache refreshed', connections=len(connection_ids))
+    return list(connection_ids)
+
+def invalidate_connections(connection_ids):
+    """切断済みの接続をキャッシュから即座に除外"""
+    connection_cache['ids'].difference_update(connection_ids)
+
+def broadcast(connection_ids, message):
+    """複数の接続に並列でメッセージを送信し、切断済みの接続はまとめて削除"""
+    started = time.perf_counter()
+    
+    def send(connection_id):
+        try:
+            with metrics.timer('ApiGatewayLatency'):
                 apigateway_client.post_to_connection(
                     ConnectionId=connection_id,
                     Data=message
                 )
-                print(f'Message sent to connection: {connection_id}')
-                
-            except apigateway_client.exceptions.GoneException:
-                # 接続が切れている場合は削除
-                print(f'Removing stale connection: {connection_id}')
-                connections_table.delete_item(
-                    Key={'connectionId': connection_id}
-                )
-            except Exception as error:
-                print(f'Error sending message to connection {connection_id}: {str(error)}')
-        
-        print('Notifications sent to all clients')
+            return 'sent'
+        except apigateway_client.exceptions.GoneException:
+            return 'gone'
+        except Exception as error:
+            log.error('Error sending message', connectionId=connection_id, error=str(error))
+            return 'failed'
+    
+    results = {}
+    if connection_ids:
+        max_workers = max(1, min(BROADCAST_MAX_WORKERS, len(connection_ids)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(connection_ids, executor.map(send, connection_ids)))
+    
+    # 接続が切れているものは最後にまとめて削除
+    gone_ids = [connection_id for connection_id, result in results.items() if result == 'gone']
+    invalidate_connections(gone_ids)
+    pruned = remove_stale_connections(gone_ids)
+    
+    return {
+        'sent': sum(1 for result in results.values() if result == 'sent'),
+        'failed': sum(1 for result in results.values() if result == 'failed'),
+        'pruned': pruned,
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def remove_stale_connections(connection_ids):
+    """切断済みの接続をBatchWriteItemでまとめて削除"""
+    if not connection_ids:
+        return 0
+    
+    try:
+        log.info('Removing stale connections', connections=len(connection_ids))
+        with connections_table.batch_writer() as batch:
+            for connection_id in connection_ids:
+                batch.delete_item(Key={'connectionId': connection_id})
+        return len(connection_ids)
         
     except Exception as error:
-        print(f'Error notifying clients: {str(error)}')
+        log.error('Error removing stale connections', error=str(error))
+        return 0
 
 # DynamoDB用のJSONエンコーダー（Decimalサポート）
 class DecimalEncoder(json.JSONEncoder):
@@ -1,27 +1,63 @@
 import json
 import boto3
+import math
 import os
+import time
 import uuid
 from datetime import datetime
 
+import instrumentation as log
+from instrumentation import Metrics
+from record_format import RECORD_FORMAT, build_records
+from kinesis_producer import MAX_RECORDS_PER_REQUEST, put_records_with_retry
+from partitioning import Partitioner
+
 # AWS サービスクライアント
 kinesis = boto3.client('kinesis')
 
 # 環境変数
 STREAM_NAME = os.environ['KINESIS_STREAM_NAME']
 
+# 呼び出しごとのメトリクス（EMF形式で出力）
+metrics = Metrics()
+
+# 注文可能な商品一覧
+PRODUCTS = [product.strip() for product in os.environ.get('PRODUCTS', 'kinoko,takenoko').split(',') if product.strip()]
+
+# 1リクエストでまとめて受け付ける注文数の上限（json形式では1回のPutRecordsに収まる件数）
+MAX_ORDERS_PER_REQUEST = int(os.environ.get('MAX_ORDERS_PER_REQUEST', str(MAX_RECORDS_PER_REQUEST)))
+
+# PutRecordsで失敗したレコードを再送する回数（API Gatewayのタイムアウト内に収まるように少なめ）
+KINESIS_MAX_RETRIES = int(os.environ.get('KINESIS_MAX_RETRIES', '2'))
+
+# パーティションキーの決め方（PARTITION_STRATEGY、explicitの場合はシャードの範囲を初回の送信時に取得）
+partitioner = None
+
+def get_partitioner():
+    global partitioner
+    if partitioner is None:
+        partitioner = Partitioner.for_stream(kinesis, STREAM_NAME)
+    return partitioner
+
 def lambda_handler(event, context):
-    print(f'Received event: {json.dumps(event)}')
+    log.debug('Received event', payload=lambda: event)
+    started = time.perf_counter()
     
     try:
         # リクエストボディの解析
         body = json.loads(event['body'])
+        
+        # 複数注文をまとめたリクエスト（{"orders": [...]}）はレコード形式に従ってパックして送信
+        if isinstance(body.get('orders'), list):
+            return handle_order_batch(event, body['orders'])
+        
         product = body.get('product')
         timestamp = body.get('timestamp')
         location = body.get('location')  # 位置情報を追加
         
-        # バリデーション
-        if not product or product not in ['kinoko', 'takenoko']:
+        # バリデーション（まとめ送信と同じ検証。不正な位置情報はAggregatorまで流さない）
+        error = validate_order(body)
+        if error:
             return {
                 'statusCode': 400,
                 'headers': {
@@ -30,7 +66,7 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Methods': 'POST, OPTIONS'
                 },
                 'body': json.dumps({
-                    'error': 'Invalid product type'
+                    'error': error
                 })
             }
         
@@ -43,16 +79,16 @@ def lambda_handler(event, context):
             'location': location  # 位置情報を追加
         }
         
-        print(f'Order data with location: {json.dumps(order_data)}')
+        log.debug('Order data prepared', orderId=order_data['orderId'], payload=order_data)
         
         # Kinesis Data Streamにデータを送信
-        response = kinesis.put_record(
-            StreamName=STREAM_NAME,
-            Data=json.dumps(order_data),
-            PartitionKey=product  # 商品タイプでパーティション分割
-        )
+        with metrics.timer('KinesisLatency'):
+            response = kinesis.put_record(
+                StreamName=STREAM_NAME,
+                **get_partitioner().entry(json.dumps(order_data), order_data)  # 全シャードに分散
+            )
         
-        print(f'Successfully sent to Kinesis: {response}')
+        log.info('Sent to Kinesis', orderId=order_data['orderId'], shardId=response['ShardId'])
         
         return {
             'statusCode': 200,
@@ -70,7 +106,7 @@ def lambda_handler(event, context):
         }
         
     except Exception as error:
-        print(f'Error processing order: {str(error)}')
+        log.error('Error processing order', error=str(error))
         
         return {
             'statusCode': 500,
@@ -83,6 +119,151 @@ def lambda_handler(event, context):
                 'error': 'Internal server error'
             })
         }
+    
+    finally:
+        metrics.put('HandlerTime', round((time.perf_counter() - started) * 1000, 3), 'Milliseconds')
+        metrics.flush()
+
+def validate_order(order):
+    """注文1件のバリデーション（問題があればエラーメッセージ、なければNone）"""
+    if not isinstance(order, dict):
+        return 'Invalid order'
+    if order.get('product') not in PRODUCTS:
+        return 'Invalid product type'
+    if order.get('timestamp') is not None and not isinstance(order['timestamp'], str):
+        return 'Invalid timestamp'
+    if order.get('location') is not None and not is_valid_location(order['location']):
+        return 'Invalid location'
+    return None
+
+def is_valid_location(location):
+    """位置情報が {"name", "region", "lat", "lng"} の形で、緯度・経度が数値かどうか"""
+    if not isinstance(location, dict):
+        return False
+    for field in ('lat', 'lng'):
+        value = location.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return False
+    return all(location.get(field) is None or isinstance(location[field], str) for field in ('name', 'region'))
+
+def handle_order_batch(event, orders):
+    """複数注文をまとめて受け付け、1回のPutRecordsでKinesisに送信して注文ごとの結果を返す
+
+    不正な注文はその注文だけをエラーにして残りを送信する。PutRecordsで失敗したレコード（スロットリングなど）は
+    失敗したものだけを再送し、それでも送信できなかった注文はエラーコード付きで返す（一部失敗は207）。
+    """
+    if not orders or len(orders) > MAX_ORDERS_PER_REQUEST:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS'
+            },
+            'body': json.dumps({
+                'error': f'orders must contain 1 to {MAX_ORDERS_PER_REQUEST} orders'
+            })
+        }
+    
+    # 1回のループでバリデーションと注文データの作成を行い、結果はリクエストの順番で返す
+    user_id = event.get('requestContext', {}).get('connectionId', 'anonymous')
+    received_at = datetime.utcnow().isoformat()
+    results = [None] * len(orders)
+    orders_data = []
+    positions = {}
+    for index, order in enumerate(orders):
+        error = validate_order(order)
+        if error:
+            results[index] = {'index': index, 'success': False, 'error': error}
+            continue
+        order_data = {
+            'orderId': generate_order_id(),
+            'product': order['product'],
+            'timestamp': order.get('timestamp') or received_at,
+            'userId': user_id,
+            'location': order.get('location')
+        }
+        orders_data.append(order_data)
+        positions[order_data['orderId']] = index
+    
+    rejected = len(orders) - len(orders_data)
+    failed = 0
+    if orders_data:
+        # RECORD_FORMATに従ってレコードにまとめ、1回のPutRecordsで送信
+        # （MAX_ORDERS_PER_REQUESTをPutRecordsの上限より大きくした場合だけ、上限ごとに分けて送信）
+        records = build_records(orders_data, RECORD_FORMAT)
+        entries = [
+            get_partitioner().entry(data, packed_orders[0])
+            for data, packed_orders in records
+        ]
+        outcomes = []
+        retried = throttled = 0
+        with metrics.timer('KinesisLatency'):
+            for offset in range(0, len(entries), MAX_RECORDS_PER_REQUEST):
+                chunk_outcomes, summary = put_records_with_retry(
+                    kinesis, STREAM_NAME, entries[offset:offset + MAX_RECORDS_PER_REQUEST],
+                    max_retries=KINESIS_MAX_RETRIES
+                )
+                outcomes.extend(chunk_outcomes)
+                retried += summary['retried']
+                throttled += summary['throttled']
+        
+        for (data, packed_orders), outcome in zip(records, outcomes):
+            for order_data in packed_orders:
+                index = positions[order_data['orderId']]
+                if outcome.get('ErrorCode'):
+                    failed += 1
+                    results[index] = {
+                        'index': index,
+                        'orderId': order_data['orderId'],
+                        'success': False,
+                        'error': outcome['ErrorCode']
+                    }
+                else:
+                    results[index] = {
+                        'index': index,
+                        'orderId': order_data['orderId'],
+                        'success': True,
+                        'sequenceNumber': outcome['SequenceNumber'],
+                        'shardId': outcome['ShardId']
+                    }
+        
+        metrics.put('KinesisRecordsPerRequest', len(entries))
+        metrics.put('KinesisRetriedRecords', retried)
+        metrics.put('KinesisThrottledRecords', throttled)
+    
+    accepted = len(orders_data) - failed
+    metrics.put('OrdersPerRequest', len(orders))
+    metrics.put('RejectedOrders', rejected)
+    metrics.put('FailedOrders', failed)
+    log.info('Sent order batch to Kinesis', orders=len(orders), accepted=accepted, rejected=rejected,
+             failed=failed, recordFormat=RECORD_FORMAT)
+    
+    if accepted == len(orders):
+        status_code = 200
+    elif not orders_data:
+        status_code = 400
+    elif not accepted:
+        # 正しい注文がすべてKinesisへの送信に失敗した場合は、再試行できるエラーとして返す
+        status_code = 503
+    else:
+        status_code = 207
+    
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Methods': 'POST, OPTIONS'
+        },
+        'body': json.dumps({
+            'success': accepted == len(orders),
+            'accepted': accepted,
+            'rejected': rejected,
+            'failed': failed,
+            'orders': results
+        })
+    }
 
 def options_handler(event, context):
     """OPTIONSリクエスト（CORS対応）"""
@@ -0,0 +1,114 @@
+"""
+Lambda共通の計測ユーティリティ
+CloudWatch Embedded Metric Format (EMF) によるメトリクス出力と、
+レベル・サンプリングで絞り込める構造化ログを提供する。
+
+デプロイ時は各Lambda関数のディレクトリにコピーしてからzip化する（README参照）。
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# 環境変数
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'KinesisStreamDemo')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+LOG_PAYLOADS = os.environ.get('LOG_PAYLOADS', 'false').lower() == 'true'
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+# EMFで1つのメトリクスに記録できる値の上限
+MAX_VALUES_PER_METRIC = 100
+
+
+class Metrics:
+    """1回の呼び出し分のメトリクスを溜めて、flush()でEMF形式の1行として出力"""
+
+    def __init__(self, namespace=METRICS_NAMESPACE, function_name=FUNCTION_NAME):
+        self.namespace = namespace
+        self.function_name = function_name
+        self._lock = threading.Lock()
+        self._values = {}
+        self._units = {}
+
+    def put(self, name, value, unit='Count'):
+        """メトリクス値を追加（同じ名前を複数回記録した場合は配列として出力、上限を超えた分は破棄）"""
+        with self._lock:
+            recorded = self._values.setdefault(name, [])
+            if len(recorded) < MAX_VALUES_PER_METRIC:
+                recorded.append(value)
+            self._units[name] = unit
+
+    @contextmanager
+    def timer(self, name):
+        """ブロックの実行時間をミリ秒で記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, round((time.perf_counter() - started) * 1000, 3), 'Milliseconds')
+
+    def flush(self):
+        """溜めたメトリクスをEMF形式で標準出力に書き出してリセット"""
+        with self._lock:
+            values, units = self._values, self._units
+            self._values, self._units = {}, {}
+
+        if not values:
+            return
+
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in values]
+                }]
+            },
+            'FunctionName': self.function_name
+        }
+        for name, recorded in values.items():
+            document[name] = recorded[0] if len(recorded) == 1 else recorded
+
+        print(json.dumps(document))
+
+
+def log(level, message, payload=None, **fields):
+    """構造化ログを出力
+
+    LOG_LEVEL未満のログは出力しない。DEBUG/INFOはLOG_SAMPLE_RATEの割合だけ出力する。
+    payloadはLOG_PAYLOADS=trueのときだけ評価・シリアライズする（callableを渡すと遅延評価）。
+    """
+    if LOG_LEVELS[level] < LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS['INFO']):
+        return
+    if LOG_LEVELS[level] < LOG_LEVELS['WARNING'] and LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE:
+        return
+
+    record = {'level': level, 'message': message}
+    record.update(fields)
+    if payload is not None and LOG_PAYLOADS:
+        record['payload'] = payload() if callable(payload) else payload
+
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def debug(message, payload=None, **fields):
+    log('DEBUG', message, payload, **fields)
+
+
+def info(message, payload=None, **fields):
+    log('INFO', message, payload, **fields)
+
+
+def warning(message, payload=None, **fields):
+    log('WARNING', message, payload, **fields)
+
+
+def error(message, payload=None, **fields):
+    log('ERROR', message, payload, **fields)
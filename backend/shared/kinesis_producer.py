@@ -0,0 +1,180 @@
+"""
+PutRecordsによるKinesisへのバッチ送信
+レコードを500件 / 5MiB（PutRecordsの上限）または一定の待ち時間（linger）までまとめて送信し、
+ErrorCodeが返ったレコード（スロットリングなど）だけを指数バックオフで再送する。
+
+デプロイ時は各Lambda関数のディレクトリにコピーしてからzip化する（README参照）。
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+
+# PutRecordsの上限
+MAX_RECORDS_PER_REQUEST = 500
+MAX_BYTES_PER_REQUEST = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
+
+# スロットリング（シャードの書き込み上限超過）のエラーコード
+THROTTLE_ERROR = 'ProvisionedThroughputExceededException'
+
+# 再送の設定
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.1
+DEFAULT_MAX_DELAY = 2.0
+
+
+def entry_size(entry):
+    """PutRecordsの上限計算に使う1レコードのサイズ（データ + パーティションキー）"""
+    return len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
+
+
+def put_records_with_retry(client, stream_name, entries, max_retries=DEFAULT_MAX_RETRIES,
+                           base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """1回分のPutRecordsを送信し、失敗したレコードだけを再送
+
+    entriesと同じ順番で各レコードの結果（ShardId・SequenceNumber、または最後のErrorCode・ErrorMessage）と、
+    バッチ全体の結果（件数・再送回数・スロットリング回数・失敗件数・シャードごとの件数・所要時間）を返す。
+    """
+    started = time.perf_counter()
+    results = [None] * len(entries)
+    pending = list(range(len(entries)))
+    attempts = 0
+    retried = 0
+    throttled = 0
+
+    while pending:
+        attempts += 1
+        try:
+            response = client.put_records(
+                StreamName=stream_name,
+                Records=[entries[index] for index in pending]
+            )
+            outcomes = response['Records']
+        except Exception as error:
+            # リクエスト全体の失敗（スロットリング・ネットワーク）は未送信のレコードすべてを再送
+            code = getattr(error, 'response', {}).get('Error', {}).get('Code', type(error).__name__)
+            outcomes = [{'ErrorCode': code, 'ErrorMessage': str(error)}] * len(pending)
+
+        failed = []
+        for index, outcome in zip(pending, outcomes):
+            results[index] = outcome
+            if outcome.get('ErrorCode'):
+                failed.append(index)
+                if outcome['ErrorCode'] == THROTTLE_ERROR:
+                    throttled += 1
+
+        if not failed or attempts > max_retries:
+            break
+
+        # フルジッター付き指数バックオフ
+        retried += len(failed)
+        pending = failed
+        time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** (attempts - 1)))))
+
+    failed_count = sum(1 for result in results if result.get('ErrorCode'))
+    return results, {
+        'records': len(entries),
+        'bytes': sum(entry_size(entry) for entry in entries),
+        'attempts': attempts,
+        'retried': retried,
+        'throttled': throttled,
+        'failed': failed_count,
+        'errors': dict(Counter(result['ErrorCode'] for result in results if result.get('ErrorCode'))),
+        'shards': dict(Counter(result['ShardId'] for result in results if result.get('ShardId'))),
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+class KinesisProducer:
+    """レコードをバッファし、PutRecordsの上限またはlingerに達したらまとめて送信"""
+
+    def __init__(self, client, stream_name, linger_seconds=0.1, max_retries=DEFAULT_MAX_RETRIES,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, on_batch=None):
+        self.client = client
+        self.stream_name = stream_name
+        self.linger_seconds = linger_seconds
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # バッチごとの結果 (entries, results, summary) を受け取るコールバック
+        self.on_batch = on_batch
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._linger_thread = threading.Thread(target=self._linger_loop, daemon=True)
+        self._linger_thread.start()
+
+    def put(self, data, partition_key, explicit_hash_key=None):
+        """レコードをバッファに追加（上限に達した場合は呼び出し元でそのまま送信）"""
+        entry = {'Data': data, 'PartitionKey': partition_key}
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        size = entry_size(entry)
+        if size > MAX_BYTES_PER_RECORD:
+            raise ValueError(f'Record too large: {size} bytes')
+
+        with self._lock:
+            batch = None
+            if self._buffer_bytes + size > MAX_BYTES_PER_REQUEST:
+                batch = self._take()
+            self._buffer.append(entry)
+            self._buffer_bytes += size
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            # linger=0の場合はまとめずにすぐ送信
+            if batch is None and (len(self._buffer) >= MAX_RECORDS_PER_REQUEST or self.linger_seconds <= 0):
+                batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def flush(self):
+        """バッファに残っているレコードをすべて送信"""
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def close(self):
+        self._closed.set()
+        self._linger_thread.join()
+        self.flush()
+
+    def _take(self):
+        batch = self._buffer
+        self._buffer, self._buffer_bytes, self._oldest = [], 0, None
+        return batch
+
+    def _send(self, batch):
+        # 送信順を保つため、同時に送るPutRecordsは1つだけ
+        with self._send_lock:
+            try:
+                results, summary = put_records_with_retry(
+                    self.client, self.stream_name, batch,
+                    self.max_retries, self.base_delay, self.max_delay
+                )
+            except BaseException:
+                # 送信中に中断された場合（Ctrl+Cなど）はバッファの先頭に戻し、closeで送り直す
+                # （送信済みのレコードは重複するが、集計側は注文IDで重複を除外する）
+                with self._lock:
+                    self._buffer[:0] = batch
+                    self._buffer_bytes += sum(entry_size(entry) for entry in batch)
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                raise
+        if self.on_batch:
+            self.on_batch(batch, results, summary)
+
+    def _linger_loop(self):
+        """一番古いレコードがlingerを超えて待っていれば送信"""
+        while not self._closed.wait(max(min(self.linger_seconds, 0.05), 0.01)):
+            with self._lock:
+                expired = self._oldest is not None and time.monotonic() - self._oldest >= self.linger_seconds
+                batch = self._take() if expired else None
+            if batch:
+                self._send(batch)
@@ -0,0 +1,91 @@
+"""
+Kinesisのパーティションキーの決め方（Order Processor・クリックストリーム生成スクリプトで共通）
+PartitionKeyを商品名にするとキーが2種類しかなく、シャードを増やしても最大2シャードにしか書き込まれない。
+環境変数 PARTITION_STRATEGY（生成スクリプトは --partition）で次のいずれかを選ぶ。
+
+- orderId: 注文ID（デフォルト）。KinesisがキーのMD5でシャードを決めるため、全シャードにほぼ均等に分散する
+- userId: ユーザーIDのハッシュ。同じユーザーの注文は同じシャードに順番どおり届く（ユーザー数が少ないと偏る）
+- random: ランダムなキー
+- explicit: 各シャードのハッシュキー範囲に順番に割り当てるExplicitHashKey（キーの偏りに関係なく均等）
+- product: 商品名（従来の動作。シャードを増やしても分散しない）
+
+Data Aggregatorは注文IDで重複を除外し、集計は加算だけなので、シャードをまたいだ注文の順序には依存しない。
+デプロイ時は各Lambda関数のディレクトリにコピーしてからzip化する（README参照）。
+"""
+
+import hashlib
+import itertools
+import os
+import random
+
+STRATEGIES = ('orderId', 'userId', 'random', 'explicit', 'product')
+DEFAULT_STRATEGY = 'orderId'
+
+# パーティションキーのハッシュ空間（MD5の128ビット）
+HASH_KEY_SPACE = 2 ** 128
+
+PARTITION_STRATEGY = os.environ.get('PARTITION_STRATEGY', DEFAULT_STRATEGY)
+
+
+def even_hash_ranges(shard_count):
+    """ハッシュ空間をshard_count個に均等に分けた範囲（CreateStreamで作成したシャードと同じ分け方）"""
+    return [
+        (HASH_KEY_SPACE * index // shard_count, HASH_KEY_SPACE * (index + 1) // shard_count - 1)
+        for index in range(shard_count)
+    ]
+
+
+def list_hash_ranges(client, stream_name):
+    """ストリームの書き込み可能なシャードのハッシュキー範囲（リシャーディング後の不均等な範囲にも対応）"""
+    ranges = []
+    kwargs = {'StreamName': stream_name, 'ShardFilter': {'Type': 'AT_LATEST'}}
+    while True:
+        response = client.list_shards(**kwargs)
+        for shard in response['Shards']:
+            hash_range = shard['HashKeyRange']
+            ranges.append((int(hash_range['StartingHashKey']), int(hash_range['EndingHashKey'])))
+        if not response.get('NextToken'):
+            return sorted(ranges)
+        kwargs = {'NextToken': response['NextToken']}
+
+
+class Partitioner:
+    """注文データからPutRecordsのPartitionKey（explicitの場合はExplicitHashKeyも）を決める"""
+
+    def __init__(self, strategy=None, hash_ranges=None):
+        self.strategy = strategy or PARTITION_STRATEGY
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f'Unknown partition strategy: {self.strategy} (expected one of {", ".join(STRATEGIES)})')
+        # explicitで順番に割り当てるハッシュキー（各シャードの範囲の中央）
+        self.hash_keys = [str((start + end) // 2) for start, end in hash_ranges or []]
+        if self.strategy == 'explicit' and not self.hash_keys:
+            raise ValueError('explicit partition strategy requires the shard hash key ranges')
+        self._next_shard = itertools.count()
+
+    @classmethod
+    def for_stream(cls, client, stream_name, strategy=None):
+        """ストリーム用に作成（explicitの場合だけListShardsでシャードの範囲を取得）"""
+        strategy = strategy or PARTITION_STRATEGY
+        hash_ranges = list_hash_ranges(client, stream_name) if strategy == 'explicit' else None
+        return cls(strategy, hash_ranges)
+
+    def key(self, order_data):
+        """(PartitionKey, ExplicitHashKey) を返す（ExplicitHashKeyを使わない場合はNone）"""
+        if self.strategy == 'orderId':
+            return order_data['orderId'], None
+        if self.strategy == 'userId':
+            # 元のID（WebSocketの接続IDなど）をキーに残さない
+            return hashlib.md5(str(order_data.get('userId')).encode('utf-8')).hexdigest(), None
+        if self.strategy == 'random':
+            return f'{random.getrandbits(64):016x}', None
+        if self.strategy == 'explicit':
+            return order_data['orderId'], self.hash_keys[next(self._next_shard) % len(self.hash_keys)]
+        return order_data['product'], None
+
+    def entry(self, data, order_data):
+        """PutRecord / PutRecordsに渡す1レコード分（パックしたレコードは先頭の注文でキーを決める）"""
+        partition_key, explicit_hash_key = self.key(order_data)
+        entry = {'Data': data, 'PartitionKey': partition_key}
+        if explicit_hash_key is not None:
+            entry['ExplicitHashKey'] = explicit_hash_key
+        return entry
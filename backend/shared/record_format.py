@@ -0,0 +1,93 @@
+"""
+Kinesisレコードの形式（複数注文のパック・圧縮）
+1レコード1注文のJSONに加えて、複数の注文を1レコードにまとめ、必要に応じてzlibで圧縮した形式を扱う。
+パックしたレコードは先頭のマーカーで判別するため、従来のJSONレコードと混在できる。
+
+    マーカー(4バイト) + フラグ(1バイト) + 注文のJSON配列（フラグに応じてzlib圧縮）
+
+デプロイ時は各Lambda関数のディレクトリにコピーしてからzip化する（README参照）。
+"""
+
+import json
+import os
+import zlib
+
+# JSONは0x00で始まらないため、従来のレコードと衝突しない
+PACKED_MAGIC = b'\x00KSD'
+FLAG_ZLIB = 0x01
+
+# レコード形式: json（1レコード1注文）/ packed（複数注文）/ packed-zlib（複数注文を圧縮）
+RECORD_FORMAT = os.environ.get('RECORD_FORMAT', 'json')
+RECORD_FORMATS = ('json', 'packed', 'packed-zlib')
+
+# 1レコードのデータ上限（Kinesisは1MiB。パーティションキーの分を残す）と、1レコードにまとめる最大注文数
+MAX_RECORD_BYTES = int(os.environ.get('PACKED_MAX_RECORD_BYTES', '1000000'))
+MAX_ORDERS_PER_RECORD = int(os.environ.get('PACKED_MAX_ORDERS_PER_RECORD', '500'))
+
+# この長さ未満のJSONは圧縮しても小さくならないため、packed-zlibでも非圧縮で送る
+MIN_COMPRESS_BYTES = 256
+
+
+def encode_order(order_data):
+    """注文を1件分のJSONにエンコード"""
+    return json.dumps(order_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def pack_orders(encoded_orders, compress=False):
+    """エンコード済みの注文をまとめて1レコード分のバイト列を作成"""
+    body = b'[' + b','.join(encoded_orders) + b']'
+    flags = 0
+    if compress and len(body) >= MIN_COMPRESS_BYTES:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body, flags = compressed, FLAG_ZLIB
+    return PACKED_MAGIC + bytes([flags]) + body
+
+
+def build_records(orders, record_format=None):
+    """注文の一覧を、指定した形式のKinesisレコード [(データ, まとめた注文の一覧), ...] に変換"""
+    record_format = record_format or RECORD_FORMAT
+    if record_format not in RECORD_FORMATS:
+        raise ValueError(f'Unknown record format: {record_format}')
+
+    if record_format == 'json':
+        return [(encode_order(order_data), [order_data]) for order_data in orders]
+
+    compress = record_format == 'packed-zlib'
+    records = []
+    encoded_orders, packed_orders, size = [], [], 0
+    for order_data in orders:
+        encoded = encode_order(order_data)
+        # 非圧縮時のサイズで上限を判定する（圧縮後はこれより小さい）
+        if encoded_orders and (size + len(encoded) + 1 > MAX_RECORD_BYTES or len(encoded_orders) >= MAX_ORDERS_PER_RECORD):
+            records.append((pack_orders(encoded_orders, compress), packed_orders))
+            encoded_orders, packed_orders, size = [], [], 0
+        encoded_orders.append(encoded)
+        packed_orders.append(order_data)
+        size += len(encoded) + 1
+    if encoded_orders:
+        records.append((pack_orders(encoded_orders, compress), packed_orders))
+    return records
+
+
+def unpack_record(data):
+    """Kinesisレコードのデータを注文の一覧に変換（形式はマーカーで自動判別、壊れている場合はValueError）"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    if not data.startswith(PACKED_MAGIC):
+        return [json.loads(data.decode('utf-8'))]
+
+    if len(data) <= len(PACKED_MAGIC):
+        raise ValueError('Truncated packed record')
+    flags, body = data[len(PACKED_MAGIC)], data[len(PACKED_MAGIC) + 1:]
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as error:
+            raise ValueError(f'Invalid compressed record: {error}') from error
+
+    orders = json.loads(body.decode('utf-8'))
+    if not isinstance(orders, list):
+        raise ValueError('Packed record is not a list of orders')
+    return orders
@@ -0,0 +1,145 @@
+"""
+ストリームコンシューマーのチェックポイント・リースの保存先
+シャードごとに「どのワーカーが処理しているか（リース）」と「どこまで処理したか（チェックポイント）」を保持する。
+同じインターフェースで、DynamoDB（複数プロセス・複数ホスト）とメモリ（ローカル検証）を切り替えられる。
+"""
+
+import threading
+import time
+from decimal import Decimal
+
+import boto3
+from botocore.exceptions import ClientError
+
+# シャードを最後まで処理し終えたことを表すチェックポイント（子シャードの処理開始条件）
+SHARD_END = 'SHARD_END'
+
+
+class MemoryCheckpointStore:
+    """プロセス内で共有するチェックポイント・リース（ローカル検証用）"""
+
+    def __init__(self):
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def list_leases(self):
+        """全シャードのリース {shardId: {'owner', 'leaseExpiresAt', 'checkpoint'}} を取得"""
+        with self._lock:
+            return {shard_id: dict(lease) for shard_id, lease in self._leases.items()}
+
+    def get_checkpoint(self, shard_id):
+        with self._lock:
+            return self._leases.get(shard_id, {}).get('checkpoint')
+
+    def acquire_lease(self, shard_id, owner, lease_seconds, expected_owner=None):
+        """空き・期限切れのリース、またはexpected_ownerが持つリースを取得"""
+        now = time.time()
+        with self._lock:
+            lease = self._leases.setdefault(shard_id, {'owner': None, 'leaseExpiresAt': 0, 'checkpoint': None})
+            if expected_owner is not None:
+                if lease['owner'] != expected_owner:
+                    return False
+            elif lease['owner'] not in (None, owner) and lease['leaseExpiresAt'] >= now:
+                return False
+            lease['owner'] = owner
+            lease['leaseExpiresAt'] = now + lease_seconds
+            return True
+
+    def renew_lease(self, shard_id, owner, lease_seconds):
+        with self._lock:
+            lease = self._leases.get(shard_id)
+            if not lease or lease['owner'] != owner:
+                return False
+            lease['leaseExpiresAt'] = time.time() + lease_seconds
+            return True
+
+    def release_lease(self, shard_id, owner):
+        with self._lock:
+            lease = self._leases.get(shard_id)
+            if lease and lease['owner'] == owner:
+                lease['owner'] = None
+                lease['leaseExpiresAt'] = 0
+
+    def set_checkpoint(self, shard_id, owner, sequence_number):
+        """リースを保持している場合だけチェックポイントを更新（奪われたリースでは上書きしない）"""
+        with self._lock:
+            lease = self._leases.get(shard_id)
+            if not lease or lease['owner'] != owner:
+                return False
+            lease['checkpoint'] = sequence_number
+            return True
+
+
+class DynamoDBCheckpointStore:
+    """DynamoDBの条件付き書き込みによるチェックポイント・リース（パーティションキー: shardId）"""
+
+    def __init__(self, table_name, dynamodb=None):
+        self.table = (dynamodb or boto3.resource('dynamodb')).Table(table_name)
+
+    def list_leases(self):
+        leases = {}
+        scan_kwargs = {'ConsistentRead': True}
+        while True:
+            response = self.table.scan(**scan_kwargs)
+            for item in response['Items']:
+                leases[item['shardId']] = {
+                    'owner': item.get('owner'),
+                    'leaseExpiresAt': float(item.get('leaseExpiresAt', 0)),
+                    'checkpoint': item.get('checkpoint')
+                }
+            if 'LastEvaluatedKey' not in response:
+                return leases
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def get_checkpoint(self, shard_id):
+        response = self.table.get_item(Key={'shardId': shard_id}, ConsistentRead=True)
+        return response.get('Item', {}).get('checkpoint')
+
+    def acquire_lease(self, shard_id, owner, lease_seconds, expected_owner=None):
+        now = time.time()
+        values = {':owner': owner, ':expires': Decimal(str(now + lease_seconds))}
+        if expected_owner is not None:
+            condition = '#owner = :expected'
+            values[':expected'] = expected_owner
+        else:
+            condition = 'attribute_not_exists(#owner) OR #owner = :owner OR leaseExpiresAt < :now'
+            values[':now'] = Decimal(str(now))
+        return self._conditional_update(
+            shard_id, 'SET #owner = :owner, leaseExpiresAt = :expires', condition, values
+        )
+
+    def renew_lease(self, shard_id, owner, lease_seconds):
+        return self._conditional_update(
+            shard_id,
+            'SET leaseExpiresAt = :expires',
+            '#owner = :owner',
+            {':owner': owner, ':expires': Decimal(str(time.time() + lease_seconds))}
+        )
+
+    def release_lease(self, shard_id, owner):
+        self._conditional_update(shard_id, 'REMOVE #owner SET leaseExpiresAt = :zero', '#owner = :owner',
+                                 {':owner': owner, ':zero': 0})
+
+    def set_checkpoint(self, shard_id, owner, sequence_number):
+        return self._conditional_update(
+            shard_id,
+            'SET #checkpoint = :checkpoint',
+            '#owner = :owner',
+            {':owner': owner, ':checkpoint': sequence_number},
+            {'#checkpoint': 'checkpoint'}
+        )
+
+    def _conditional_update(self, shard_id, update_expression, condition, values, names=None):
+        try:
+            self.table.update_item(
+                Key={'shardId': shard_id},
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#owner': 'owner', **(names or {})},
+                ExpressionAttributeValues=values
+            )
+            return True
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
@@ -0,0 +1,337 @@
+"""
+Data Aggregatorの集計処理を常駐プロセスから呼び出すKinesisコンシューマー
+Lambdaのイベントソースマッピング（BatchSize・バッチウィンドウ）を経由せず、シャードごとのワーカーが
+GetRecordsでポーリングして lambda_function.process_records() を直接呼び出す。
+
+- シャードごとに1スレッドのワーカー（GetRecordsの件数は処理時間と遅延に応じて自動調整）
+- チェックポイント・リースの保存先は差し替え可能（checkpoints.py）
+- 複数プロセスで起動すると、リースを通じてシャードを均等に分け合う
+
+使い方:
+    python consumer.py --stream-name kinesis-stream-demo-stream --lease-table kinesis-stream-demo-consumer-leases
+"""
+
+import argparse
+import math
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+
+# リポジトリから直接実行する場合は共通モジュールと集計Lambdaを参照（パッケージ化時は同じディレクトリにコピーする）
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.extend(os.path.join(BACKEND_DIR, name) for name in ('shared', 'data-aggregator'))
+
+import instrumentation as log
+from instrumentation import Metrics
+from checkpoints import SHARD_END, DynamoDBCheckpointStore
+
+# 環境変数
+STREAM_NAME = os.environ.get('KINESIS_STREAM_NAME', '')
+LEASE_TABLE_NAME = os.environ.get('CONSUMER_LEASE_TABLE_NAME', '')
+
+# チェックポイントがないシャードの読み始め位置（イベントソースマッピングと同じくLATEST）
+INITIAL_POSITION = os.environ.get('CONSUMER_INITIAL_POSITION', 'LATEST')
+
+# GetRecordsの設定（1シャードあたり毎秒5回までのため、呼び出し間隔は0.2秒以上）
+POLL_INTERVAL_SECONDS = max(0.2, float(os.environ.get('CONSUMER_POLL_INTERVAL_SECONDS', '0.2')))
+MIN_RECORDS_LIMIT = int(os.environ.get('CONSUMER_MIN_RECORDS_LIMIT', '10'))
+MAX_RECORDS_LIMIT = min(10000, int(os.environ.get('CONSUMER_MAX_RECORDS_LIMIT', '1000')))
+TARGET_BATCH_SECONDS = float(os.environ.get('CONSUMER_TARGET_BATCH_SECONDS', '0.5'))
+
+# 処理失敗時の再試行間隔
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 5.0
+
+# リースの設定
+LEASE_SECONDS = float(os.environ.get('CONSUMER_LEASE_SECONDS', '10'))
+REBALANCE_INTERVAL_SECONDS = float(os.environ.get('CONSUMER_REBALANCE_INTERVAL_SECONDS', '3'))
+
+# ワーカーごとのメトリクス（EMF形式で出力）
+metrics = Metrics(function_name='stream-consumer')
+
+
+def list_shards(kinesis, stream_name):
+    """ストリームの全シャードを取得"""
+    shards = []
+    kwargs = {'StreamName': stream_name}
+    while True:
+        response = kinesis.list_shards(**kwargs)
+        shards.extend(response['Shards'])
+        if not response.get('NextToken'):
+            return shards
+        kwargs = {'NextToken': response['NextToken']}
+
+
+class ShardWorker(threading.Thread):
+    """1シャードを読み続け、処理できたところまでチェックポイントを進める"""
+
+    def __init__(self, consumer, shard_id):
+        super().__init__(name=f'worker-{shard_id}', daemon=True)
+        self.consumer = consumer
+        self.shard_id = shard_id
+        self.limit = MIN_RECORDS_LIMIT
+        self.elapsed = 0.0
+        self.stopping = threading.Event()
+        self.lease_lost = False
+
+    def run(self):
+        kinesis = self.consumer.kinesis
+        iterator = self.get_iterator(self.consumer.checkpoint_store.get_checkpoint(self.shard_id))
+        retries = 0
+        last_poll = 0.0
+
+        while iterator and not self.stopping.is_set():
+            # 1シャードあたりのGetRecords上限を超えないよう間隔を空ける
+            delay = last_poll + POLL_INTERVAL_SECONDS - time.monotonic()
+            if delay > 0:
+                self.stopping.wait(delay)
+            last_poll = time.monotonic()
+
+            try:
+                response = kinesis.get_records(ShardIterator=iterator, Limit=self.limit)
+            except ClientError as error:
+                code = error.response['Error']['Code']
+                if code == 'ExpiredIteratorException':
+                    iterator = self.get_iterator(self.consumer.checkpoint_store.get_checkpoint(self.shard_id))
+                    continue
+                if code == 'ProvisionedThroughputExceededException':
+                    self.stopping.wait(self.backoff(retries))
+                    retries += 1
+                    continue
+                raise
+
+            records = response['Records']
+            behind_ms = response.get('MillisBehindLatest', 0)
+            metrics.put('MillisBehindLatest', behind_ms, 'Milliseconds')
+
+            if records:
+                failed_sequence_number = self.process(records)
+                if failed_sequence_number:
+                    # 失敗したレコードから読み直す（それより前はチェックポイント済み）
+                    iterator = self.get_iterator(failed_sequence_number, 'AT_SEQUENCE_NUMBER')
+                    self.stopping.wait(self.backoff(retries))
+                    retries += 1
+                    continue
+                retries = 0
+                if not self.checkpoint(records[-1]['SequenceNumber']):
+                    break
+
+            self.adjust_limit(len(records), behind_ms)
+            iterator = response.get('NextShardIterator')
+
+        if iterator is None and not self.stopping.is_set():
+            # シャードが閉じられた（リシャーディング）場合は子シャードに処理を引き継ぐ
+            log.info('Shard ended', shardId=self.shard_id)
+            self.checkpoint(SHARD_END)
+
+    def process(self, records):
+        """集計処理を呼び出し、再試行が必要な最初のシーケンス番号を返す"""
+        # eventIDはイベントソースマッピングと同じ「シャードID:シーケンス番号」（集計側で配信レーンに使う）
+        kinesis_records = [
+            {
+                'eventID': f"{self.shard_id}:{record['SequenceNumber']}",
+                'kinesis': {
+                    'sequenceNumber': record['SequenceNumber'],
+                    'partitionKey': record.get('PartitionKey'),
+                    'data': record['Data'],
+                    'approximateArrivalTimestamp': record['ApproximateArrivalTimestamp'].timestamp()
+                }
+            }
+            for record in records
+        ]
+        started = time.perf_counter()
+        try:
+            failed = set(self.consumer.process_records(kinesis_records))
+        except Exception as error:
+            log.error('Error processing records', shardId=self.shard_id, error=str(error))
+            failed = {records[0]['SequenceNumber']}
+        self.elapsed = time.perf_counter() - started
+
+        metrics.put('BatchTime', round(self.elapsed * 1000, 3), 'Milliseconds')
+        metrics.put('RecordsLimit', self.limit)
+        self.consumer.flush_metrics()
+
+        for index, record in enumerate(records):
+            if record['SequenceNumber'] in failed:
+                if index > 0:
+                    self.checkpoint(records[index - 1]['SequenceNumber'])
+                return record['SequenceNumber']
+        return None
+
+    def adjust_limit(self, received, behind_ms):
+        """取得件数を調整（遅れていて満杯なら増やし、1回の処理が目標時間を超えたら減らす）"""
+        if received and self.elapsed > TARGET_BATCH_SECONDS:
+            self.limit = max(MIN_RECORDS_LIMIT, self.limit // 2)
+        elif received >= self.limit and behind_ms > 0:
+            self.limit = min(MAX_RECORDS_LIMIT, self.limit * 2)
+
+    def checkpoint(self, sequence_number):
+        """チェックポイントを保存（リースを失っていた場合はワーカーを止める）"""
+        if self.consumer.checkpoint_store.set_checkpoint(self.shard_id, self.consumer.worker_id, sequence_number):
+            return True
+        log.warning('Lease lost', shardId=self.shard_id, workerId=self.consumer.worker_id)
+        self.lease_lost = True
+        self.stopping.set()
+        return False
+
+    def get_iterator(self, sequence_number, iterator_type='AFTER_SEQUENCE_NUMBER'):
+        """チェックポイントの続き（なければINITIAL_POSITION）からのシャードイテレーターを取得"""
+        if sequence_number == SHARD_END:
+            return None
+        kwargs = {'StreamName': self.consumer.stream_name, 'ShardId': self.shard_id}
+        if sequence_number:
+            kwargs.update(ShardIteratorType=iterator_type, StartingSequenceNumber=sequence_number)
+        else:
+            kwargs['ShardIteratorType'] = INITIAL_POSITION
+        return self.consumer.kinesis.get_shard_iterator(**kwargs)['ShardIterator']
+
+    @staticmethod
+    def backoff(attempt):
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class StreamConsumer:
+    """リースを持つシャードごとにワーカーを起動し、他のプロセスとシャードを分け合う"""
+
+    def __init__(self, kinesis, stream_name, process_records, checkpoint_store, worker_id=None, flush=None):
+        self.kinesis = kinesis
+        self.stream_name = stream_name
+        self.process_records = process_records
+        self.checkpoint_store = checkpoint_store
+        self.worker_id = worker_id or f'{os.uname().nodename}-{uuid.uuid4().hex[:8]}'
+        self.flush = flush
+        self.workers = {}
+        self._flush_lock = threading.Lock()
+
+    def flush_metrics(self):
+        with self._flush_lock:
+            metrics.flush()
+            if self.flush:
+                self.flush()
+
+    def run(self, stop_event):
+        """stop_eventがセットされるまでリースの更新とシャードの再配分を繰り返す"""
+        log.info('Stream consumer started', workerId=self.worker_id, streamName=self.stream_name)
+        try:
+            while not stop_event.is_set():
+                self.rebalance()
+                stop_event.wait(REBALANCE_INTERVAL_SECONDS)
+        finally:
+            self.shutdown()
+
+    def rebalance(self):
+        """担当シャードのリースを更新し、ワーカー数に応じて不足分を取得・超過分を手放す"""
+        store = self.checkpoint_store
+
+        # 終了したワーカーを片付け、保持中のリースを更新
+        for shard_id, worker in list(self.workers.items()):
+            if not worker.is_alive() or not store.renew_lease(shard_id, self.worker_id, LEASE_SECONDS):
+                worker.stopping.set()
+                del self.workers[shard_id]
+
+        shards = list_shards(self.kinesis, self.stream_name)
+        leases = store.list_leases()
+        now = time.time()
+
+        # 親シャードを処理し終えたシャードだけを対象にする
+        shard_ids = {shard['ShardId'] for shard in shards}
+        available = [
+            shard['ShardId'] for shard in shards
+            if leases.get(shard['ShardId'], {}).get('checkpoint') != SHARD_END
+            and (shard.get('ParentShardId') not in shard_ids
+                 or leases.get(shard['ParentShardId'], {}).get('checkpoint') == SHARD_END)
+        ]
+
+        owners = {}
+        for shard_id in available:
+            lease = leases.get(shard_id, {})
+            if lease.get('owner') and lease.get('leaseExpiresAt', 0) >= now:
+                owners.setdefault(lease['owner'], []).append(shard_id)
+        owners.setdefault(self.worker_id, [])
+        target = math.ceil(len(available) / len(owners)) if available else 0
+        owned = [shard_id for shard_id in available if shard_id in self.workers]
+
+        # 多すぎる分は手放す（他のワーカーが取得する）
+        for shard_id in owned[target:]:
+            self.stop_worker(shard_id)
+        owned = owned[:target]
+
+        # 空き・期限切れのリースを取得
+        for shard_id in available:
+            if len(owned) >= target:
+                break
+            lease = leases.get(shard_id, {})
+            if shard_id in owned or (lease.get('owner') not in (None, self.worker_id)
+                                     and lease.get('leaseExpiresAt', 0) >= now):
+                continue
+            if store.acquire_lease(shard_id, self.worker_id, LEASE_SECONDS):
+                owned.append(shard_id)
+                self.start_worker(shard_id)
+
+        # まだ足りなければ、最も多く持っているワーカーから1つだけ奪う
+        if len(owned) < target:
+            victim, victim_shards = max(owners.items(), key=lambda owner: len(owner[1]))
+            if victim != self.worker_id and len(victim_shards) > target:
+                shard_id = victim_shards[-1]
+                if store.acquire_lease(shard_id, self.worker_id, LEASE_SECONDS, expected_owner=victim):
+                    log.info('Lease taken over', shardId=shard_id, previousOwner=victim)
+                    self.start_worker(shard_id)
+
+        metrics.put('OwnedShards', len(self.workers))
+
+    def start_worker(self, shard_id):
+        worker = ShardWorker(self, shard_id)
+        self.workers[shard_id] = worker
+        worker.start()
+        log.info('Shard worker started', shardId=shard_id, workerId=self.worker_id)
+
+    def stop_worker(self, shard_id):
+        """処理中のバッチを終えてからリースを手放す"""
+        worker = self.workers.pop(shard_id)
+        worker.stopping.set()
+        worker.join()
+        self.checkpoint_store.release_lease(shard_id, self.worker_id)
+        log.info('Shard worker stopped', shardId=shard_id, workerId=self.worker_id)
+
+    def shutdown(self):
+        for shard_id in list(self.workers):
+            self.stop_worker(shard_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data Aggregatorの常駐Kinesisコンシューマー')
+    parser.add_argument('--stream-name', default=STREAM_NAME, help='Kinesisストリーム名')
+    parser.add_argument('--lease-table', default=LEASE_TABLE_NAME, help='チェックポイント・リースのDynamoDBテーブル名')
+    parser.add_argument('--worker-id', help='ワーカーID（デフォルト: ホスト名とランダムな接尾辞）')
+    args = parser.parse_args()
+
+    if not args.stream_name or not args.lease_table:
+        parser.error('--stream-name と --lease-table（または環境変数）が必要です')
+
+    # 集計Lambdaは環境変数を読み込んでAWSクライアントを作るため、引数の確認後に読み込む
+    import lambda_function as aggregator
+
+    consumer = StreamConsumer(
+        boto3.client('kinesis'),
+        args.stream_name,
+        aggregator.process_records,
+        DynamoDBCheckpointStore(args.lease_table),
+        args.worker_id,
+        flush=aggregator.metrics.flush
+    )
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    consumer.run(stop_event)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
 import json
 import boto3
 import os
+import time
 from datetime import datetime
 from decimal import Decimal
+from boto3.dynamodb.conditions import Key
+
+import instrumentation as log
+from instrumentation import Metrics
 
 # AWS サービスクライアント
 dynamodb = boto3.resource('dynamodb')
@@ -10,14 +15,39 @@ dynamodb = boto3.resource('dynamodb')
 # 環境変数
 CONNECTIONS_TABLE_NAME = os.environ['CONNECTIONS_TABLE_NAME']
 AGGREGATION_TABLE_NAME = os.environ['AGGREGATION_TABLE_NAME']
+ROLLUP_TABLE_NAME = os.environ.get('ROLLUP_TABLE_NAME', '')
+GEO_TABLE_NAME = os.environ.get('GEO_TABLE_NAME', '')
 WEBSOCKET_ENDPOINT = os.environ['WEBSOCKET_ENDPOINT']
 
+# 集計対象の商品一覧
+PRODUCTS = [product.strip() for product in os.environ.get('PRODUCTS', 'kinoko,takenoko').split(',') if product.strip()]
+BATCH_GET_SIZE = 100  # BatchGetItemの1リクエストあたりの上限
+
+# 差分配信プロトコルの設定（Kinesisシャードごとのレーンのバージョン・集計と差分履歴は集計テーブルに保存）
+LANE_KEY_PREFIX = '__lane__#'
+LANES_KEY = '__lanes__'
+DELTA_KEY_PREFIX = '__delta__#'
+DELTA_CATCH_UP_MAX_VERSIONS = int(os.environ.get('DELTA_CATCH_UP_MAX_VERSIONS', '100'))
+
+# ロールアップの時間窓（秒、Aggregatorと同じ設定）と、1回のリクエストで返す期間の上限（分）
+ROLLUP_WINDOW_SECONDS = [int(size) for size in os.environ.get('ROLLUP_WINDOW_SECONDS', '10,60').split(',') if size.strip()]
+ROLLUP_MAX_MINUTES = int(os.environ.get('ROLLUP_MAX_MINUTES', '60'))
+
 # DynamoDBテーブル
 connections_table = dynamodb.Table(CONNECTIONS_TABLE_NAME)
 aggregation_table = dynamodb.Table(AGGREGATION_TABLE_NAME)
+rollup_table = dynamodb.Table(ROLLUP_TABLE_NAME) if ROLLUP_TABLE_NAME else None
+geo_table = dynamodb.Table(GEO_TABLE_NAME) if GEO_TABLE_NAME else None
+
+# WebSocket送信用クライアント（ウォームコンテナ間で再利用）
+apigateway_client = boto3.client('apigatewaymanagementapi', endpoint_url=WEBSOCKET_ENDPOINT)
+
+# 呼び出しごとのメトリクス（EMF形式で出力）
+metrics = Metrics()
 
 def lambda_handler(event, context):
-    print(f'WebSocket event: {json.dumps(event)}')
+    log.debug('WebSocket event', payload=lambda: event)
+    started = time.perf_counter()
     
     route_key = event['requestContext']['routeKey']
     connection_id = event['requestContext']['connectionId']
@@ -28,9 +58,15 @@ def lambda_handler(event, context):
         elif route_key == '$disconnect':
             handle_disconnect(connection_id)
         elif route_key == 'getCurrentData':
-            handle_get_current_data(event)
+            if not handle_get_current_data(event):
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'Request body must be a JSON object'})
+                }
+        elif route_key == 'getRollups':
+            handle_get_rollups(event)
         else:
-            print(f'Unknown route: {route_key}')
+            log.warning('Unknown route', routeKey=route_key)
         
         return {
             'statusCode': 200,
@@ -38,136 +74,322 @@ def lambda_handler(event, context):
         }
         
     except Exception as error:
-        print(f'WebSocket handler error: {str(error)}')
+        log.error('WebSocket handler error', routeKey=route_key, error=str(error))
         return {
             'statusCode': 500,
             'body': json.dumps({'error': 'Internal server error'})
         }
+    
+    finally:
+        metrics.put('HandlerTime', round((time.perf_counter() - started) * 1000, 3), 'Milliseconds')
+        metrics.flush()
 
 def handle_connect(connection_id):
-    """WebSocket接続時の処理"""
-    print(f'New WebSocket connection: {connection_id}')
+    """WebSocket接続時の処理（接続情報の登録のみ）
+
+    $connectの処理中は接続が確立していないためpost_to_connectionできない。初期データはクライアントが
+    接続後に送る getCurrentData への応答で返す。
+    """
+    log.debug('New WebSocket connection', connectionId=connection_id)
     
     try:
         # 接続情報をDynamoDBに保存
         ttl = int(datetime.utcnow().timestamp()) + (2 * 60 * 60)  # 2時間後に削除
         
-        connections_table.put_item(
-            Item={
-                'connectionId': connection_id,
-                'timestamp': datetime.utcnow().isoformat(),
-                'ttl': ttl
-            }
-        )
-        
-        # 現在の集計データを取得して送信
-        current_data = get_current_aggregation()
-        send_initial_data(connection_id, current_data)
+        with metrics.timer('DynamoDBLatency'):
+            connections_table.put_item(
+                Item={
+                    'connectionId': connection_id,
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'ttl': ttl
+                }
+            )
         
-        print(f'Connection {connection_id} registered and initial data sent')
+        log.info('Connection registered', connectionId=connection_id)
         
     except Exception as error:
-        print(f'Error handling connect: {str(error)}')
+        log.error('Error handling connect', connectionId=connection_id, error=str(error))
         raise error
 
-def send_initial_data(connection_id, aggregation_data):
-    """WebSocket接続時に初期データを送信"""
-    try:
-        apigateway_client = boto3.client('apigatewaymanagementapi',
-                                       endpoint_url=WEBSOCKET_ENDPOINT)
-        
-        message = json.dumps({
-            'type': 'update',
-            'data': aggregation_data,
-            'timestamp': datetime.utcnow().isoformat()
-        }, cls=DecimalEncoder)
-        
-        apigateway_client.post_to_connection(
-            ConnectionId=connection_id,
-            Data=message
-        )
-        print(f'Initial data sent to connection: {connection_id}')
-        
-    except Exception as error:
-        print(f'Error sending initial data to connection {connection_id}: {str(error)}')
-        # 初期データ送信エラーは無視（接続は維持）
+def build_snapshot_message(include_heatmap=False):
+    """レーンごとのバージョン付きの全量スナップショット {"t": "s", "v": {レーン: バージョン}, "c": 集計, "h": ヒートマップ}"""
+    versions, aggregation = get_current_aggregation()
+    message_data = {'t': 's', 'v': versions, 'c': aggregation}
+    if include_heatmap:
+        message_data['h'] = get_heatmap()
+    return message_data
+
+def build_catch_up_message(since_versions):
+    """sinceVersion以降の差分だけをまとめたメッセージ {"t": "c", "v": {レーン: バージョン}, "ds": [[レーン, バージョン, 差分], ...]}
+
+    sinceVersionにないレーンは0から追いつく。クライアントの遅れが大きい場合や差分履歴が欠けている場合は
+    Noneを返す（全量スナップショットで応答）。
+    """
+    versions = {lane: int(item.get('version', 0)) for lane, item in read_lane_items().items()}
+    if any(version > versions.get(lane, 0) for lane, version in since_versions.items()):
+        return None
+    
+    missing_versions = [
+        (lane, missing)
+        for lane, version in versions.items()
+        for missing in range(since_versions.get(lane, 0) + 1, version + 1)
+    ]
+    if len(missing_versions) > DELTA_CATCH_UP_MAX_VERSIONS:
+        return None
+    
+    items = {
+        item['product']: item
+        for item in read_aggregation_items([f'{DELTA_KEY_PREFIX}{lane}#{missing}' for lane, missing in missing_versions])
+    }
+    
+    deltas = []
+    for lane, missing in missing_versions:
+        item = items.get(f'{DELTA_KEY_PREFIX}{lane}#{missing}')
+        if item is None:
+            return None
+        deltas.append([lane, missing, {product: int(count) for product, count in item['deltas'].items()}])
+    
+    return {'t': 'c', 'v': versions, 'ds': deltas}
+
+def read_lane_items():
+    """レーンの一覧と、レーンごとのアイテム（バージョンと商品ごとの件数）を強い整合性で読み込む"""
+    with metrics.timer('DynamoDBLatency'):
+        response = aggregation_table.get_item(Key={'product': LANES_KEY}, ConsistentRead=True)
+    lanes = sorted(response.get('Item', {}).get('lanes', set()))
+    items = {item['product']: item for item in read_aggregation_items([f'{LANE_KEY_PREFIX}{lane}' for lane in lanes])}
+    return {lane: items.get(f'{LANE_KEY_PREFIX}{lane}', {}) for lane in lanes}
+
+def encode_message(message_data):
+    """WebSocketメッセージをコンパクトなJSONにエンコード"""
+    return json.dumps(message_data, cls=DecimalEncoder, ensure_ascii=False, separators=(',', ':'))
 
 def get_current_aggregation():
-    """現在の集計データを取得"""
+    """レーンごとのバージョンと集計データを取得（スキャンせず、レーンの一覧とレーンのアイテムだけを読む）
+
+    各レーンのバージョンと件数は同じアイテムの属性として同じトランザクションで更新されるため、
+    レーンごとに読んだバージョンの差分までがちょうどそのレーンの件数に含まれる。トランザクションで読まないので
+    書き込み中のトランザクションと競合しない。
+    一覧を読んだ後に追加されたレーンはバージョン0として扱われ、その差分はクライアントが最初から適用する。
+    """
+    aggregation = {product: 0 for product in PRODUCTS}
+    versions = {}
+    for lane, item in read_lane_items().items():
+        versions[lane] = int(item.get('version', 0))
+        for product in PRODUCTS:
+            aggregation[product] += int(item.get(product, 0))
+    return versions, aggregation
+
+def read_aggregation_items(item_keys):
+    """集計アイテムをGetItem/BatchGetItemで読み込み（読み込んだバージョンまでの差分履歴が必ず見えるよう強い整合性で読む）"""
+    if not item_keys:
+        return []
+    
+    if len(item_keys) == 1:
+        with metrics.timer('DynamoDBLatency'):
+            response = aggregation_table.get_item(Key={'product': item_keys[0]}, ConsistentRead=True)
+        return [response['Item']] if 'Item' in response else []
+    
+    items = []
+    keys = [{'product': key} for key in item_keys]
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request_items = {AGGREGATION_TABLE_NAME: {'Keys': keys[start:start + BATCH_GET_SIZE], 'ConsistentRead': True}}
+        while request_items:
+            with metrics.timer('DynamoDBLatency'):
+                response = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(response['Responses'].get(AGGREGATION_TABLE_NAME, []))
+            request_items = response.get('UnprocessedKeys') or {}
+    
+    return items
+
+def get_heatmap():
+    """地方・都市ごとの商品別件数をコンパクトな形式で取得
+
+    {"p": [商品...], "r": {地方: [件数...]}, "c": [[都市, 緯度, 経度, 件数...], ...]}
+    件数の並びは "p" の商品順。
+    """
+    heatmap = {'p': PRODUCTS, 'r': {}, 'c': []}
+    if geo_table is None:
+        return heatmap
+    
     try:
-        response = aggregation_table.scan()
-        
-        aggregation = {
-            'kinoko': 0,
-            'takenoko': 0
-        }
+        for item in query_geo_level('region'):
+            heatmap['r'][item['name']] = [int(item.get(product, 0)) for product in PRODUCTS]
         
-        for item in response['Items']:
-            product = item['product']
-            count = int(item.get('count', 0))
-            aggregation[product] = count
+        for item in query_geo_level('city'):
+            if 'lat' not in item or 'lng' not in item:
+                continue
+            heatmap['c'].append(
+                [item['name'], float(item['lat']), float(item['lng'])]
+                + [int(item.get(product, 0)) for product in PRODUCTS]
+            )
         
-        return aggregation
+        return heatmap
         
     except Exception as error:
-        print(f'Error getting current aggregation: {str(error)}')
-        return {'kinoko': 0, 'takenoko': 0}
+        log.error('Error getting heatmap', error=str(error))
+        return heatmap
+
+def query_geo_level(level):
+    """地域別カウンターを階層（region/city）ごとにQueryで全件取得"""
+    query_kwargs = {'KeyConditionExpression': Key('level').eq(level)}
+    while True:
+        with metrics.timer('DynamoDBLatency'):
+            response = geo_table.query(**query_kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
 def handle_disconnect(connection_id):
     """WebSocket切断時の処理"""
-    print(f'WebSocket disconnection: {connection_id}')
+    log.debug('WebSocket disconnection', connectionId=connection_id)
     
     try:
-        connections_table.delete_item(
-            Key={'connectionId': connection_id}
-        )
-        print('Connection removed from DynamoDB')
+        with metrics.timer('DynamoDBLatency'):
+            connections_table.delete_item(
+                Key={'connectionId': connection_id}
+            )
+        log.info('Connection removed', connectionId=connection_id)
         
     except Exception as error:
-        print(f'Error handling disconnect: {str(error)}')
+        log.error('Error handling disconnect', connectionId=connection_id, error=str(error))
         # 切断時のエラーは無視する
 
 def handle_get_current_data(event):
-    """現在のデータ取得リクエストの処理"""
+    """現在のデータ取得リクエストの処理
+
+    {"sinceVersion": {レーン: N}} で不足分の差分だけを、{"heatmap": true} でヒートマップ付きの全量を返す。
+    ボディがJSONのオブジェクトでない場合は何も送らずにFalseを返し、sinceVersionが不正な場合は全量を返す。
+    """
     connection_id = event['requestContext']['connectionId']
-    send_current_data(connection_id)
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        log.warning('Invalid getCurrentData request', connectionId=connection_id)
+        return False
+    
+    send_current_data(
+        connection_id,
+        body.get('heatmap') is True,
+        parse_since_versions(body.get('sinceVersion'))
+    )
+    return True
 
-def send_current_data(connection_id):
-    """現在の集計データをクライアントに送信"""
+def parse_since_versions(since_versions):
+    """sinceVersion（{レーン: 0以上の整数}）を検証して返す（不正な場合はNone）"""
+    if not isinstance(since_versions, dict):
+        return None
+    for version in since_versions.values():
+        if isinstance(version, bool) or not isinstance(version, int) or version < 0:
+            return None
+    return since_versions
+
+def send_current_data(connection_id, include_heatmap=False, since_versions=None):
+    """現在の集計データ（差分または全量スナップショット）をクライアントに送信"""
     try:
-        # 現在の集計データを取得
-        aggregation = get_current_aggregation()
+        # 追いつける範囲なら差分だけを、それ以外は全量スナップショットを送る
+        message_data = None
+        if since_versions is not None and not include_heatmap:
+            message_data = build_catch_up_message(since_versions)
+        if message_data is None:
+            message_data = build_snapshot_message(include_heatmap)
         
         # WebSocket経由でデータを送信
-        apigateway_client = boto3.client('apigatewaymanagementapi',
-                                       endpoint_url=WEBSOCKET_ENDPOINT)
-        
-        message = json.dumps({
-            'type': 'update',
-            'data': aggregation,
-            'timestamp': datetime.utcnow().isoformat()
-        }, cls=DecimalEncoder)
+        message = encode_message(message_data)
         
         try:
-            apigateway_client.post_to_connection(
-                ConnectionId=connection_id,
-                Data=message
-            )
-            print(f'Current data sent to connection: {connection_id}')
+            with metrics.timer('ApiGatewayLatency'):
+                apigateway_client.post_to_connection(
+                    ConnectionId=connection_id,
+                    Data=message
+                )
+            log.debug('Current data sent', connectionId=connection_id)
         except apigateway_client.exceptions.GoneException:
             # 接続が切れている場合は削除
-            print(f'Connection {connection_id} is gone, removing from table')
+            log.info('Connection is gone, removing from table', connectionId=connection_id)
             connections_table.delete_item(
                 Key={'connectionId': connection_id}
             )
         except Exception as send_error:
-            print(f'Error sending data to connection {connection_id}: {str(send_error)}')
+            log.error('Error sending current data', connectionId=connection_id, error=str(send_error))
             
     except Exception as error:
-        print(f'Error in send_current_data: {str(error)}')
+        log.error('Error in send_current_data', connectionId=connection_id, error=str(error))
         # エラーが発生してもWebSocket接続処理は続行
 
-# DynamoDB用のJSONエンコーダー（Decimalサポート）
+def handle_get_rollups(event):
+    """直近N分の時間窓ロールアップ取得リクエストの処理
+
+    windowSecondsは集計している時間窓のいずれか、minutesはROLLUP_MAX_MINUTESまでに制限する。
+    """
+    connection_id = event['requestContext']['connectionId']
+    
+    try:
+        body = json.loads(event.get('body') or '{}')
+        try:
+            window_seconds = int(body.get('windowSeconds', 60))
+            minutes = int(body.get('minutes', 10))
+        except (TypeError, ValueError):
+            window_seconds = minutes = None
+        
+        if window_seconds not in ROLLUP_WINDOW_SECONDS or minutes is None:
+            # 集計していない時間窓は、テーブルを読まずにエラーを返す
+            log.warning('Invalid rollup request', connectionId=connection_id, payload=body)
+            message = encode_message({
+                't': 'r',
+                'e': f"windowSeconds must be one of {', '.join(str(size) for size in ROLLUP_WINDOW_SECONDS)}"
+                     " and minutes must be an integer"
+            })
+        else:
+            minutes = min(max(minutes, 1), ROLLUP_MAX_MINUTES)
+            message = encode_message({
+                't': 'r',
+                'w': window_seconds,
+                'r': get_recent_rollups(window_seconds, minutes)
+            })
+        
+        with metrics.timer('ApiGatewayLatency'):
+            apigateway_client.post_to_connection(
+                ConnectionId=connection_id,
+                Data=message
+            )
+        log.debug('Rollups sent', connectionId=connection_id)
+        
+    except Exception as error:
+        log.error('Error sending rollups', connectionId=connection_id, error=str(error))
+
+def get_recent_rollups(window_seconds, minutes):
+    """商品ごとに直近N分の窓別件数をQueryで取得（テーブルはスキャンしない）"""
+    if rollup_table is None:
+        return {product: [] for product in PRODUCTS}
+    
+    since = int(time.time() - minutes * 60) // window_seconds * window_seconds
+    return {
+        product: [
+            [int(item['windowStart']), int(item.get('count', 0))]
+            for item in query_rollup_series(f'{product}#{window_seconds}', since)
+        ]
+        for product in PRODUCTS
+    }
+
+def query_rollup_series(series, since):
+    """1系列（商品#時間窓）のsince以降の窓をQueryで全件取得（1MBを超える分はページングで続きを読む）"""
+    query_kwargs = {
+        'KeyConditionExpression': Key('series').eq(series) & Key('windowStart').gte(since),
+        'ProjectionExpression': 'windowStart, #count',
+        'ExpressionAttributeNames': {'#count': 'count'}
+    }
+    while True:
+        with metrics.timer('DynamoDBLatency'):
+            response = rollup_table.query(**query_kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# Decimal型をJSONに変換するためのヘルパー
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
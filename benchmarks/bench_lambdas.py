@@ -0,0 +1,247 @@
+"""
+3つのLambda関数のホットパスをデプロイせずに計測するマイクロベンチマーク
+インメモリのDynamoDB / Kinesis / API Gatewayに対してlambda_handlerを直接呼び出し、
+レコード/秒・1レコードあたりのAWS呼び出し回数・ハンドラー処理時間のp50/p99を表示する。
+
+使い方:
+    python benchmarks/bench_lambdas.py --batch-sizes 1,10,100 --connections 10,1000 --latency-ms 5
+    python benchmarks/bench_lambdas.py --output baseline.json
+    python benchmarks/bench_lambdas.py --baseline baseline.json
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fakes import BACKEND_DIR, CallStats, FakeApiGateway, FakeDynamoDB, FakeKinesis, install_fakes, load_lambda
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'shared'))
+from record_format import encode_order, pack_orders
+
+# 合成データに使う都市（クリックストリーム生成スクリプトの一部）
+CITIES = [
+    {"name": "東京", "lat": 35.6762, "lng": 139.6503, "region": "関東"},
+    {"name": "大阪", "lat": 34.6937, "lng": 135.5023, "region": "関西"},
+    {"name": "名古屋", "lat": 35.1815, "lng": 136.9066, "region": "中部"},
+    {"name": "札幌", "lat": 43.0642, "lng": 141.3469, "region": "北海道"},
+    {"name": "福岡", "lat": 33.5904, "lng": 130.4017, "region": "九州"}
+]
+PRODUCTS = ["kinoko", "takenoko"]
+
+
+def make_order():
+    """合成の注文データを生成"""
+    return {
+        'orderId': f'order_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}',
+        'product': random.choice(PRODUCTS),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'userId': f'user_{random.randint(1, 100)}',
+        'location': random.choice(CITIES)
+    }
+
+
+def make_kinesis_event(batch_size, pack_size=1, compress=False):
+    """Lambdaのイベントソースマッピングが渡す形式のKinesisイベントを生成（pack_size > 1 の場合は複数注文をまとめたレコード）"""
+    now = time.time()
+    records = []
+    for index in range(batch_size):
+        if pack_size > 1:
+            data = pack_orders([encode_order(make_order()) for _ in range(pack_size)], compress)
+        else:
+            data = json.dumps(make_order()).encode('utf-8')
+        records.append({
+            'eventID': f'shardId-000000000000:{index:056d}',
+            'kinesis': {
+                'sequenceNumber': f'{index:056d}',
+                'data': base64.b64encode(data).decode('ascii'),
+                'approximateArrivalTimestamp': now
+            }
+        })
+    return {'Records': records}
+
+
+def percentile(values, ratio):
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(ratio * len(ordered) + 0.5)) - 1))]
+
+
+def measure(name, handler, make_event, records_per_event, stats, iterations, warmup):
+    """ハンドラーを繰り返し呼び出して処理時間と呼び出し回数を集計"""
+    durations = []
+    # メトリクス・ログの出力コストは含めたまま、表示だけを捨てる
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(warmup):
+            handler(make_event(), None)
+        stats.reset()
+
+        for _ in range(iterations):
+            event = make_event()
+            started = time.perf_counter()
+            handler(event, None)
+            durations.append((time.perf_counter() - started) * 1000)
+
+    records = records_per_event * iterations
+    return {
+        'name': name,
+        'recordsPerSecond': round(records / (sum(durations) / 1000), 1),
+        'callsPerRecord': round(stats.total() / records, 3),
+        'callsByOperation': {operation: round(count / records, 3) for operation, count in sorted(stats.calls.items())},
+        'p50Ms': round(statistics.median(durations), 3),
+        'p99Ms': round(percentile(durations, 0.99), 3)
+    }
+
+
+def bench_aggregator(module, batch_size, connections, args):
+    """Data Aggregator: バッチサイズ×接続数ごとの1呼び出しのコスト"""
+    stats = CallStats(args.latency, args.jitter)
+    dynamodb = FakeDynamoDB(stats)
+    install_fakes(module, dynamodb=dynamodb, apigateway=FakeApiGateway(stats))
+
+    for index in range(connections):
+        dynamodb.Table(module.CONNECTIONS_TABLE_NAME)._put({'connectionId': f'conn-{index}'})
+    module.connection_cache.update({'ids': set(), 'loaded_at': None})
+
+    name = f'data-aggregator batch={batch_size} connections={connections}'
+    if args.pack_size > 1:
+        name += f" pack={args.pack_size}{'z' if args.compress else ''}"
+    return measure(
+        name,
+        module.lambda_handler,
+        lambda: make_kinesis_event(batch_size, args.pack_size, args.compress),
+        batch_size * args.pack_size, stats, args.iterations, args.warmup
+    )
+
+
+def bench_order_processor(module, orders_per_request, args):
+    """Order Processor: 1注文、または複数注文（{"orders": [...]}）のAPIリクエスト"""
+    stats = CallStats(args.latency, args.jitter)
+    install_fakes(module, kinesis=FakeKinesis(stats, shard_count=args.shards))
+
+    def make_event():
+        orders = [make_order() for _ in range(orders_per_request)]
+        if orders_per_request == 1:
+            return {'body': json.dumps({'product': orders[0]['product'], 'location': orders[0]['location']})}
+        return {'body': json.dumps({'orders': [{'product': order['product'], 'location': order['location']}
+                                               for order in orders]})}
+
+    name = 'order-processor' if orders_per_request == 1 else f'order-processor orders={orders_per_request}'
+    return measure(name, module.lambda_handler, make_event, orders_per_request, stats, args.iterations, args.warmup)
+
+
+def bench_websocket_handler(module, route, args):
+    """WebSocket Handler: 接続時・データ再取得時の応答"""
+    stats = CallStats(args.latency, args.jitter)
+    dynamodb = FakeDynamoDB(stats)
+    install_fakes(module, dynamodb=dynamodb, apigateway=FakeApiGateway(stats))
+
+    aggregation_table = dynamodb.Table(module.AGGREGATION_TABLE_NAME)
+    aggregation_table._put({'product': module.LANES_KEY, 'lanes': {'0'}})
+    aggregation_table._put({'product': f'{module.LANE_KEY_PREFIX}0', 'version': 100,
+                            **{product: 1000 for product in PRODUCTS}})
+    for version in range(91, 101):
+        aggregation_table._put({'product': f'{module.DELTA_KEY_PREFIX}0#{version}', 'deltas': {'kinoko': 1}})
+    for city in CITIES:
+        dynamodb.Table(module.GEO_TABLE_NAME)._put({'level': 'city', 'name': city['name'], 'lat': city['lat'],
+                                                   'lng': city['lng'], 'region': city['region'], 'kinoko': 10})
+
+    def make_event():
+        context = {'routeKey': route, 'connectionId': f'conn-{uuid.uuid4().hex[:8]}'}
+        if route == '$connect':
+            return {'requestContext': context}
+        return {'requestContext': context, 'body': json.dumps({'sinceVersion': {'0': 95}})}
+
+    return measure(f'websocket-handler {route}', module.lambda_handler, make_event, 1, stats,
+                   args.iterations, args.warmup)
+
+
+def print_results(results, baseline=None):
+    """結果を表形式で表示（ベースラインがあれば処理時間・スループットの変化率も表示）"""
+    baseline_by_name = {result['name']: result for result in (baseline or [])}
+    print(f"{'scenario':<48} {'records/s':>11} {'calls/rec':>10} {'p50 ms':>9} {'p99 ms':>9}  change")
+    for result in results:
+        line = (f"{result['name']:<48} {result['recordsPerSecond']:>11} {result['callsPerRecord']:>10} "
+                f"{result['p50Ms']:>9} {result['p99Ms']:>9}")
+        previous = baseline_by_name.get(result['name'])
+        if previous:
+            throughput = (result['recordsPerSecond'] / previous['recordsPerSecond'] - 1) * 100
+            p99 = (result['p99Ms'] / previous['p99Ms'] - 1) * 100 if previous['p99Ms'] else 0
+            line += f"  throughput {throughput:+.1f}% / p99 {p99:+.1f}%"
+        print(line)
+        print('    ' + ', '.join(f'{operation}={count}' for operation, count in result['callsByOperation'].items()))
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lambda関数のオフラインベンチマーク')
+    parser.add_argument('--batch-sizes', type=parse_int_list, default=[1, 10, 100],
+                        help='Data Aggregatorに渡すKinesisバッチのサイズ（カンマ区切り）')
+    parser.add_argument('--connections', type=parse_int_list, default=[10, 1000],
+                        help='配信先のWebSocket接続数（カンマ区切り）')
+    parser.add_argument('--orders-per-request', type=parse_int_list, default=[1, 50],
+                        help='Order Processorの1リクエストあたりの注文数（カンマ区切り、1より大きい場合は {"orders": [...]}）')
+    parser.add_argument('--iterations', type=int, default=50, help='シナリオごとの計測回数')
+    parser.add_argument('--warmup', type=int, default=3, help='計測前のウォームアップ回数')
+    parser.add_argument('--pack-size', type=int, default=1,
+                        help='1レコードにまとめる注文数（1より大きい場合はパック形式、records/sはレコードではなく注文の数）')
+    parser.add_argument('--compress', action='store_true', help='パック形式のレコードをzlib圧縮')
+    parser.add_argument('--shards', type=int, default=1, help='Kinesisのシャード数')
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='全サービス共通の呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--dynamodb-latency-ms', type=float, help='DynamoDBの呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--kinesis-latency-ms', type=float, help='Kinesisの呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--apigateway-latency-ms', type=float, help='API Gatewayの呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='レイテンシの揺らぎ（0〜1の割合）')
+    parser.add_argument('--only', choices=['data-aggregator', 'order-processor', 'websocket-handler'],
+                        help='指定した関数だけを計測')
+    parser.add_argument('--output', help='結果をJSONで保存するファイル（ベースライン用）')
+    parser.add_argument('--baseline', help='比較するベースラインのJSONファイル')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    args.latency = {
+        'dynamodb': args.dynamodb_latency_ms if args.dynamodb_latency_ms is not None else args.latency_ms,
+        'kinesis': args.kinesis_latency_ms if args.kinesis_latency_ms is not None else args.latency_ms,
+        'apigateway': args.apigateway_latency_ms if args.apigateway_latency_ms is not None else args.latency_ms
+    }
+
+    results = []
+    if args.only in (None, 'data-aggregator'):
+        aggregator = load_lambda('data-aggregator')
+        for batch_size in args.batch_sizes:
+            for connections in args.connections:
+                results.append(bench_aggregator(aggregator, batch_size, connections, args))
+    if args.only in (None, 'order-processor'):
+        order_processor = load_lambda('order-processor')
+        for orders_per_request in args.orders_per_request:
+            results.append(bench_order_processor(order_processor, orders_per_request, args))
+    if args.only in (None, 'websocket-handler'):
+        websocket_handler = load_lambda('websocket-handler')
+        for route in ('$connect', 'getCurrentData'):
+            results.append(bench_websocket_handler(websocket_handler, route, args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({'args': vars(args), 'results': results}, output_file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,578 @@
+"""
+ベンチマーク・ローカル検証用のAWSサービスのインメモリ実装
+DynamoDB / Kinesis / API Gateway Management API の、Lambda関数が使う範囲だけを再現する。
+呼び出し回数を数え、設定したレイテンシを呼び出しごとに注入する。
+"""
+
+import hashlib
+import importlib.util
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_ROOT, 'backend')
+
+# Lambda関数の読み込みに必要な環境変数（実際のAWSには接続しない）
+DEFAULT_ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'ap-northeast-1',
+    'AWS_ACCESS_KEY_ID': 'local',
+    'AWS_SECRET_ACCESS_KEY': 'local',
+    'KINESIS_STREAM_NAME': 'kinoko-takenoko-stream',
+    'ORDERS_TABLE_NAME': 'orders',
+    'CONNECTIONS_TABLE_NAME': 'connections',
+    'AGGREGATION_TABLE_NAME': 'aggregation',
+    'ROLLUP_TABLE_NAME': 'rollups',
+    'GEO_TABLE_NAME': 'geo',
+    'WEBSOCKET_ENDPOINT': 'https://localhost/prod',
+    'LOG_LEVEL': 'WARNING'
+}
+
+# 各テーブルのキー属性（テーブル名の環境変数ごと）
+TABLE_KEYS = {
+    'ORDERS_TABLE_NAME': ('orderId',),
+    'CONNECTIONS_TABLE_NAME': ('connectionId',),
+    'AGGREGATION_TABLE_NAME': ('product',),
+    'ROLLUP_TABLE_NAME': ('series', 'windowStart'),
+    'GEO_TABLE_NAME': ('level', 'name')
+}
+
+# Lambdaモジュール内のテーブル変数と、テーブル名を持つ定数の対応
+TABLE_ATTRIBUTES = {
+    'connections_table': 'CONNECTIONS_TABLE_NAME',
+    'aggregation_table': 'AGGREGATION_TABLE_NAME',
+    'rollup_table': 'ROLLUP_TABLE_NAME',
+    'geo_table': 'GEO_TABLE_NAME'
+}
+
+
+def load_lambda(function_name, **environment):
+    """backend/<function_name>/lambda_function.py を独立したモジュールとして読み込む"""
+    for name, value in {**DEFAULT_ENVIRONMENT, **environment}.items():
+        os.environ.setdefault(name, str(value))
+
+    shared_dir = os.path.join(BACKEND_DIR, 'shared')
+    if shared_dir not in sys.path:
+        sys.path.insert(0, shared_dir)
+
+    path = os.path.join(BACKEND_DIR, function_name, 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location(function_name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_fakes(module, dynamodb=None, kinesis=None, apigateway=None):
+    """読み込んだLambdaモジュールのAWSクライアント・テーブルをインメモリ実装に差し替え"""
+    if dynamodb is not None:
+        module.dynamodb = dynamodb
+        for attribute, table_name in TABLE_ATTRIBUTES.items():
+            if getattr(module, attribute, None) is not None:
+                setattr(module, attribute, dynamodb.Table(getattr(module, table_name)))
+    if kinesis is not None and hasattr(module, 'kinesis'):
+        module.kinesis = kinesis
+    if apigateway is not None and hasattr(module, 'apigateway_client'):
+        module.apigateway_client = apigateway
+    return module
+
+
+class CallStats:
+    """サービス呼び出しの回数を数え、レイテンシを注入"""
+
+    def __init__(self, latency_ms=None, jitter=0.0):
+        # {'dynamodb': 5, 'kinesis': 10, 'apigateway': 20} のようにサービスごとに指定（ミリ秒）
+        self.latency_ms = latency_ms or {}
+        self.jitter = jitter
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def call(self, service, operation):
+        with self._lock:
+            self.calls[f'{service}.{operation}'] += 1
+        latency = self.latency_ms.get(service, 0)
+        if latency:
+            time.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter) / 1000)
+
+    def total(self, service=None):
+        with self._lock:
+            return sum(
+                count for name, count in self.calls.items()
+                if service is None or name.startswith(f'{service}.')
+            )
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+# --- DynamoDB ---------------------------------------------------------------
+
+def split_top_level(text):
+    """括弧の外側にあるカンマで分割"""
+    parts, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def evaluate_condition(condition, item):
+    """boto3.dynamodb.conditions の Key 条件を評価（Queryで使う範囲）"""
+    operator = condition.expression_operator
+    values = condition.get_expression()['values']
+    if operator == 'AND':
+        return evaluate_condition(values[0], item) and evaluate_condition(values[1], item)
+
+    actual = item.get(values[0].name)
+    if actual is None:
+        return False
+    if operator == 'BETWEEN':
+        return values[1] <= actual <= values[2]
+    if operator == 'begins_with':
+        return str(actual).startswith(values[1])
+    return {
+        '=': actual == values[1],
+        '<': actual < values[1],
+        '<=': actual <= values[1],
+        '>': actual > values[1],
+        '>=': actual >= values[1]
+    }[operator]
+
+
+def to_decimal(value):
+    """DynamoDBと同様に数値をDecimalとして保存"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+        return value
+    return Decimal(str(value))
+
+
+class FakeTable:
+    """DynamoDB Table リソースのインメモリ実装"""
+
+    def __init__(self, name, key_names, stats, page_size=1000):
+        self.name = name
+        self.key_names = key_names
+        self.stats = stats
+        self.page_size = page_size
+        self.items = {}
+        self._lock = threading.RLock()
+
+    def _key(self, key):
+        return tuple(to_decimal(key[name]) for name in self.key_names)
+
+    def get_item(self, Key, **kwargs):
+        self.stats.call('dynamodb', 'GetItem')
+        with self._lock:
+            item = self.items.get(self._key(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item, **kwargs):
+        self.stats.call('dynamodb', 'PutItem')
+        self._put(Item)
+        return {}
+
+    def _put(self, item):
+        with self._lock:
+            self.items[self._key(item)] = {name: to_decimal(value) for name, value in item.items()}
+
+    def delete_item(self, Key, **kwargs):
+        self.stats.call('dynamodb', 'DeleteItem')
+        self._delete(Key)
+        return {}
+
+    def _delete(self, key):
+        with self._lock:
+            self.items.pop(self._key(key), None)
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        self.stats.call('dynamodb', 'UpdateItem')
+        attributes = self.apply_update(Key, UpdateExpression, ExpressionAttributeNames or {},
+                                       ExpressionAttributeValues or {})
+        return {'Attributes': attributes} if ReturnValues != 'NONE' else {}
+
+    def apply_update(self, key, expression, names, values):
+        """ADD / SET（if_not_exists対応）の更新式を適用し、更新した属性を返す"""
+        def attribute(path):
+            return names.get(path, path)
+
+        def value_of(token, item):
+            match = re.fullmatch(r'if_not_exists\((.+),\s*(.+)\)', token)
+            if match:
+                current = item.get(attribute(match.group(1).strip()))
+                return current if current is not None else to_decimal(values[match.group(2).strip()])
+            return to_decimal(values[token])
+
+        updated = {}
+        with self._lock:
+            item = self.items.setdefault(self._key(key), {name: to_decimal(key[name]) for name in self.key_names})
+            for action, body in re.findall(r'(ADD|SET)\s+(.+?)(?=\s+(?:ADD|SET)\s+|$)', expression):
+                for clause in split_top_level(body):
+                    if action == 'ADD':
+                        path, token = clause.split()
+                        name = attribute(path)
+                        if isinstance(values[token], set):
+                            item[name] = item.get(name, set()) | values[token]
+                        else:
+                            item[name] = item.get(name, Decimal(0)) + to_decimal(values[token])
+                    else:
+                        path, token = (part.strip() for part in clause.split('=', 1))
+                        name = attribute(path)
+                        item[name] = value_of(token, item)
+                    updated[name] = item[name]
+        return updated
+
+    def scan(self, ExclusiveStartKey=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self.stats.call('dynamodb', 'Scan')
+        with self._lock:
+            keys = sorted(self.items, key=str)
+            start = keys.index(self._key(ExclusiveStartKey)) + 1 if ExclusiveStartKey else 0
+            page = [dict(self.items[key]) for key in keys[start:start + self.page_size]]
+
+        if ProjectionExpression:
+            projected = [
+                (ExpressionAttributeNames or {}).get(name.strip(), name.strip())
+                for name in ProjectionExpression.split(',')
+            ]
+            page = [{name: item[name] for name in projected if name in item} for item in page]
+
+        response = {'Items': page, 'Count': len(page)}
+        if start + self.page_size < len(keys):
+            response['LastEvaluatedKey'] = {name: keys[start + self.page_size - 1][index]
+                                            for index, name in enumerate(self.key_names)}
+        return response
+
+    def query(self, KeyConditionExpression, ExclusiveStartKey=None, ProjectionExpression=None,
+              ExpressionAttributeNames=None, **kwargs):
+        self.stats.call('dynamodb', 'Query')
+        with self._lock:
+            items = [dict(item) for item in self.items.values() if evaluate_condition(KeyConditionExpression, item)]
+        if len(self.key_names) > 1:
+            items.sort(key=lambda item: item[self.key_names[1]])
+        keys = [self._key(item) for item in items]
+        start = keys.index(self._key(ExclusiveStartKey)) + 1 if ExclusiveStartKey else 0
+        page = items[start:start + self.page_size]
+
+        response_key = None
+        if start + self.page_size < len(items):
+            response_key = {name: page[-1][name] for name in self.key_names}
+        if ProjectionExpression:
+            projected = [
+                (ExpressionAttributeNames or {}).get(name.strip(), name.strip())
+                for name in ProjectionExpression.split(',')
+            ]
+            page = [{name: item[name] for name in projected if name in item} for item in page]
+
+        response = {'Items': page, 'Count': len(page)}
+        if response_key:
+            response['LastEvaluatedKey'] = response_key
+        return response
+
+    def batch_writer(self, **kwargs):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    """batch_writer() のインメモリ実装（25件ごとに1回のBatchWriteItemとして数える）"""
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def put_item(self, Item):
+        self.table._put(Item)
+        self._count()
+
+    def delete_item(self, Key):
+        self.table._delete(Key)
+        self._count()
+
+    def _count(self):
+        self.pending += 1
+        if self.pending == 25:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.table.stats.call('dynamodb', 'BatchWriteItem')
+            self.pending = 0
+
+
+class FakeDynamoDBClient:
+    """低レベルクライアントのうち TransactWriteItems だけを再現"""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.deserializer = TypeDeserializer()
+        self.serializer = TypeSerializer()
+
+    def transact_write_items(self, TransactItems):
+        self.resource.stats.call('dynamodb', 'TransactWriteItems')
+        with self.resource.lock:
+            # 条件チェックを先にすべて評価し、1件でも失敗したら何も書き込まない
+            reasons = []
+            for transact_item in TransactItems:
+                put = transact_item.get('Put')
+                update = transact_item.get('Update')
+                if put and put.get('ConditionExpression', '').startswith('attribute_not_exists'):
+                    table = self.resource.Table(put['TableName'])
+                    item = self._deserialize(put['Item'])
+                    exists = table._key(item) in table.items
+                    reasons.append({'Code': 'ConditionalCheckFailed' if exists else 'None'})
+                elif update and update.get('ConditionExpression'):
+                    reasons.append(self._check_update(update))
+                else:
+                    reasons.append({'Code': 'None'})
+
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise ClientError({
+                    'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                    'CancellationReasons': reasons
+                }, 'TransactWriteItems')
+
+            for transact_item in TransactItems:
+                if 'Put' in transact_item:
+                    put = transact_item['Put']
+                    self.resource.Table(put['TableName'])._put(self._deserialize(put['Item']))
+                elif 'Update' in transact_item:
+                    update = transact_item['Update']
+                    self.resource.Table(update['TableName']).apply_update(
+                        self._deserialize(update['Key']),
+                        update['UpdateExpression'],
+                        update.get('ExpressionAttributeNames', {}),
+                        self._deserialize(update.get('ExpressionAttributeValues', {}))
+                    )
+        return {}
+
+    def _check_update(self, update):
+        """Updateの条件（attribute_not_exists(属性) / 属性 = :値）を評価"""
+        table = self.resource.Table(update['TableName'])
+        item = table.items.get(table._key(self._deserialize(update['Key'])))
+        names = update.get('ExpressionAttributeNames', {})
+        values = self._deserialize(update.get('ExpressionAttributeValues', {}))
+        condition = update['ConditionExpression']
+        match = re.fullmatch(r'attribute_not_exists\((.+)\)', condition)
+        if match:
+            passed = item is None or names.get(match.group(1), match.group(1)) not in item
+        else:
+            path, token = (part.strip() for part in condition.split('=', 1))
+            passed = item is not None and item.get(names.get(path, path)) == to_decimal(values[token])
+        if passed:
+            return {'Code': 'None'}
+        reason = {'Code': 'ConditionalCheckFailed'}
+        if item is not None and update.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD':
+            reason['Item'] = {name: self.serializer.serialize(value) for name, value in item.items()}
+        return reason
+
+    def _deserialize(self, attributes):
+        return {name: self.deserializer.deserialize(value) for name, value in attributes.items()}
+
+
+class FakeMeta:
+    def __init__(self, client):
+        self.client = client
+
+
+class FakeDynamoDB:
+    """boto3.resource('dynamodb') のインメモリ実装"""
+
+    def __init__(self, stats, table_keys=None, page_size=1000):
+        self.stats = stats
+        self.table_keys = {
+            os.environ.get(variable, DEFAULT_ENVIRONMENT[variable]): keys for variable, keys in TABLE_KEYS.items()
+        }
+        self.table_keys.update(table_keys or {})
+        self.page_size = page_size
+        self.tables = {}
+        self.lock = threading.RLock()
+        self.meta = FakeMeta(FakeDynamoDBClient(self))
+
+    def Table(self, name):
+        with self.lock:
+            if name not in self.tables:
+                self.tables[name] = FakeTable(name, self.table_keys.get(name, ('id',)), self.stats, self.page_size)
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        self.stats.call('dynamodb', 'BatchGetItem')
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            with table._lock:
+                responses[table_name] = [
+                    dict(table.items[table._key(key)]) for key in request['Keys'] if table._key(key) in table.items
+                ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+# --- Kinesis ----------------------------------------------------------------
+
+class FakeKinesis:
+    """Kinesis Data Streams クライアントのインメモリ実装（パーティションキーのMD5またはExplicitHashKeyでシャードに振り分け）"""
+
+    def __init__(self, stats, shard_count=1, on_put=None, throttle_rate=0.0):
+        self.stats = stats
+        self.shard_count = shard_count
+        self.shards = [[] for _ in range(shard_count)]
+        self.on_put = on_put
+        # PutRecordsで各レコードがスロットリングされる確率（再送の検証用）
+        self.throttle_rate = throttle_rate
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def shard_for(self, partition_key, explicit_hash_key=None):
+        if explicit_hash_key is not None:
+            hash_key = int(explicit_hash_key)
+        else:
+            hash_key = int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+        return hash_key * self.shard_count >> 128
+
+    def _append(self, data, partition_key, explicit_hash_key=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        shard = self.shard_for(partition_key, explicit_hash_key)
+        with self._lock:
+            self._sequence += 1
+            record = {
+                'shardId': f'shardId-{shard:012d}',
+                'sequenceNumber': f'{self._sequence:056d}',
+                'partitionKey': partition_key,
+                'data': data,
+                'approximateArrivalTimestamp': time.time()
+            }
+            self.shards[shard].append(record)
+        if self.on_put:
+            self.on_put(shard, record)
+        return record
+
+    def put_record(self, StreamName, Data, PartitionKey, ExplicitHashKey=None, **kwargs):
+        self.stats.call('kinesis', 'PutRecord')
+        record = self._append(Data, PartitionKey, ExplicitHashKey)
+        return {'ShardId': record['shardId'], 'SequenceNumber': record['sequenceNumber']}
+
+    def put_records(self, Records, StreamName, **kwargs):
+        self.stats.call('kinesis', 'PutRecords')
+        results = []
+        for entry in Records:
+            if self.throttle_rate and random.random() < self.throttle_rate:
+                results.append({
+                    'ErrorCode': 'ProvisionedThroughputExceededException',
+                    'ErrorMessage': 'Rate exceeded for shard'
+                })
+                continue
+            record = self._append(entry['Data'], entry['PartitionKey'], entry.get('ExplicitHashKey'))
+            results.append({'ShardId': record['shardId'], 'SequenceNumber': record['sequenceNumber']})
+        failed = sum(1 for result in results if 'ErrorCode' in result)
+        return {'FailedRecordCount': failed, 'Records': results}
+
+    def list_shards(self, StreamName=None, **kwargs):
+        self.stats.call('kinesis', 'ListShards')
+        # ハッシュキーの範囲はシャード数で均等に分割（shard_forと同じ分け方）
+        return {'Shards': [
+            {
+                'ShardId': f'shardId-{shard:012d}',
+                'HashKeyRange': {
+                    'StartingHashKey': str((shard << 128) // self.shard_count),
+                    'EndingHashKey': str(((shard + 1) << 128) // self.shard_count - 1)
+                }
+            }
+            for shard in range(self.shard_count)
+        ]}
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None, **kwargs):
+        """イテレーターは「シャード番号:読み出し位置」の文字列で表す"""
+        self.stats.call('kinesis', 'GetShardIterator')
+        shard = int(ShardId.rsplit('-', 1)[1])
+        with self._lock:
+            records = list(self.shards[shard])
+        if ShardIteratorType == 'TRIM_HORIZON':
+            position = 0
+        elif ShardIteratorType == 'LATEST':
+            position = len(records)
+        else:
+            sequence_numbers = [record['sequenceNumber'] for record in records]
+            position = sequence_numbers.index(StartingSequenceNumber)
+            if ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+                position += 1
+        return {'ShardIterator': f'{shard}:{position}'}
+
+    def get_records(self, ShardIterator, Limit=10000, **kwargs):
+        self.stats.call('kinesis', 'GetRecords')
+        shard, position = (int(part) for part in ShardIterator.split(':'))
+        with self._lock:
+            records = self.shards[shard][position:position + Limit]
+            latest = self.shards[shard][-1] if self.shards[shard] else None
+        behind = 0
+        if records and latest is not records[-1]:
+            behind = max(1, int((latest['approximateArrivalTimestamp'] - records[-1]['approximateArrivalTimestamp']) * 1000))
+        return {
+            'Records': [
+                {
+                    'SequenceNumber': record['sequenceNumber'],
+                    'PartitionKey': record['partitionKey'],
+                    'Data': record['data'],
+                    'ApproximateArrivalTimestamp': datetime.fromtimestamp(record['approximateArrivalTimestamp'], timezone.utc)
+                }
+                for record in records
+            ],
+            'NextShardIterator': f'{shard}:{position + len(records)}',
+            'MillisBehindLatest': behind
+        }
+
+
+# --- API Gateway Management API --------------------------------------------
+
+class GoneException(Exception):
+    """切断済みの接続への送信"""
+
+
+class FakeApiGatewayExceptions:
+    GoneException = GoneException
+
+
+class FakeApiGateway:
+    """apigatewaymanagementapi クライアントのインメモリ実装"""
+
+    exceptions = FakeApiGatewayExceptions
+
+    def __init__(self, stats, gone_ids=None, on_message=None):
+        self.stats = stats
+        self.gone_ids = set(gone_ids or ())
+        self.on_message = on_message
+        self.messages = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.stats.call('apigateway', 'PostToConnection')
+        if ConnectionId in self.gone_ids:
+            raise GoneException(ConnectionId)
+        size = len(Data.encode('utf-8') if isinstance(Data, str) else Data)
+        with self._lock:
+            self.messages += 1
+            self.bytes_sent += size
+        if self.on_message:
+            self.on_message(ConnectionId, Data)
+        return {}
@@ -0,0 +1,460 @@
+"""
+注文から画面更新までのパイプラインを1プロセスで再現する負荷試験ハーネス
+クリックストリーム生成スクリプトの注文データ → Order Processor → インメモリのシャード付きストリーム
+→（イベントソースマッピングのバッチ化）→ Data Aggregator → 模擬WebSocketクライアント
+の順に実際のハンドラーを呼び出し、クリックからクライアント到達までのレイテンシと持続可能なスループットを表示する。
+
+イベントソースマッピングの BatchSize / MaximumBatchingWindowInSeconds とシャード数は
+infrastructure/cloudformation.yaml から読み込む（引数で上書き可能）。
+
+使い方:
+    python benchmarks/pipeline_emulator.py --rates 5,20,50 --duration 30 --clients 500
+    python benchmarks/pipeline_emulator.py --rates 100 --batching-window 0 --latency-ms 5
+    python benchmarks/pipeline_emulator.py --rates 100 --shards 4 --consumer --consumer-workers 2
+    python benchmarks/pipeline_emulator.py --rates 200 --shards 4 --partition product
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+
+from bench_lambdas import percentile
+from fakes import REPO_ROOT, CallStats, FakeApiGateway, FakeDynamoDB, FakeKinesis, install_fakes, load_lambda
+
+# クリックストリーム生成スクリプトの注文データ（地方都市重視版の都市と重み）
+sys.path.insert(0, REPO_ROOT)
+from clickstream.cities import REGIONAL_CITIES, REGIONAL_REGION_WEIGHTS
+from clickstream.synthesis import OrderSynthesizer
+
+# Order Processorと共通のパーティションキーの決め方
+sys.path.insert(0, os.path.join(REPO_ROOT, 'backend', 'shared'))
+from partitioning import PARTITION_STRATEGY, STRATEGIES
+
+CLOUDFORMATION_PATH = os.path.join(REPO_ROOT, 'infrastructure', 'cloudformation.yaml')
+CONSUMER_DIR = os.path.join(REPO_ROOT, 'backend', 'stream-consumer')
+
+# Lambdaのイベントソースマッピングは、レコードがない間はシャードを1秒ごとにポーリングする
+DEFAULT_POLL_INTERVAL = 1.0
+
+# 送信停止後、ポーリング間隔に加えて送信時間のこの割合以内に処理しきれたレートを持続可能とみなす
+SUSTAINABLE_DRAIN_FRACTION = 0.1
+
+
+def read_stream_settings(path=CLOUDFORMATION_PATH):
+    """CloudFormationテンプレートからバッチ設定とシャード数を読み込む"""
+    with open(path, encoding='utf-8') as template_file:
+        template = template_file.read()
+
+    def find(name, default):
+        match = re.search(rf'^\s+{name}:\s*(\d+)\s*$', template, re.MULTILINE)
+        return int(match.group(1)) if match else default
+
+    return {
+        'batch_size': find('BatchSize', 100),
+        'batching_window': find('MaximumBatchingWindowInSeconds', 0),
+        'shards': find('ShardCount', 1)
+    }
+
+
+def load_generator():
+    """クリックストリーム生成スクリプトと同じ注文データの生成元"""
+    return OrderSynthesizer(REGIONAL_CITIES, REGIONAL_REGION_WEIGHTS)
+
+
+class LatencyTracker:
+    """注文ごとのクリック時刻と、クライアントへの到達時刻を記録"""
+
+    def __init__(self):
+        self.clicked_at = {}
+        self.lane_orders = {}
+        self.latencies = []
+        self.delivered_orders = set()
+        self.client_versions = {}
+        self.out_of_order = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def clicked(self, order_id, clicked_at):
+        with self._lock:
+            self.clicked_at[order_id] = clicked_at
+
+    def committed(self, commits):
+        # レーンのバージョンは注文と同じトランザクションで採番済み
+        with self._lock:
+            for commit in commits:
+                self.lane_orders[(commit['lane'], commit['version'])] = [
+                    order_data['orderId'] for order_data in commit['orders']
+                ]
+
+    def delivered(self, connection_id, data):
+        delivered_at = time.perf_counter()
+        message = json.loads(data)
+        if message.get('t') != 'd':
+            return
+
+        with self._lock:
+            self.messages += 1
+            # バージョンはレーンごとの連番
+            lane = (connection_id, message['l'])
+            last_version = self.client_versions.get(lane)
+            if last_version is not None and message['v'] != last_version + 1:
+                self.out_of_order += 1
+            self.client_versions[lane] = max(message['v'], last_version or 0)
+
+            for order_id in self.lane_orders.get((message['l'], message['v']), []):
+                clicked_at = self.clicked_at.get(order_id)
+                if clicked_at is not None:
+                    self.latencies.append((delivered_at - clicked_at) * 1000)
+                    self.delivered_orders.add(order_id)
+
+
+class ShardPoller(threading.Thread):
+    """1シャード分のイベントソースマッピング（同時実行1、BatchSize件またはバッチウィンドウ経過で起動）"""
+
+    def __init__(self, shard, kinesis, handler, batch_size, batching_window, poll_interval):
+        super().__init__(daemon=True)
+        self.shard = shard
+        self.kinesis = kinesis
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batching_window = batching_window
+        self.poll_interval = poll_interval
+        self.position = 0
+        self.invocations = 0
+        self.processed = 0
+        self.retried = 0
+        self.max_backlog = 0
+        self.busy_seconds = 0.0
+        self.stopping = threading.Event()
+
+    def backlog(self):
+        return len(self.kinesis.shards[self.shard]) - self.position
+
+    def run(self):
+        records = self.kinesis.shards[self.shard]
+        while not (self.stopping.is_set() and self.backlog() == 0):
+            if self.backlog() == 0:
+                time.sleep(self.poll_interval)
+                continue
+
+            # バッチウィンドウの間、BatchSize件に達するまでレコードを待つ
+            window_ends = time.monotonic() + self.batching_window
+            while self.backlog() < self.batch_size and time.monotonic() < window_ends and not self.stopping.is_set():
+                time.sleep(min(0.01, self.batching_window))
+
+            self.max_backlog = max(self.max_backlog, self.backlog())
+            batch = records[self.position:self.position + self.batch_size]
+            event = {
+                'Records': [
+                    {
+                        'eventID': f"shardId-{self.shard:012d}:{record['sequenceNumber']}",
+                        'kinesis': {
+                            'sequenceNumber': record['sequenceNumber'],
+                            'partitionKey': record['partitionKey'],
+                            'data': base64.b64encode(record['data']).decode('ascii'),
+                            'approximateArrivalTimestamp': record['approximateArrivalTimestamp']
+                        }
+                    }
+                    for record in batch
+                ]
+            }
+
+            started = time.perf_counter()
+            try:
+                response = self.handler(event, None) or {}
+                failures = response.get('batchItemFailures', [])
+            except Exception:
+                # 関数エラーの場合はバッチ全体を再試行
+                failures = [{'itemIdentifier': batch[0]['sequenceNumber']}]
+            self.busy_seconds += time.perf_counter() - started
+            self.invocations += 1
+
+            # 部分的な失敗は最初に失敗したシーケンス番号から再試行
+            sequence_numbers = [record['sequenceNumber'] for record in batch]
+            failed_indexes = [
+                sequence_numbers.index(failure['itemIdentifier'])
+                for failure in failures if failure['itemIdentifier'] in sequence_numbers
+            ]
+            advanced = min(failed_indexes) if failed_indexes else len(batch)
+            self.retried += len(batch) - advanced
+            self.position += advanced
+            self.processed += advanced
+
+
+class ConsumerGroup:
+    """常駐コンシューマー（backend/stream-consumer）を複数プロセス分起動し、ShardPollerと同じ形で集計値を持つ"""
+
+    def __init__(self, kinesis, process_records, workers):
+        if CONSUMER_DIR not in sys.path:
+            sys.path.insert(0, CONSUMER_DIR)
+        import checkpoints
+        import consumer
+
+        # ローカルのストリームは起動前に書き込まれたレコードも読む。再配分は短い間隔で行う
+        consumer.INITIAL_POSITION = 'TRIM_HORIZON'
+        consumer.REBALANCE_INTERVAL_SECONDS = 1.0
+
+        self.kinesis = kinesis
+        self.store = checkpoints.MemoryCheckpointStore()
+        self.invocations = 0
+        self.processed = 0
+        self.retried = 0
+        self.max_backlog = 0
+        self.busy_seconds = 0.0
+        self.stopping = threading.Event()
+        self._stop_consumers = threading.Event()
+        self._lock = threading.Lock()
+
+        def traced_process_records(records):
+            self.max_backlog = max(self.max_backlog, self.backlog())
+            started = time.perf_counter()
+            failed = process_records(records)
+            with self._lock:
+                self.busy_seconds += time.perf_counter() - started
+                self.invocations += 1
+                self.processed += len(records) - len(failed)
+                self.retried += len(failed)
+            return failed
+
+        # 同じチェックポイントストアを共有するワーカーを、別々のプロセスとして振る舞わせる
+        self.threads = [
+            threading.Thread(
+                target=consumer.StreamConsumer(kinesis, 'local', traced_process_records, self.store,
+                                               f'consumer-{index}').run,
+                args=(self._stop_consumers,),
+                daemon=True
+            )
+            for index in range(workers)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def backlog(self):
+        """チェックポイントより後ろに残っているレコード数"""
+        leases = self.store.list_leases()
+        remaining = 0
+        for shard, records in enumerate(self.kinesis.shards):
+            checkpoint = leases.get(f'shardId-{shard:012d}', {}).get('checkpoint') or ''
+            remaining += sum(1 for record in records if record['sequenceNumber'] > checkpoint)
+        return remaining
+
+    def join(self, timeout):
+        """滞留がなくなるまで待ってからワーカーを止める"""
+        deadline = time.monotonic() + timeout
+        while self.backlog() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self._stop_consumers.set()
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def is_alive(self):
+        return self.backlog() > 0 or any(thread.is_alive() for thread in self.threads)
+
+
+def wait_for_drain(pollers, timeout):
+    """送信停止から滞留がなくなるまでの秒数（timeout内に処理しきれなければNone）"""
+    started = time.perf_counter()
+    while sum(poller.backlog() for poller in pollers):
+        if time.perf_counter() - started >= timeout:
+            return None
+        time.sleep(0.01)
+    return time.perf_counter() - started
+
+
+def produce(order_processor, generator, tracker, rate, duration, producer_index, producers):
+    """一定間隔で注文データを生成し、Order Processorに送信（遅れた分は詰めて送る）"""
+    interval = producers / rate
+    started = time.perf_counter() + producer_index * (interval / producers)
+    sent = 0
+    while True:
+        scheduled = started + sent * interval
+        if scheduled - started >= duration:
+            return
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        order_data = generator.make_orders(1)[0]
+        body = {'product': order_data['product'], 'timestamp': order_data['timestamp'], 'location': order_data['location']}
+        clicked_at = time.perf_counter()
+        response = order_processor.lambda_handler({'body': json.dumps(body), 'requestContext': {}}, None)
+        if response['statusCode'] == 200:
+            tracker.clicked(json.loads(response['body'])['orderId'], clicked_at)
+        sent += 1
+
+
+def run_step(rate, settings, args, generator):
+    """1つの注文レートでパイプライン全体を実行して結果を集計"""
+    stats = CallStats(args.latency, args.jitter)
+    tracker = LatencyTracker()
+    dynamodb = FakeDynamoDB(stats)
+    kinesis = FakeKinesis(stats, shard_count=settings['shards'])
+    apigateway = FakeApiGateway(stats, on_message=tracker.delivered)
+
+    order_processor = install_fakes(load_lambda('order-processor'), kinesis=kinesis)
+    order_processor.partitioner = order_processor.Partitioner.for_stream(kinesis, order_processor.STREAM_NAME,
+                                                                         args.partition)
+    aggregator = install_fakes(load_lambda('data-aggregator'), dynamodb=dynamodb, apigateway=apigateway)
+    for index in range(args.clients):
+        dynamodb.Table(aggregator.CONNECTIONS_TABLE_NAME)._put({'connectionId': f'client-{index}'})
+
+    # 配信メッセージのバージョンと、そこに含まれる注文を対応付ける
+    notify_clients = aggregator.notify_clients
+
+    def traced_notify_clients(commits):
+        tracker.committed(commits)
+        return notify_clients(commits)
+
+    aggregator.notify_clients = traced_notify_clients
+
+    if args.consumer:
+        pollers = [ConsumerGroup(kinesis, aggregator.process_records, args.consumer_workers)]
+    else:
+        pollers = [
+            ShardPoller(shard, kinesis, aggregator.lambda_handler, settings['batch_size'],
+                        settings['batching_window'], args.poll_interval)
+            for shard in range(settings['shards'])
+        ]
+    producers = [
+        threading.Thread(target=produce, args=(order_processor, generator, tracker, rate, args.duration, index, args.producers),
+                         daemon=True)
+        for index in range(args.producers)
+    ]
+
+    started = time.perf_counter()
+    for thread in pollers + producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+    produced_seconds = time.perf_counter() - started
+    backlog_at_end = sum(poller.backlog() for poller in pollers)
+
+    # 送信を止めた後、残りのレコードを処理しきるまでの時間を計る（停止後はバッチウィンドウを待たずに呼び出す）
+    for poller in pollers:
+        poller.stopping.set()
+    drain_seconds = wait_for_drain(pollers, args.drain_timeout)
+    for poller in pollers:
+        poller.join(args.drain_timeout)
+    drained = all(not poller.is_alive() for poller in pollers)
+    elapsed = time.perf_counter() - started
+
+    clicked = len(tracker.clicked_at)
+    latencies = sorted(tracker.latencies) or [0.0]
+    invocations = sum(poller.invocations for poller in pollers)
+    processed = sum(poller.processed for poller in pollers)
+    busy_seconds = sum(poller.busy_seconds for poller in pollers)
+    # 停止時点の滞留はポーリングの周期で0〜レート×ポーリング間隔の間を揺れるため、判定には使わない。
+    # 送信中に溜まった分を、ポーリング間隔＋送信時間のSUSTAINABLE_DRAIN_FRACTION以内に処理しきれたかで判定する
+    drain_allowance = args.poll_interval + SUSTAINABLE_DRAIN_FRACTION * args.duration
+    sustainable = drained and drain_seconds is not None and drain_seconds <= drain_allowance
+
+    return {
+        'rate': rate,
+        'clicked': clicked,
+        'ingestRate': round(clicked / produced_seconds, 1),
+        'processed': processed,
+        'processRate': round(processed / elapsed, 1),
+        'capacityRate': round(processed / busy_seconds, 1) if busy_seconds else 0.0,
+        'invocations': invocations,
+        'meanBatchSize': round(processed / invocations, 2) if invocations else 0.0,
+        'retriedRecords': sum(poller.retried for poller in pollers),
+        'maxBacklog': max(poller.max_backlog for poller in pollers),
+        'backlogAtEnd': backlog_at_end,
+        'drainSeconds': round(drain_seconds, 2) if drain_seconds is not None else None,
+        'recordsPerShard': [len(records) for records in kinesis.shards],
+        'delivered': len(tracker.delivered_orders),
+        'messages': tracker.messages,
+        'outOfOrder': tracker.out_of_order,
+        'bytesSent': apigateway.bytes_sent,
+        'p50Ms': round(statistics.median(latencies), 1),
+        'p90Ms': round(percentile(latencies, 0.90), 1),
+        'p99Ms': round(percentile(latencies, 0.99), 1),
+        'maxMs': round(latencies[-1], 1),
+        'sustainable': sustainable
+    }
+
+
+def print_results(settings, args, results):
+    mode = f"consumer workers={args.consumer_workers}" if args.consumer else 'event source mapping'
+    print(f"{mode} shards={settings['shards']} partition={args.partition} BatchSize={settings['batch_size']} "
+          f"MaximumBatchingWindowInSeconds={settings['batching_window']} clients={args.clients} "
+          f"latency={args.latency}")
+    print(f"{'rate':>7} {'ingest/s':>9} {'process/s':>10} {'capacity/s':>11} {'batch':>6} {'backlog':>8} "
+          f"{'drain s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'delivered':>10}  sustainable")
+    for result in results:
+        print(f"{result['rate']:>7} {result['ingestRate']:>9} {result['processRate']:>10} {result['capacityRate']:>11} "
+              f"{result['meanBatchSize']:>6} {result['maxBacklog']:>8} "
+              f"{result['drainSeconds'] if result['drainSeconds'] is not None else '-':>8} {result['p50Ms']:>8} {result['p90Ms']:>8} "
+              f"{result['p99Ms']:>8} {result['maxMs']:>8} {result['delivered']:>5}/{result['clicked']:<4}  "
+              f"{'yes' if result['sustainable'] else 'NO'}")
+
+
+def parse_float_list(value):
+    return [float(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    settings = read_stream_settings()
+
+    parser = argparse.ArgumentParser(description='注文から画面更新までのパイプラインのローカル負荷試験')
+    parser.add_argument('--rates', type=parse_float_list, default=[5.0, 20.0, 50.0],
+                        help='試行する注文レート（件/秒、カンマ区切り）')
+    parser.add_argument('--duration', type=float, default=20.0, help='レートごとの送信時間（秒）')
+    parser.add_argument('--clients', type=int, default=100, help='模擬WebSocketクライアント数')
+    parser.add_argument('--producers', type=int, default=4, help='Order Processorを呼び出す並列数')
+    parser.add_argument('--shards', type=int, default=settings['shards'], help='シャード数（デフォルト: テンプレートの値）')
+    parser.add_argument('--partition', choices=STRATEGIES, default=PARTITION_STRATEGY,
+                        help='Order Processorのパーティションキーの決め方（デフォルト: 環境変数 PARTITION_STRATEGY）')
+    parser.add_argument('--batch-size', type=int, default=settings['batch_size'],
+                        help='BatchSize（デフォルト: テンプレートの値）')
+    parser.add_argument('--batching-window', type=float, default=settings['batching_window'],
+                        help='MaximumBatchingWindowInSeconds（デフォルト: テンプレートの値）')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='レコードがないときのシャードのポーリング間隔（秒）')
+    parser.add_argument('--consumer', action='store_true',
+                        help='イベントソースマッピングの代わりに常駐コンシューマー（backend/stream-consumer）で処理')
+    parser.add_argument('--consumer-workers', type=int, default=1,
+                        help='常駐コンシューマーのプロセス数（シャードはリースで分け合う）')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='全サービス共通の呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--dynamodb-latency-ms', type=float, help='DynamoDBの呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--kinesis-latency-ms', type=float, help='Kinesisの呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--apigateway-latency-ms', type=float, help='API Gatewayの呼び出しレイテンシ（ミリ秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='レイテンシの揺らぎ（0〜1の割合）')
+    parser.add_argument('--drain-timeout', type=float, default=30.0, help='送信停止後に滞留を処理しきるまでの待ち時間（秒）')
+    parser.add_argument('--output', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    settings = {'shards': args.shards, 'batch_size': args.batch_size, 'batching_window': args.batching_window}
+    args.latency = {
+        'dynamodb': args.dynamodb_latency_ms if args.dynamodb_latency_ms is not None else args.latency_ms,
+        'kinesis': args.kinesis_latency_ms if args.kinesis_latency_ms is not None else args.latency_ms,
+        'apigateway': args.apigateway_latency_ms if args.apigateway_latency_ms is not None else args.latency_ms
+    }
+
+    generator = load_generator()
+    results = []
+    for rate in args.rates:
+        # Lambdaのメトリクス・ログは表示しない
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results.append(run_step(rate, settings, args, generator))
+        print(f"rate={rate}/s done", file=sys.stderr)
+
+    print_results(settings, args, results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump({'settings': settings, 'args': vars(args), 'results': results}, output_file,
+                      ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+"""
+クリックストリーム生成スクリプトの共通部品
+"""
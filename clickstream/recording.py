@@ -0,0 +1,183 @@
+"""
+生成した注文の記録と再生
+記録モードはKinesisに送信せずに注文を生成し、送信予定時刻（開始からの秒数）付きでgzip圧縮のJSONLに書き出す。
+同じシードなら同じ注文・同じ間隔になるため、バックエンドの変更前後で全く同じトラフィックを流して比較できる。
+注文IDとタイムスタンプは記録した時刻ではなく、ヘッダーの固定の起点（epoch）＋送信予定時刻から作るため、ファイルの中身も同じになる。
+
+    {"header": {"seed": 1, "rate": 500, "epoch": "2024-01-01T00:00:00Z", ...}}
+    {"t": 0.00213, "order": {"orderId": "...", "product": "kinoko", ...}}
+
+再生モードはファイルを1行ずつ読みながら、記録時の間隔の1倍・N倍、または待たずに送信する。
+"""
+
+import gzip
+import io
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+# 記録時に一度に生成する注文の件数と時間幅（秒。シナリオの比率の切り替えを遅らせないように）
+RECORD_CHUNK_SIZE = 1000
+RECORD_CHUNK_SECONDS = 1.0
+
+# 記録する注文のタイムスタンプの起点（送信予定時刻0秒の時刻）
+RECORD_EPOCH = datetime(2024, 1, 1)
+
+
+class VirtualClock:
+    """記録用の仮想時計（sleepしても実際には待たず、時刻だけ進める）"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+
+def restamp(order_data, when):
+    """注文のタイムスタンプと注文IDの時刻部分を、指定した時刻（UTC）に置き換える"""
+    suffix = order_data["orderId"].rsplit("_", 1)[-1]
+    # 実行環境のタイムゾーンで注文IDが変わらないように、UTCとしてエポックミリ秒にする
+    millis = int(when.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    order_data["orderId"] = f"order_{millis}_{suffix}"
+    order_data["timestamp"] = when.isoformat() + 'Z'
+    return order_data
+
+
+def record(path, synthesizer, scheduler, clock, duration=None, count=None, header=None):
+    """仮想時計で動かしたスケジューラーの予定どおりに注文を生成し、ファイルに書き出して件数を返す
+
+    scheduler は clock.time / clock.sleep を時計として作成しておく。duration（秒）かcount（件）のどちらかで終了する。
+    """
+    if duration is None and count is None:
+        raise ValueError("duration or count is required")
+    written = 0
+    # gzipのヘッダーの更新時刻を0、ファイル名を空にして、同じシードの記録を保存先によらずバイト単位で同じにする
+    with open(path, "wb") as raw, \
+            io.TextIOWrapper(gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0), encoding="utf-8") as file:
+        file.write(json.dumps({"header": {**(header or {}), "epoch": RECORD_EPOCH.isoformat() + 'Z'}},
+                              ensure_ascii=False) + "\n")
+        finished = False
+        while not finished:
+            # 送信予定時刻をまとめて決めてから、その件数分の注文を生成
+            offsets = []
+            while len(offsets) < RECORD_CHUNK_SIZE:
+                due = scheduler.wait()
+                if duration is not None and clock.time() > duration:
+                    finished = True
+                    break
+                offsets.extend([clock.time()] * due)
+                if count is not None and written + len(offsets) >= count:
+                    del offsets[count - written:]
+                    finished = True
+                    break
+                if getattr(scheduler, "finished", False):
+                    finished = True
+                    break
+                if offsets and clock.time() - offsets[0] >= RECORD_CHUNK_SECONDS:
+                    break
+
+            elapsed = offsets[0] if offsets else None
+            for offset, order_data in zip(offsets, synthesizer.make_orders(len(offsets), elapsed)):
+                restamp(order_data, RECORD_EPOCH + timedelta(seconds=offset))
+                file.write(json.dumps({"t": round(offset, 6), "order": order_data},
+                                      ensure_ascii=False, separators=(",", ":")) + "\n")
+            written += len(offsets)
+    return written
+
+
+class ReplaySource:
+    """記録ファイルを1行ずつ読み、記録時の間隔（speed倍、0なら待たない）で注文を返す
+
+    スケジューラー（wait）と注文の生成元（make_orders）を兼ねるため、生成時と同じループでそのまま送信できる。
+    """
+
+    def __init__(self, path, speed=1.0, keep_ids=False, max_burst=1000, clock=time.monotonic, sleep=time.sleep):
+        self.path = path
+        self.speed = speed
+        # Falseの場合は注文IDの時刻部分とタイムスタンプを送信時刻に置き換える（同じファイルを何度再生しても重複扱いにならない）
+        self.keep_ids = keep_ids
+        self.max_burst = max_burst
+        self.clock = clock
+        self.sleep = sleep
+
+        self.file = gzip.open(path, "rt", encoding="utf-8")
+        first = self._read_line()
+        if first is None or "header" not in first:
+            raise ValueError(f"Not a recorded clickstream file: {path}")
+        self.header = first["header"]
+        self._next = self._read_event()
+        self._due = []
+        self.started = None
+        self.events = 0
+        self.finished = self._next is None
+
+    def _read_line(self):
+        for line in self.file:
+            if line.strip():
+                return json.loads(line)
+        return None
+
+    def _read_event(self):
+        event = self._read_line()
+        return (event["t"], event["order"]) if event else None
+
+    def wait(self):
+        """次の注文の送信時刻まで待ち、送信時刻を過ぎた注文の数を返す"""
+        if self._next is None:
+            self.finished = True
+            return 0
+        now = self.clock()
+        if self.started is None:
+            # 最初の注文の記録時刻を再生開始時刻に合わせる
+            self.started = now - self._next[0] / self.speed if self.speed else now
+        if self.speed:
+            due_time = self.started + self._next[0] / self.speed
+            if due_time > now:
+                self.sleep(due_time - now)
+                now = self.clock()
+
+        while self._next is not None and len(self._due) < self.max_burst:
+            if self.speed and self.started + self._next[0] / self.speed > now:
+                break
+            self._due.append(self._next[1])
+            self._next = self._read_event()
+        if self._next is None:
+            self.finished = True
+            self.file.close()
+        return len(self._due)
+
+    def make_orders(self, count, elapsed=None):
+        """送信時刻を過ぎた注文をcount件返す（比率は記録時のものなので、elapsedは使わない）"""
+        orders, self._due = self._due[:count], self._due[count:]
+        self.events += len(orders)
+        if not self.keep_ids:
+            now = datetime.utcnow()
+            for order_data in orders:
+                restamp(order_data, now)
+        return orders
+
+    def elapsed(self):
+        return self.clock() - self.started if self.started is not None else 0.0
+
+    def summary(self):
+        """記録時のレート（speed倍）と実績レートの比較"""
+        elapsed = self.elapsed()
+        achieved = self.events / elapsed if elapsed > 0 else 0.0
+        # シナリオで記録したファイルはレートが一定ではないため、目標レートを表示しない
+        rate = self.header.get("rate")
+        target = rate * self.speed if rate and self.speed else None
+        lag = 0.0
+        if self.speed and self._next is not None and self.started is not None:
+            lag = max(0.0, self.clock() - (self.started + self._next[0] / self.speed))
+        return {
+            "target": target,
+            "achieved": round(achieved, 1),
+            "ratio": round(achieved / target, 3) if target else None,
+            "events": self.events,
+            "elapsed": round(elapsed, 1),
+            "lag": round(lag, 3)
+        }
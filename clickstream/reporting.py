@@ -0,0 +1,190 @@
+"""
+送信結果の集計と定期的な表示
+注文を1件ずつ表示する代わりに、一定間隔でスループット（件/秒・bytes/秒）、PutRecordsのレイテンシ（p50/p95/p99）、
+スロットリング・失敗件数、シャードごとの件数を1行で表示し、終了時に全体のサマリーを表示する（--summary-jsonでJSONにも出力）。
+"""
+
+import json
+import random
+from collections import Counter
+
+# 定期的な表示の間隔（秒）
+REPORT_INTERVAL = 5
+
+# 終了時のパーセンタイル計算に残すレイテンシの件数（超えた分はリザーバーサンプリング）
+LATENCY_SAMPLES = 10000
+
+
+def new_stats(worker_id):
+    """ワーカー1つ分の送信結果"""
+    return {
+        "worker": worker_id,
+        "events": 0,
+        "batches": 0,
+        "records": 0,
+        "bytes": 0,
+        "retried": 0,
+        "throttled": 0,
+        "failed": 0,
+        "errors": Counter(),
+        "shards": Counter(),
+        # PutRecords 1回ごとの所要時間（ミリ秒、再送を含む）
+        "latencies": []
+    }
+
+
+def add_latency(latencies, seen, latency, rng=random):
+    """seen件目のレイテンシを、LATENCY_SAMPLES件までのリザーバーに追加"""
+    if len(latencies) < LATENCY_SAMPLES:
+        latencies.append(latency)
+        return
+    index = rng.randrange(seen)
+    if index < LATENCY_SAMPLES:
+        latencies[index] = latency
+
+
+def add_batch(stats, summary):
+    """PutRecords 1回分の結果（kinesis_producer.put_records_with_retryのsummary）を加算"""
+    stats["batches"] += 1
+    stats["records"] += summary["records"]
+    stats["bytes"] += summary["bytes"]
+    stats["retried"] += summary["retried"]
+    stats["throttled"] += summary.get("throttled", 0)
+    stats["failed"] += summary["failed"]
+    stats["errors"].update(summary["errors"])
+    stats["shards"].update(summary["shards"])
+    add_latency(stats["latencies"], stats["batches"], summary["elapsedMs"])
+
+
+def merge_stats(all_stats):
+    """全ワーカーの送信結果を合計"""
+    total = new_stats("total")
+    for stats in all_stats:
+        for key in ("events", "batches", "records", "bytes", "retried", "throttled", "failed"):
+            total[key] += stats[key]
+        total["errors"].update(stats["errors"])
+        total["shards"].update(stats["shards"])
+        total["latencies"].extend(stats["latencies"])
+    if len(total["latencies"]) > LATENCY_SAMPLES:
+        total["latencies"] = random.sample(total["latencies"], LATENCY_SAMPLES)
+    return total
+
+
+def percentile(sorted_values, fraction):
+    """ソート済みの値のパーセンタイル（最近接順位法）"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    """PutRecordsのレイテンシのp50/p95/p99/最大（ミリ秒）"""
+    values = sorted(latencies)
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else None
+    }
+
+
+def format_shards(shards):
+    """シャードごとの件数の割合（shardId-000000000003 → 3: 25%）"""
+    total = sum(shards.values())
+    if not total:
+        return ""
+    return ", ".join(
+        f"{int(shard_id.rsplit('-', 1)[-1])}: {count * 100 / total:.0f}%"
+        for shard_id, count in sorted(shards.items())
+    )
+
+
+def format_latencies(stats):
+    latency = latency_summary(stats["latencies"])
+    if latency["p50"] is None:
+        return "PutRecords 0回"
+    return (f"PutRecords {stats['batches']}回 p50 {latency['p50']:.1f}ms / p95 {latency['p95']:.1f}ms / "
+            f"p99 {latency['p99']:.1f}ms")
+
+
+def interval_rates(snapshots):
+    """区間ごとの送信結果（elapsed付き）から、ワーカーごとのレートを合計した (件/秒, bytes/秒)
+
+    ワーカーの区間は親プロセスの表示間隔とずれるため、ワーカーごとに自分の区間の長さで割ってから合計する。
+    """
+    totals = {}
+    for snapshot in snapshots:
+        events, sent, elapsed = totals.get(snapshot["worker"], (0, 0, 0.0))
+        totals[snapshot["worker"]] = (events + snapshot["events"], sent + snapshot["bytes"], elapsed + snapshot["elapsed"])
+    events_rate = sum(events / elapsed for events, _, elapsed in totals.values() if elapsed > 0)
+    bytes_rate = sum(sent / elapsed for _, sent, elapsed in totals.values() if elapsed > 0)
+    return events_rate, bytes_rate
+
+
+def print_interval(stats, events_rate, bytes_rate, prefix=""):
+    """直近の区間の送信結果を1行で表示"""
+    line = (f"📊 {prefix}{events_rate:.1f}件/秒, {bytes_rate / 1024:.1f}KB/秒, {format_latencies(stats)}, "
+            f"スロットリング {stats['throttled']}回, 失敗 {stats['failed']}件")
+    shards = format_shards(stats["shards"])
+    print(line + (f" [{shards}]" if shards else ""))
+
+
+def print_rate_summary(summary):
+    """目標レートと実績レートを表示（目標がない場合は実績だけ）"""
+    if summary["target"]:
+        rate = f"目標 {summary['target']}件/秒, 実績 {summary['achieved']}件/秒 ({summary['ratio'] * 100:.1f}%)"
+    else:
+        rate = f"実績 {summary['achieved']}件/秒"
+    print(f"📈 レート: {rate}, 累計 {summary['events']}件 / {summary['elapsed']}秒, 遅れ {summary['lag']}秒")
+
+
+def print_batch_result(summary, prefix=""):
+    """PutRecords 1回分の結果を表示（--verbose）"""
+    shards = ", ".join(f"{shard_id}: {count}" for shard_id, count in sorted(summary["shards"].items()))
+    print(f"✅ {prefix}PutRecords {summary['records']}レコード送信 ({summary['bytes']} bytes, {summary['elapsedMs']}ms, "
+          f"再送 {summary['retried']}件, 失敗 {summary['failed']}件) [{shards}]")
+
+
+def export_stats(stats, elapsed=None):
+    """JSONに書き出せる形の送信結果（レイテンシはパーセンタイルにまとめる）"""
+    exported = {key: value for key, value in stats.items() if key != "latencies"}
+    exported["errors"] = dict(stats["errors"])
+    exported["shards"] = dict(stats["shards"])
+    exported["latencyMs"] = latency_summary(stats["latencies"])
+    if elapsed:
+        exported["eventsPerSecond"] = round(stats["events"] / elapsed, 1)
+        exported["bytesPerSecond"] = round(stats["bytes"] / elapsed, 1)
+    return exported
+
+
+def print_summary(all_stats, elapsed, rate_summary=None, summary_path=None):
+    """ワーカーごとと全体の送信結果を表示（summary_pathを指定するとJSONでも書き出す）"""
+    print("\n=== 送信結果 ===")
+    if len(all_stats) > 1:
+        for stats in sorted(all_stats, key=lambda stats: stats["worker"]):
+            print(f"  worker {stats['worker']}: {stats['events']}件生成, {stats['records']}レコード / "
+                  f"PutRecords {stats['batches']}回, 再送 {stats['retried']}件, 失敗 {stats['failed']}件")
+    total = merge_stats(all_stats)
+    rate = total["events"] / elapsed if elapsed > 0 else 0.0
+    print(f"  合計: {total['events']}件生成 ({rate:.1f}件/秒, {elapsed:.1f}秒), "
+          f"{total['records'] - total['failed']}レコード送信 ({total['bytes']} bytes), "
+          f"再送 {total['retried']}件, スロットリング {total['throttled']}回, 失敗 {total['failed']}件")
+    print(f"  レイテンシ: {format_latencies(total)}")
+    if total["errors"]:
+        print(f"  エラー: {dict(total['errors'])}")
+    if total["shards"]:
+        print("  シャード: " + ", ".join(f"{shard_id}: {count}" for shard_id, count in sorted(total["shards"].items())))
+    if rate_summary:
+        print_rate_summary(rate_summary)
+
+    if summary_path:
+        document = {
+            "elapsed": round(elapsed, 3),
+            "total": export_stats(total, elapsed),
+            "workers": [export_stats(stats, elapsed) for stats in sorted(all_stats, key=lambda stats: stats["worker"])],
+            "rate": rate_summary
+        }
+        with open(summary_path, "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False, indent=2)
+        print(f"  サマリー: {summary_path}")
@@ -0,0 +1,202 @@
+"""
+負荷のシナリオ（時間とともに変わる注文レートと、商品・地域の比率）
+JSONファイルで、フェーズごとの負荷の形と、途中で切り替える商品・地域の比率を指定する。
+
+    {
+      "name": "webinar-go",
+      "arrival": "poisson",
+      "cities": "regional",
+      "loop": false,
+      "load": [
+        {"shape": "constant", "duration": 60, "rate": 20},
+        {"shape": "burst", "duration": 90, "rate": 20, "peak": 2000, "at": 5, "rise": 2, "decay": 15},
+        {"shape": "ramp", "duration": 60, "from": 20, "to": 300},
+        {"shape": "step", "duration": 60, "rates": [300, 600, 100]},
+        {"shape": "sine", "duration": 120, "base": 200, "amplitude": 150, "period": 40},
+        {"shape": "diurnal", "duration": 240, "base": 150, "amplitude": 140, "period": 240}
+      ],
+      "mix": [
+        {"at": 0, "products": {"kinoko": 0.5, "takenoko": 0.5}},
+        {"at": 60, "transition": 10, "products": {"kinoko": 0.8, "takenoko": 0.2}, "regions": {"関東": 0.6, "関西": 0.4}}
+      ]
+    }
+
+時刻はすべてシナリオ開始からの秒数。mixの比率は次のキーフレームまで続き、transition秒かけて前の比率から切り替える
+（指定しなかった比率は前のキーフレームのまま）。
+"""
+
+import bisect
+import json
+import math
+
+SHAPES = ("constant", "ramp", "step", "burst", "sine", "diurnal")
+
+# 平均の目標レートを計算するときの積分の刻み（秒）
+INTEGRATION_STEP = 0.1
+
+
+def phase_rate(phase, t):
+    """フェーズ開始からt秒のレート（件/秒）"""
+    shape = phase["shape"]
+    if shape == "constant":
+        rate = phase["rate"]
+    elif shape == "ramp":
+        rate = phase["from"] + (phase["to"] - phase["from"]) * t / phase["duration"]
+    elif shape == "step":
+        rates = phase["rates"]
+        rate = rates[min(int(t * len(rates) / phase["duration"]), len(rates) - 1)]
+    elif shape == "burst":
+        # 「せーの」で一斉に購入: rise秒でpeakまで上がり、decay秒の時定数で元のレートに戻る
+        base, peak = phase["rate"], phase["peak"]
+        start, rise, decay = phase.get("at", 0), phase.get("rise", 1), phase.get("decay", 10)
+        if t < start:
+            rate = base
+        elif t < start + rise:
+            rate = base + (peak - base) * (t - start) / rise
+        else:
+            rate = base + (peak - base) * math.exp(-(t - start - rise) / decay)
+    elif shape == "sine":
+        rate = phase["base"] + phase["amplitude"] * math.sin(2 * math.pi * (t + phase.get("offset", 0)) / phase["period"])
+    else:
+        # diurnal: 谷（夜）から始まり、周期の中央で山（昼）になる
+        rate = phase["base"] - phase["amplitude"] * math.cos(2 * math.pi * (t + phase.get("offset", 0)) / phase["period"])
+    return max(0.0, rate)
+
+
+def phase_peak(phase):
+    """フェーズ中の最大レート"""
+    shape = phase["shape"]
+    if shape == "constant":
+        return phase["rate"]
+    if shape == "ramp":
+        return max(phase["from"], phase["to"])
+    if shape == "step":
+        return max(phase["rates"])
+    if shape == "burst":
+        return max(phase["rate"], phase["peak"])
+    return phase["base"] + abs(phase["amplitude"])
+
+
+def validate_phase(phase):
+    required = {
+        "constant": ("rate",),
+        "ramp": ("from", "to"),
+        "step": ("rates",),
+        "burst": ("rate", "peak"),
+        "sine": ("base", "amplitude", "period"),
+        "diurnal": ("base", "amplitude", "period")
+    }
+    shape = phase.get("shape")
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown load shape: {shape} (expected one of {', '.join(SHAPES)})")
+    if not phase.get("duration") or phase["duration"] <= 0:
+        raise ValueError(f"{shape}: duration must be positive")
+    missing = [key for key in required[shape] if key not in phase]
+    if missing:
+        raise ValueError(f"{shape}: missing {', '.join(missing)}")
+    if shape == "step" and not phase["rates"]:
+        raise ValueError("step: rates must not be empty")
+
+
+def validate_weights(name, weights):
+    """mixの比率が0以上の数値で、合計が正になっているか"""
+    if not isinstance(weights, dict) or not weights:
+        raise ValueError(f"mix: {name} must be a non-empty object")
+    for key, weight in weights.items():
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not math.isfinite(weight) or weight < 0:
+            raise ValueError(f"mix: {name}.{key} must be a non-negative number")
+    if sum(weights.values()) <= 0:
+        raise ValueError(f"mix: {name} weights must not all be zero")
+
+
+def blend(previous, current, ratio):
+    """2つの比率をratio（0〜1）で線形に混ぜる"""
+    if previous is None or current is None or ratio >= 1:
+        return current
+    keys = set(previous) | set(current)
+    return {key: previous.get(key, 0) * (1 - ratio) + current.get(key, 0) * ratio for key in keys}
+
+
+class Scenario:
+    """シナリオ定義から、経過時間ごとのレートと商品・地域の比率を求める"""
+
+    def __init__(self, definition):
+        self.definition = definition
+        self.name = definition.get("name", "scenario")
+        self.arrival = definition.get("arrival")
+        self.cities = definition.get("cities")
+        self.loop = definition.get("loop", False)
+
+        self.phases = definition.get("load") or []
+        if not self.phases:
+            raise ValueError("Scenario has no load phases")
+        self.starts = []
+        self.duration = 0.0
+        for phase in self.phases:
+            validate_phase(phase)
+            self.starts.append(self.duration)
+            self.duration += phase["duration"]
+
+        # 指定のない比率は前のキーフレームから引き継ぐ
+        self.mix = []
+        for keyframe in sorted(definition.get("mix") or [], key=lambda keyframe: keyframe.get("at", 0)):
+            previous = self.mix[-1] if self.mix else {}
+            for name in ("regions", "products"):
+                if keyframe.get(name) is not None:
+                    validate_weights(name, keyframe[name])
+            self.mix.append({
+                **keyframe,
+                "regions": keyframe.get("regions", previous.get("regions")),
+                "products": keyframe.get("products", previous.get("products"))
+            })
+        self.mix_times = [keyframe.get("at", 0) for keyframe in self.mix]
+
+        # 間引き法で使う最大レート
+        self.peak_rate = max(phase_peak(phase) for phase in self.phases)
+        if self.peak_rate <= 0:
+            raise ValueError("Scenario rate is zero for its whole duration")
+
+    def _position(self, t):
+        return t % self.duration if self.loop else t
+
+    def finished(self, t):
+        """t秒でシナリオが終わっているか（loopの場合は終わらない）"""
+        return not self.loop and t >= self.duration
+
+    def rate_at(self, t):
+        """開始からt秒の目標レート（件/秒）"""
+        if self.finished(t):
+            return 0.0
+        t = self._position(t)
+        index = bisect.bisect_right(self.starts, t) - 1
+        return phase_rate(self.phases[index], t - self.starts[index])
+
+    def expected_events(self, t):
+        """開始からt秒までに発生する予定のイベント数（レートの積分）"""
+        steps = int(t / INTEGRATION_STEP)
+        total = sum(self.rate_at((step + 0.5) * INTEGRATION_STEP) for step in range(steps)) * INTEGRATION_STEP
+        remainder = t - steps * INTEGRATION_STEP
+        return total + self.rate_at(t - remainder / 2) * remainder
+
+    def mix_at(self, t):
+        """開始からt秒の (地域の重み, 商品の重み)。指定がないものはNone"""
+        t = self._position(t)
+        index = bisect.bisect_right(self.mix_times, t) - 1
+        if index < 0:
+            return None, None
+        keyframe = self.mix[index]
+        previous = self.mix[index - 1] if index > 0 else {}
+        ratio = 1.0
+        if keyframe.get("transition"):
+            # 比率の変化を0.01刻みにして、重みテーブルを作り直す回数を抑える
+            ratio = round(min(1.0, (t - keyframe.get("at", 0)) / keyframe["transition"]), 2)
+        return (
+            blend(previous.get("regions"), keyframe.get("regions"), ratio),
+            blend(previous.get("products"), keyframe.get("products"), ratio)
+        )
+
+
+def load_scenario(path):
+    """JSONファイルからシナリオを読み込む"""
+    with open(path, encoding="utf-8") as file:
+        return Scenario(json.load(file))
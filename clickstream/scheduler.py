@@ -0,0 +1,198 @@
+"""
+目標レート（件/秒）でイベントを発生させるスケジューラー
+送信予定時刻を開始時刻からの絶対時刻で管理するため、sleepの誤差や送信処理の時間が積み重なってレートがずれることがない。
+レートは一定の値のほか、時間とともに変わるシナリオ（clickstream/scenarios.py）も指定できる。
+--workers指定時は、複数プロセスで1つの送信予定を共有する（SharedRateBudget）。
+"""
+
+import math
+import multiprocessing
+import random
+import time
+
+ARRIVAL_PROCESSES = ("poisson", "fixed")
+
+# シナリオの一定間隔の到着で、レートが低い間に時刻を進める幅（秒）
+FIXED_STEP = 0.05
+
+
+def is_scenario(load):
+    return hasattr(load, "rate_at")
+
+
+def next_arrival(t, load, arrival, rng):
+    """開始からt秒の次のイベントの時刻（開始からの秒数。シナリオが終わった場合はinf）
+
+    シナリオの一定間隔の到着は、レートの積分が1件分になる時刻にする（レートが0に近い時点の1 / rateで大きく飛ばさない）。
+    ポアソン到着は、最大レートで候補を作りrate(t) / 最大レートの確率で採用する間引き法で作る。
+    """
+    if not is_scenario(load):
+        return t + (1.0 / load if arrival == "fixed" else rng.expovariate(load))
+    remaining = 1.0
+    while not load.finished(t):
+        if arrival == "fixed":
+            rate = load.rate_at(t)
+            if rate * FIXED_STEP >= remaining:
+                return t + remaining / rate
+            remaining -= rate * FIXED_STEP
+            t += FIXED_STEP
+        else:
+            t += rng.expovariate(load.peak_rate)
+            if rng.random() * load.peak_rate < load.rate_at(t):
+                return t
+    return math.inf
+
+
+def target_rate(load, elapsed):
+    """開始から経過時間までの平均の目標レート"""
+    if not is_scenario(load):
+        return load
+    return load.expected_events(elapsed) / elapsed if elapsed > 0 else load.rate_at(0)
+
+
+def peak_rate(load):
+    return load.peak_rate if is_scenario(load) else load
+
+
+def validate_load(load, arrival):
+    if not is_scenario(load) and load <= 0:
+        raise ValueError(f"rate must be positive: {load}")
+    if arrival not in ARRIVAL_PROCESSES:
+        raise ValueError(f"Unknown arrival process: {arrival}")
+
+
+def rate_summary(load, events, elapsed, lag):
+    """目標レートと実績レートの比較"""
+    achieved = events / elapsed if elapsed > 0 else 0.0
+    target = target_rate(load, elapsed)
+    return {
+        "target": round(target, 1),
+        "achieved": round(achieved, 1),
+        "ratio": round(achieved / target, 3) if target else None,
+        "events": events,
+        "elapsed": round(elapsed, 1),
+        "lag": round(lag, 3)
+    }
+
+
+class RateScheduler:
+    """到着過程（poisson: 指数分布の間隔 / fixed: 一定間隔）に従ってイベントの予定時刻を決める"""
+
+    def __init__(self, rate, arrival="poisson", max_burst=None, rng=None, clock=time.monotonic, sleep=time.sleep):
+        validate_load(rate, arrival)
+        self.rate = rate
+        self.arrival = arrival
+        # 1回の wait で返すイベント数の上限（遅れを取り戻すときに巨大なバーストにしない）
+        self.max_burst = max_burst or max(1, int(peak_rate(rate) * 0.1))
+        self.rng = rng or random.Random()
+        self.clock = clock
+        self.sleep = sleep
+
+        self.started = clock()
+        self.next_time = self.started + next_arrival(0.0, rate, arrival, self.rng)
+        self.events = 0
+        # シナリオを最後まで進めると終了する（一定のレートでは終わらない）
+        self.finished = False
+
+    def wait(self):
+        """次のイベントの予定時刻まで待ち、予定時刻を過ぎたイベントの数を返す"""
+        if self.next_time == math.inf:
+            self.finished = True
+            return 0
+        now = self.clock()
+        if self.next_time > now:
+            self.sleep(self.next_time - now)
+            now = self.clock()
+
+        due = 0
+        while self.next_time <= now and due < self.max_burst:
+            due += 1
+            self.next_time = self.started + next_arrival(self.next_time - self.started, self.rate, self.arrival, self.rng)
+        self.events += due
+        self.finished = self.next_time == math.inf
+        return due
+
+    def elapsed(self):
+        """開始からの経過秒数（シナリオの時刻）"""
+        return self.clock() - self.started
+
+    def lag(self):
+        """予定より遅れている時間（秒）。送信が目標レートに追いついていないと増え続ける"""
+        if self.next_time == math.inf:
+            return 0.0
+        return max(0.0, self.clock() - self.next_time)
+
+    def summary(self):
+        return rate_summary(self.rate, self.events, self.elapsed(), self.lag())
+
+
+class SharedRateBudget:
+    """複数プロセスで共有する送信予定（--workers指定時に全ワーカーで1つの目標レートを分け合う）"""
+
+    def __init__(self, rate, arrival="poisson", context=multiprocessing):
+        validate_load(rate, arrival)
+        self.rate = rate
+        self.arrival = arrival
+        # プロセス間で比較できるようにtime.time()の時刻で持つ（0は未開始）
+        self.started = context.Value("d", 0.0, lock=False)
+        self.next_time = context.Value("d", 0.0, lock=False)
+        self.events = context.Value("q", 0, lock=False)
+        self.lock = context.Lock()
+
+    def summary(self):
+        """全ワーカー合計の目標レートと実績レートの比較"""
+        with self.lock:
+            started, next_time, events = self.started.value, self.next_time.value, self.events.value
+        now = time.time()
+        elapsed = now - started if started else 0.0
+        lag = max(0.0, now - next_time) if started and next_time != math.inf else 0.0
+        return rate_summary(self.rate, events, elapsed, lag)
+
+
+class SharedRateScheduler:
+    """SharedRateBudgetの送信予定を一定時間（window）ずつ取り出すワーカー用スケジューラー
+
+    空いているワーカーが次の区間を取るため、遅いワーカーの分を他のワーカーが自然に肩代わりする。
+    """
+
+    def __init__(self, budget, window=0.01, rng=None, clock=time.time, sleep=time.sleep):
+        self.budget = budget
+        self.window = window
+        self.rng = rng or random.Random()
+        self.clock = clock
+        self.sleep = sleep
+        self.max_burst = max(1, int(peak_rate(budget.rate) * 0.1))
+        self.events = 0
+        self.finished = False
+
+    def wait(self):
+        """次の区間の送信予定を取り出し、区間の開始時刻まで待ってからイベントの数を返す"""
+        budget = self.budget
+        with budget.lock:
+            now = self.clock()
+            if not budget.started.value:
+                budget.started.value = now
+                budget.next_time.value = now + next_arrival(0.0, budget.rate, budget.arrival, self.rng)
+            started = budget.started.value
+            start = next_time = budget.next_time.value
+            # 予定より遅れている場合は、予定時刻を過ぎたイベントもこの区間に含める
+            end = max(start, now) + self.window
+            due = 0
+            while next_time <= end and next_time != math.inf and due < self.max_burst:
+                due += 1
+                next_time = started + next_arrival(next_time - started, budget.rate, budget.arrival, self.rng)
+            budget.next_time.value = next_time
+            budget.events.value += due
+
+        self.finished = next_time == math.inf
+        if due and start > now:
+            self.sleep(start - now)
+        self.events += due
+        return due
+
+    def elapsed(self):
+        started = self.budget.started.value
+        return self.clock() - started if started else 0.0
+
+    def summary(self):
+        return self.budget.summary()
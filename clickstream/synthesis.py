@@ -0,0 +1,150 @@
+"""
+注文データのまとめ生成
+都市の選択確率（地域の重み ÷ 地域内の都市数）を最初に累積テーブルにしておき、商品・ユーザー・都市をN件分まとめて抽出する。
+注文IDとタイムスタンプもバッチごとにまとめて作るため、1件ごとのdatetime・uuidの呼び出しがなくなる。
+NumPyがインストールされていればNumPyでベクトル化して抽出する（なくても同じ分布で動作する）。
+シードを指定した場合は、NumPyの有無で注文が変わらないように常にrandomモジュールで抽出する。
+シナリオを指定すると、経過時間に応じて地域・商品の比率を切り替える。
+"""
+
+import itertools
+import random
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PRODUCTS = ("kinoko", "takenoko")
+MAX_USER_ID = 100
+
+
+def city_weights(cities, region_weights):
+    """地域の重みを地域内の都市に均等に割り振った、都市ごとの選択確率"""
+    region_sizes = {}
+    for city in cities:
+        region_sizes[city["region"]] = region_sizes.get(city["region"], 0) + 1
+    weights = [region_weights.get(city["region"], 0) / region_sizes[city["region"]] for city in cities]
+    total = sum(weights)
+    if total <= 0:
+        raise ValueError("region_weights do not cover any city")
+    return [weight / total for weight in weights]
+
+
+def product_probabilities(products, product_weights):
+    """商品ごとの選択確率"""
+    total = sum(product_weights)
+    if total <= 0:
+        raise ValueError(f"product_weights do not cover any of {', '.join(products)}")
+    return [weight / total for weight in product_weights]
+
+
+class OrderSynthesizer:
+    """注文データをN件まとめて生成（citiesを省略すると位置情報なし）"""
+
+    def __init__(self, cities=None, region_weights=None, products=PRODUCTS, product_weights=None,
+                 max_user_id=MAX_USER_ID, seed=None, scenario=None):
+        self.cities = list(cities) if cities else []
+        self.products = list(products)
+        self.max_user_id = max_user_id
+        self.user_ids = [f"user_{user_id}" for user_id in range(1, max_user_id + 1)]
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # NumPyとrandomでは同じシードでも乱数系列が異なるため、シード指定時はrandomだけを使う
+        self.np_rng = numpy.random.default_rng() if numpy is not None and seed is None else None
+        # シナリオで比率の指定がない間は、この重みを使う
+        self.base_region_weights = region_weights
+        self.base_product_weights = product_weights
+        self.scenario = scenario
+        self._mix = (None, None)
+        self.set_weights(region_weights, product_weights)
+        if scenario is not None:
+            self._check_scenario()
+
+    def set_weights(self, region_weights=None, product_weights=None):
+        """地域・商品の重みを変更（累積テーブルを作り直す）"""
+        self.region_weights = region_weights
+        self.product_weights = product_weights
+        if self.cities:
+            weights = city_weights(self.cities, region_weights or {city["region"]: 1 for city in self.cities})
+            self.city_probabilities = weights
+            self.city_cum_weights = list(itertools.accumulate(weights))
+        self.product_probabilities = product_probabilities(self.products, product_weights or [1] * len(self.products))
+        self.product_cum_weights = list(itertools.accumulate(self.product_probabilities))
+
+    def for_worker(self, worker_id):
+        """ワーカーごとに乱数系列を分けた複製（fork後の全ワーカーが同じ注文を生成しないように）"""
+        seed = None if self.seed is None else self.seed * 1000003 + worker_id
+        return OrderSynthesizer(self.cities, self.base_region_weights, self.products, self.base_product_weights,
+                                self.max_user_id, seed, self.scenario)
+
+    def _check_scenario(self):
+        """シナリオの比率がこの商品・都市のどれかを選べるか、生成を始める前に確認する
+
+        比率は0以上なので、キーフレームごとに選べれば切り替え途中の比率でも選べる。
+        """
+        for keyframe in self.scenario.mix:
+            if keyframe.get("products") is not None:
+                product_probabilities(self.products, [keyframe["products"].get(product, 0) for product in self.products])
+            if keyframe.get("regions") is not None and self.cities:
+                city_weights(self.cities, keyframe["regions"])
+
+    def _apply_scenario(self, elapsed):
+        """シナリオのelapsed秒の比率に重みを切り替える（変わったときだけテーブルを作り直す）"""
+        mix = self.scenario.mix_at(elapsed)
+        if mix == self._mix:
+            return
+        self._mix = mix
+        regions, products = mix
+        product_weights = self.base_product_weights
+        if products is not None:
+            product_weights = [products.get(product, 0) for product in self.products]
+        self.set_weights(self.base_region_weights if regions is None else regions, product_weights)
+
+    def _sample(self, population, cum_weights, probabilities, count):
+        if self.np_rng is not None:
+            indexes = self.np_rng.choice(len(population), size=count, p=probabilities)
+            return [population[index] for index in indexes.tolist()]
+        return self.rng.choices(population, cum_weights=cum_weights, k=count)
+
+    def _sample_uniform(self, population, count):
+        if self.np_rng is not None:
+            return [population[index] for index in self.np_rng.integers(0, len(population), size=count).tolist()]
+        return self.rng.choices(population, k=count)
+
+    def _order_id_suffixes(self, count):
+        """注文IDの乱数部分（16進8桁）をまとめて作成
+
+        同じバッチの注文はミリ秒部分が同じになるため、乱数の起点から連番にしてバッチ内で重複させない。
+        """
+        base = self.rng.getrandbits(32)
+        return [f"{(base + offset) & 0xffffffff:08x}" for offset in range(count)]
+
+    def make_orders(self, count, elapsed=None):
+        """注文データをcount件生成（elapsedはシナリオ開始からの秒数）"""
+        if count <= 0:
+            return []
+        if self.scenario is not None and elapsed is not None:
+            self._apply_scenario(elapsed)
+        now = datetime.utcnow()
+        # 同じバッチの注文は同じ時刻に生成したものとして扱う
+        timestamp = now.isoformat() + 'Z'
+        id_prefix = f"order_{int(now.timestamp() * 1000)}_"
+
+        products = self._sample(self.products, self.product_cum_weights, self.product_probabilities, count)
+        user_ids = self._sample_uniform(self.user_ids, count)
+        suffixes = self._order_id_suffixes(count)
+
+        if not self.cities:
+            return [
+                {"orderId": id_prefix + suffix, "product": product, "timestamp": timestamp, "userId": user_id}
+                for suffix, product, user_id in zip(suffixes, products, user_ids)
+            ]
+
+        locations = self._sample(self.cities, self.city_cum_weights, self.city_probabilities, count)
+        return [
+            {"orderId": id_prefix + suffix, "product": product, "timestamp": timestamp, "userId": user_id,
+             "location": location}
+            for suffix, product, user_id, location in zip(suffixes, products, user_ids, locations)
+        ]
@@ -0,0 +1,255 @@
+"""
+クリックストリーム生成のメインループと、複数プロセスでの並列実行
+ワーカーごとにKinesisクライアントとプロデューサーを持ち、--rate・--scenario指定時は全ワーカーで1つの目標レートを共有する。
+各ワーカーの送信結果は一定間隔で親プロセスに送って1行にまとめて表示し、終了時に1つのサマリーにまとめる。
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+import boto3
+
+# 共通のレコード形式・バッチ送信（backend/shared）
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "shared"))
+from record_format import build_records
+from kinesis_producer import KinesisProducer
+from partitioning import Partitioner
+
+from clickstream.recording import ReplaySource, VirtualClock, record
+from clickstream.reporting import (add_batch, interval_rates, merge_stats, new_stats, print_batch_result,
+                                   print_interval, print_rate_summary, print_summary)
+from clickstream.scheduler import RateScheduler, SharedRateBudget, SharedRateScheduler
+
+
+def send_packed_orders(producer, partitioner, orders, record_format):
+    """複数の注文をまとめたレコードとして送信バッファに追加（パーティションキーは先頭の注文で決める）"""
+    records = build_records(orders, record_format)
+    for data, packed_orders in records:
+        producer.put(data, *partitioner.key(packed_orders[0]))
+    return len(records)
+
+
+def run_generator(synthesizer, describe_order, options, worker_id=0, scheduler=None, stop_event=None, reports=None):
+    """注文を生成してKinesisに送信し、送信結果を返す（Ctrl+Cまたはstop_eventで終了）
+
+    synthesizer は注文をまとめて生成し（clickstream/synthesis.py）、
+    describe_order(order_data) は1件ごとの表示（Noneの場合はJSONをそのまま表示）を返す。
+    reportsを指定した場合（複数ワーカー）は、区間ごとの送信結果を表示せずに親プロセスへ送る。
+    """
+    verbose = options["verbose"]
+    # 1件ごとの表示は --debug=N でN件に1件だけ（0は表示しない）
+    debug_every = options["debug_every"]
+    pack_size = options["pack_size"]
+    prefix = f"[worker {worker_id}] " if options["workers"] > 1 else ""
+    stats = new_stats(worker_id)
+    # 表示間隔ごとの送信結果（lingerのスレッドからも更新するためロックで守る）
+    interval = new_stats(worker_id)
+    stats_lock = threading.Lock()
+
+    def on_batch(entries, results, summary):
+        with stats_lock:
+            add_batch(stats, summary)
+            add_batch(interval, summary)
+        if verbose:
+            print_batch_result(summary, prefix)
+        if summary["failed"]:
+            print(f"❌ {prefix}再送しても送信できなかったレコード: {summary['errors']}")
+
+    # ワーカーごとにクライアントを作成（プロセス間で共有しない）
+    client = boto3.client("kinesis", region_name=options["region"])
+    # 500レコード / 5MiB / lingerのいずれかでPutRecordsを送信し、失敗したレコードだけを再送
+    producer = KinesisProducer(client, options["stream_name"], linger_seconds=options["linger"], on_batch=on_batch)
+    # --partitionに従ってパーティションキーを決める（explicitはここでシャードの範囲を取得）
+    partitioner = Partitioner.for_stream(client, options["stream_name"], options["partition"])
+
+    # 親プロセスが表示間隔ごとに全ワーカーの区間をまとめられるように、ワーカーは半分の間隔で送る
+    report_interval = options["report_interval"] / 2 if reports is not None else options["report_interval"]
+    interval_started = time.monotonic()
+    generated = 0
+    pending_orders = []
+    try:
+        while not (stop_event and stop_event.is_set()) and not (scheduler and scheduler.finished):
+            if scheduler:
+                # 予定時刻を過ぎた分だけまとめて生成
+                count = scheduler.wait()
+            else:
+                # ランダムな間隔で待機（0の場合は待たずに連続で生成）
+                if options["max_interval"] > 0:
+                    time.sleep(random.randint(1, options["max_interval"]))
+                count = 1
+
+            # 予定の件数をまとめて生成（シナリオの比率は開始からの経過時間で決まる）
+            with stats_lock:
+                stats["events"] += count
+                interval["events"] += count
+            for order_data in synthesizer.make_orders(count, scheduler.elapsed() if scheduler else None):
+                generated += 1
+                if debug_every and generated % debug_every == 0:
+                    detail = json.dumps(order_data, ensure_ascii=False) if describe_order is None else describe_order(order_data)
+                    print(f"{prefix}[{datetime.now().strftime('%H:%M:%S')}] 送信データ: {detail}")
+
+                if pack_size > 1:
+                    pending_orders.append(order_data)
+                    if len(pending_orders) < pack_size:
+                        continue
+                    send_packed_orders(producer, partitioner, pending_orders, options["record_format"])
+                    pending_orders = []
+                    continue
+
+                # JSON形式でデータを準備し、送信バッファに追加（結果はPutRecordsごとにまとめて集計）
+                data = json.dumps(order_data, ensure_ascii=False)
+                producer.put(data.encode("utf-8"), *partitioner.key(order_data))
+
+            now = time.monotonic()
+            if now - interval_started >= report_interval:
+                with stats_lock:
+                    snapshot, interval = interval, new_stats(worker_id)
+                snapshot["elapsed"] = now - interval_started
+                interval_started = now
+                if reports is not None:
+                    reports.put(snapshot)
+                else:
+                    print_interval(snapshot, *interval_rates([snapshot]), prefix)
+                    if scheduler:
+                        print_rate_summary(scheduler.summary())
+
+        if scheduler and scheduler.finished:
+            print(f"\n\n=== {prefix}最後まで送信しました ===")
+    except KeyboardInterrupt:
+        print("\n\n=== データ生成を停止しました ===")
+    except Exception as e:
+        print(f"\n❌ {prefix}エラーが発生しました: {str(e)}")
+    finally:
+        # バッファに残っている注文を送信してから終了
+        if pending_orders:
+            send_packed_orders(producer, partitioner, pending_orders, options["record_format"])
+        producer.close()
+    return stats
+
+
+def worker_main(synthesizer, describe_order, options, worker_id, budget, stop_event, results, reports):
+    """子プロセスのエントリポイント（Ctrl+Cは親プロセスが受けてstop_eventで止める）"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    scheduler = SharedRateScheduler(budget) if budget else None
+    results.put(run_generator(synthesizer.for_worker(worker_id), describe_order, options, worker_id, scheduler,
+                              stop_event, reports))
+
+
+def target_load(options):
+    """目標のレート（件/秒）またはシナリオ（どちらも指定がなければNone）"""
+    return options.get("scenario") or options["rate"]
+
+
+def drain(reports):
+    """ワーカーから届いている区間ごとの送信結果をすべて取り出す"""
+    snapshots = []
+    while True:
+        try:
+            snapshots.append(reports.get_nowait())
+        except queue.Empty:
+            return snapshots
+
+
+def run_workers(synthesizer, describe_order, options, scheduler=None):
+    """options["workers"]個のワーカーで生成・送信し、送信結果のサマリーを表示
+
+    schedulerを指定した場合（記録ファイルの再生など）は、1プロセスでそのスケジュールどおりに送信する。
+    """
+    started = time.monotonic()
+    load = target_load(options)
+    summary_path = options.get("summary_path")
+    if scheduler is not None or options["workers"] <= 1:
+        if scheduler is None and load:
+            scheduler = RateScheduler(load, options["arrival"])
+        stats = run_generator(synthesizer, describe_order, options, scheduler=scheduler)
+        print_summary([stats], time.monotonic() - started, scheduler.summary() if scheduler else None, summary_path)
+        return
+
+    budget = SharedRateBudget(load, options["arrival"]) if load else None
+    stop_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    reports = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker_main,
+            args=(synthesizer, describe_order, options, worker_id, budget, stop_event, results, reports),
+            daemon=True
+        )
+        for worker_id in range(1, options["workers"] + 1)
+    ]
+    for process in processes:
+        process.start()
+
+    # 全ワーカーの区間ごとの送信結果をまとめて表示
+    all_stats = []
+    snapshots = []
+    next_report = time.monotonic() + options["report_interval"]
+    try:
+        while any(process.is_alive() for process in processes):
+            time.sleep(0.5)
+            snapshots.extend(drain(reports))
+            if time.monotonic() >= next_report:
+                if snapshots:
+                    print_interval(merge_stats(snapshots), *interval_rates(snapshots))
+                    snapshots = []
+                if budget:
+                    print_rate_summary(budget.summary())
+                next_report += options["report_interval"]
+    except KeyboardInterrupt:
+        print("\n\n=== データ生成を停止しました ===")
+    stop_event.set()
+
+    # 結果を受け取ってからjoinする（キューに残ったままだと子プロセスが終了できない）
+    while len(all_stats) < len(processes):
+        drain(reports)
+        try:
+            all_stats.append(results.get(timeout=1))
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                break
+    drain(reports)
+    for process in processes:
+        process.join()
+    print_summary(all_stats, time.monotonic() - started, budget.summary() if budget else None, summary_path)
+
+
+def run_clickstream(synthesizer, describe_order, options):
+    """optionsに応じて、記録（--record）・記録の再生（--replay）・生成して送信のいずれかを実行"""
+    if options.get("record_path"):
+        # 送信せずに、仮想時計で目標レートのスケジュールを進めながら記録
+        clock = VirtualClock()
+        scheduler = RateScheduler(target_load(options), options["arrival"], rng=random.Random(options["seed"]),
+                                  clock=clock.time, sleep=clock.sleep)
+        header = {"seed": options["seed"], "arrival": options["arrival"]}
+        if options.get("scenario"):
+            header["scenario"] = options["scenario"].definition
+        else:
+            header["rate"] = options["rate"]
+        written = record(
+            options["record_path"], synthesizer, scheduler, clock,
+            duration=options.get("duration"), count=options.get("count"), header=header
+        )
+        print(f"\n✅ {written}件を {options['record_path']} に記録しました")
+        return
+
+    if options.get("replay_path"):
+        # 記録の順番どおりに送るため、再生は1プロセスで行う
+        options = {**options, "workers": 1}
+        source = ReplaySource(options["replay_path"], speed=options["speed"], keep_ids=options["keep_ids"])
+        speed = f"{options['speed']}倍" if options["speed"] else "最大速度"
+        header = dict(source.header)
+        if "scenario" in header:
+            header["scenario"] = header["scenario"].get("name")
+        print(f"\n 再生: {options['replay_path']}（{speed}, 記録時の設定: {header}）")
+        run_workers(source, describe_order, options, scheduler=source)
+        return
+
+    run_workers(synthesizer, describe_order, options)
@@ -0,0 +1,203 @@
+"""
+Script to generate kinoko vs takenoko purchase data driven by load-shape scenarios
+きのこ vs たけのこ リアルタイム購入サイト用のクリックストリームデータ生成スクリプト（シナリオ対応版）
+
+--cities で都市データ（major: 主要都市 / regional: 地方都市重視 / none: 位置情報なし）を、
+--scenario でバースト・ランプ・サイン波などの負荷の形と商品・地域の比率の変化を指定する（clickstream/scenarios.py）。
+"""
+
+import os
+import sys
+import boto3
+
+from clickstream.cities import CITY_SETS
+from clickstream.reporting import REPORT_INTERVAL
+from clickstream.scenarios import load_scenario
+from clickstream.scheduler import ARRIVAL_PROCESSES
+from clickstream.synthesis import OrderSynthesizer
+from clickstream.workers import run_clickstream
+
+# パーティションキーの決め方（backend/shared/partitioning.py、Order Processorと共通）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "shared"))
+from partitioning import PARTITION_STRATEGY, STRATEGIES
+
+
+def detect_region():
+    # requestsはEC2上でのリージョン検出にだけ使う（ローカル検証では不要）
+    import requests
+
+    try:
+        response = requests.get(
+            "http://169.254.169.254/latest/dynamic/instance-identity/document"
+        )
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        metadata = response.json()
+        return metadata["region"]
+    except requests.RequestException:
+        print("Failed to fetch EC2 instance metadata")
+        return None
+
+
+def describe_order(order_data):
+    """1件ごとの表示（商品名と都市）"""
+    product_name = "きのこの山" if order_data["product"] == "kinoko" else "たけのこの里"
+    location = order_data["location"]
+    return f"{product_name} @ {location['name']}({location['region']})"
+
+
+def main(argv=None, cities=None, title="シナリオ対応版"):
+    """コマンドライン引数を解析して生成・送信（citiesは --cities 省略時の都市データ）"""
+    argv = sys.argv if argv is None else argv
+    script = argv[0]
+    print(f"\n=== きのこ vs たけのこ クリックストリーム生成器（{title}） ===")
+    print("\n Number of arguments:", len(argv), "arguments")
+    print("\n Argument List:", str(argv))
+    print("\n The program name is:", str(script))
+
+    if len(argv) < 3:
+        print(f"\n使用方法: python {script} <stream_name> <max_interval_seconds> [--verbose] [--debug[=N]] [--report-interval=SECONDS] [--summary-json=PATH] [--pack=N] [--compress] [--linger=SECONDS] [--partition=orderId|userId|random|explicit|product] [--rate=EVENTS_PER_SEC|--scenario=PATH] [--arrival=poisson|fixed] [--cities=major|regional|none] [--workers=N] [--seed=N] [--record=PATH --duration=SECONDS|--count=N] [--replay=PATH] [--speed=N|max] [--keep-ids]")
+        print(f"例: python {script} kinesis-stream-demo-stream 1 --scenario=scenarios/webinar-go.json")
+        sys.exit(1)
+
+    stream_name = str(argv[1])
+    max_interval = int(argv[2])
+    # 一定間隔で送信結果を1行にまとめて表示（--verboseでPutRecordsごとにも表示）
+    verbose = "--verbose" in argv[3:]
+    report_interval = next((float(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--report-interval=")),
+                           REPORT_INTERVAL)
+    # 1件ごとの表示は --debug（全件）/ --debug=N（N件に1件）のときだけ
+    debug_every = next((int(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--debug=")),
+                       1 if "--debug" in argv[3:] else 0)
+    # 終了時のサマリーをJSONファイルにも書き出す
+    summary_path = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--summary-json=")), None)
+    # 複数の注文を1レコードにまとめて送信（--pack=N、--compressでzlib圧縮）
+    pack_size = next((int(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--pack=")), 1)
+    record_format = ("packed-zlib" if "--compress" in argv[3:] else "packed") if pack_size > 1 else "json"
+    # PutRecordsでまとめて送信するまでの最大待ち時間（秒）
+    linger = next((float(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--linger=")), 0.1)
+    # パーティションキーの決め方（省略時は環境変数 PARTITION_STRATEGY、未設定ならorderId）
+    partition = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--partition=")), PARTITION_STRATEGY)
+    if partition not in STRATEGIES:
+        print(f"\n--partition は {' / '.join(STRATEGIES)} のいずれかを指定してください")
+        sys.exit(1)
+    # 目標レート（件/秒）を指定すると、max_interval_secondsの代わりにこのレートで生成
+    rate = next((float(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--rate=")), None)
+    # --scenario=PATHはシナリオファイルの負荷の形と比率で生成（--rateの代わり）
+    scenario_path = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--scenario=")), None)
+    if rate and scenario_path:
+        print("\n--rate と --scenario は同時に指定できません")
+        sys.exit(1)
+    scenario = None
+    if scenario_path:
+        try:
+            scenario = load_scenario(scenario_path)
+        except (OSError, ValueError) as e:
+            print(f"\n❌ シナリオを読み込めませんでした: {scenario_path}: {e}")
+            sys.exit(1)
+    # 到着過程・都市データはシナリオの指定より引数を優先
+    arrival = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--arrival=")), None)
+    arrival = arrival or (scenario and scenario.arrival) or "poisson"
+    if arrival not in ARRIVAL_PROCESSES:
+        print(f"\n--arrival は {' / '.join(ARRIVAL_PROCESSES)} のいずれかを指定してください")
+        sys.exit(1)
+    city_set = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--cities=")), None)
+    city_set = city_set or (scenario and scenario.cities) or cities or "regional"
+    if city_set not in CITY_SETS:
+        print(f"\n--cities は {' / '.join(CITY_SETS)} のいずれかを指定してください")
+        sys.exit(1)
+    # 並列で生成・送信するプロセス数（--rate・--scenario指定時は全プロセスで目標レートを分け合う）
+    workers = next((int(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--workers=")), 1)
+    # --seedで注文の内容を再現可能にする（--recordでは省略時0）
+    seed = next((int(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--seed=")), None)
+    # --record=PATHは送信せずに --duration秒 / --count件 分をgzip圧縮のJSONLに記録
+    record_path = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--record=")), None)
+    duration = next((float(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--duration=")), None)
+    count = next((int(arg.split("=", 1)[1]) for arg in argv[3:] if arg.startswith("--count=")), None)
+    # --replay=PATHは記録したファイルを --speed倍（maxで待たずに）送信
+    replay_path = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--replay=")), None)
+    speed = next((arg.split("=", 1)[1] for arg in argv[3:] if arg.startswith("--speed=")), "1")
+    speed = 0 if speed == "max" else float(speed)
+    keep_ids = "--keep-ids" in argv[3:]
+    if record_path:
+        # 繰り返さないシナリオは最後まで記録
+        if duration is None and count is None and scenario and not scenario.loop:
+            duration = scenario.duration
+        if not (rate or scenario) or (duration is None and count is None):
+            print("\n--record には --rate または --scenario と、--duration または --count を指定してください")
+            sys.exit(1)
+        seed = seed if seed is not None else 0
+
+    print(f"\n Kinesis Stream名: {stream_name}")
+    if scenario:
+        length = "繰り返し" if scenario.loop else f"{scenario.duration:.0f}秒"
+        print(f"\n シナリオ: {scenario.name}（{len(scenario.phases)}フェーズ, {length}, "
+              f"最大 {scenario.peak_rate}件/秒, {arrival}）")
+    elif rate:
+        print(f"\n 目標レート: {rate}件/秒（{arrival}）")
+    else:
+        print(f"\n 最大間隔（秒）: {max_interval}")
+    if verbose:
+        print("\n Verbose モード: ON")
+    if debug_every:
+        print(f"\n 1件ごとの表示: {debug_every}件に1件")
+    if pack_size > 1:
+        print(f"\n レコード形式: {record_format}（{pack_size}件ずつ）")
+    print(f"\n PutRecordsの待ち時間（秒）: {linger}")
+    print(f"\n パーティションキー: {partition}")
+    if workers > 1:
+        print(f"\n ワーカー数: {workers}")
+
+    # AWS設定
+    my_session = boto3.session.Session()
+    region = detect_region() if not record_path else None  # 記録モードでは送信しないため不要
+    if not region:
+        region = "ap-northeast-1"  # デフォルトリージョン
+    print(f"\n リージョン: {region}")
+
+    # ワーカーごとにKinesisクライアントを作成して送信する（clickstream/workers.py）
+    options = {
+        "stream_name": stream_name,
+        "region": region,
+        "max_interval": max_interval,
+        "verbose": verbose,
+        "debug_every": debug_every,
+        "report_interval": report_interval,
+        "summary_path": summary_path,
+        "pack_size": pack_size,
+        "record_format": record_format,
+        "linger": linger,
+        "partition": partition,
+        "rate": rate,
+        "scenario": scenario,
+        "arrival": arrival,
+        "workers": workers,
+        "seed": seed,
+        "record_path": record_path,
+        "duration": duration,
+        "count": count,
+        "replay_path": replay_path,
+        "speed": speed,
+        "keep_ids": keep_ids
+    }
+
+    japan_cities, region_weights = CITY_SETS[city_set]
+    print(f"\n=== データ生成開始（{title}） ===")
+    if japan_cities:
+        print(f"対象都市数: {len(japan_cities)}都市")
+        print("地域別重み付け:")
+        for name, weight in region_weights.items():
+            region_count = len([city for city in japan_cities if city["region"] == name])
+            print(f"  {name}: {weight*100:.1f}% ({region_count}都市)")
+    print("Ctrl+C で停止")
+
+    # 注文データは都市の累積テーブルからまとめて生成する（clickstream/synthesis.py）
+    try:
+        synthesizer = OrderSynthesizer(japan_cities, region_weights, seed=seed, scenario=scenario)
+    except ValueError as e:
+        print(f"\n❌ シナリオの比率で注文を生成できません: {e}")
+        sys.exit(1)
+    run_clickstream(synthesizer, describe_order if japan_cities else None, options)
+
+
+if __name__ == "__main__":
+    main()
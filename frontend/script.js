@@ -2,11 +2,26 @@
 let chart;
 let websocket;
 let map;
+let heatmapLayer;
+let heatmapCities = {};
+// 差分配信のバージョン管理（Kinesisシャードごとのレーン: {レーン: 適用済みのバージョン}）
+let currentVersions = null;
+let pendingDeltas = {};
+let gapTimer = null;
+const GAP_TIMEOUT_MS = 2000;
+let snapshotTimer = null;
+const SNAPSHOT_RETRY_MS = 3000;
 let salesData = {
     kinoko: 0,
     takenoko: 0
 };
 
+// 連打されたクリックをまとめて送信（{"orders": [...]}）する待ち時間と最大件数
+const ORDER_BATCH_DELAY_MS = 200;
+const ORDER_BATCH_MAX = 50;
+let pendingOrders = [];
+let orderBatchTimer = null;
+
 // API設定
 const API_ENDPOINT = 'https://v04tokbw1g.execute-api.ap-northeast-1.amazonaws.com/prod';
 const WEBSOCKET_ENDPOINT = 'wss://svo2gfv6ml.execute-api.ap-northeast-1.amazonaws.com/prod';
@@ -79,6 +94,61 @@ function addMarkerToMap(product, location) {
     console.log(`マーカー追加: ${productName} at ${location.name}`);
 }
 
+// サーバーから受け取ったヒートマップ（{p: 商品一覧, c: [[都市, 緯度, 経度, 件数...]]}）を読み込み
+function loadHeatmap(heatmap) {
+    heatmapCities = {};
+    heatmap.c.forEach(([name, lat, lng, ...counts]) => {
+        const city = {lat: lat, lng: lng, counts: {}};
+        heatmap.p.forEach((product, index) => {
+            city.counts[product] = counts[index];
+        });
+        heatmapCities[name] = city;
+    });
+    renderHeatmap();
+}
+
+// 新しい注文をヒートマップの累計に反映
+function addOrderToHeatmap(product, location) {
+    if (!heatmapCities[location.name]) {
+        heatmapCities[location.name] = {lat: location.lat, lng: location.lng, counts: {}};
+    }
+    const counts = heatmapCities[location.name].counts;
+    counts[product] = (counts[product] || 0) + 1;
+}
+
+// 都市ごとの累計件数を円の大きさ、多い方の商品を色で表示
+function renderHeatmap() {
+    if (!map) return;
+    
+    if (heatmapLayer) {
+        heatmapLayer.clearLayers();
+    } else {
+        heatmapLayer = L.layerGroup().addTo(map);
+    }
+    
+    Object.entries(heatmapCities).forEach(([name, city]) => {
+        const kinoko = city.counts.kinoko || 0;
+        const takenoko = city.counts.takenoko || 0;
+        const total = kinoko + takenoko;
+        if (total === 0) return;
+        
+        const color = kinoko >= takenoko ? '#D2691E' : '#32CD32';
+        L.circleMarker([city.lat, city.lng], {
+            radius: 6 + Math.sqrt(total) * 2,
+            color: color,
+            fillColor: color,
+            fillOpacity: 0.35,
+            weight: 1
+        }).bindPopup(`
+            <div style="text-align: center;">
+                <strong>${name}</strong><br>
+                きのこの山: ${kinoko}<br>
+                たけのこの里: ${takenoko}
+            </div>
+        `).addTo(heatmapLayer);
+    });
+}
+
 // チャートの初期化
 function initChart() {
     const ctx = document.getElementById('salesChart').getContext('2d');
@@ -122,21 +192,31 @@ function initWebSocket() {
         console.log('WebSocket接続が確立されました');
         console.log('Calling updateConnectionStatus with connected');
         updateConnectionStatus('connected');
+        // $connect中はサーバーから送信できないため、接続後にスナップショットを要求
+        requestSnapshot();
     };
     
     websocket.onmessage = function(event) {
         const data = JSON.parse(event.data);
         console.log('WebSocketメッセージ受信:', data);
         
-        if (data.type === 'update') {
-            updateDisplay(data.data);
-            
-            // 地図にマーカーを追加（新しい購入があった場合）
-            if (data.data.newOrder) {
-                const order = data.data.newOrder;
-                if (order.location) {
-                    addMarkerToMap(order.product, order.location);
-                }
+        if (data.t === 's') {
+            // 全量スナップショット
+            applySnapshot(data);
+        } else if (data.t === 'c') {
+            // 取りこぼした差分のまとめ
+            data.ds.forEach(([lane, version, deltas]) => {
+                bufferDelta({l: lane, v: version, d: deltas, o: []});
+            });
+            applyPendingDeltas();
+        } else if (data.t === 'd') {
+            // 差分（順番待ちのバッファに入れてからレーンごとに連番で適用）
+            bufferDelta(data);
+            if (currentVersions === null) {
+                // スナップショットをまだ受け取っていない場合は、差分を保持したままスナップショットを要求
+                requestSnapshot();
+            } else {
+                applyPendingDeltas();
             }
         }
     };
@@ -154,6 +234,111 @@ function initWebSocket() {
     };
 }
 
+// 全量スナップショットの適用
+function applySnapshot(message) {
+    if (snapshotTimer) {
+        clearTimeout(snapshotTimer);
+        snapshotTimer = null;
+    }
+    currentVersions = {...message.v};
+    updateDisplay(message.c);
+    if (message.h) {
+        loadHeatmap(message.h);
+    }
+    // スナップショットに含まれる差分は捨てる
+    Object.entries(pendingDeltas).forEach(([key, delta]) => {
+        if (delta.v <= laneVersion(delta.l)) {
+            delete pendingDeltas[key];
+        }
+    });
+    applyPendingDeltas();
+}
+
+// レーンの適用済みのバージョン（スナップショットにないレーンは0から）
+function laneVersion(lane) {
+    return currentVersions[lane] || 0;
+}
+
+// 差分を順番待ちのバッファに追加（適用済みのものは捨てる）
+function bufferDelta(delta) {
+    if (currentVersions === null || delta.v > laneVersion(delta.l)) {
+        pendingDeltas[`${delta.l}:${delta.v}`] = delta;
+    }
+}
+
+// レーンごとにバージョンが連続している差分を順番に適用
+function applyPendingDeltas() {
+    if (currentVersions === null) {
+        return;
+    }
+    
+    let applied = false;
+    new Set(Object.values(pendingDeltas).map(delta => delta.l)).forEach(lane => {
+        let key = `${lane}:${laneVersion(lane) + 1}`;
+        while (pendingDeltas[key]) {
+            const delta = pendingDeltas[key];
+            delete pendingDeltas[key];
+            currentVersions[lane] = delta.v;
+            applyDelta(delta);
+            applied = true;
+            key = `${lane}:${delta.v + 1}`;
+        }
+    });
+    if (applied) {
+        renderHeatmap();
+    }
+    
+    // 欠番があれば一定時間待ってから不足分を要求
+    if (Object.keys(pendingDeltas).length > 0) {
+        if (!gapTimer) {
+            gapTimer = setTimeout(requestMissingDeltas, GAP_TIMEOUT_MS);
+        }
+    } else if (gapTimer) {
+        clearTimeout(gapTimer);
+        gapTimer = null;
+    }
+}
+
+// 差分1件の適用（件数の加算と新規注文のマーカー表示）
+function applyDelta(delta) {
+    const totals = {...salesData};
+    Object.entries(delta.d).forEach(([product, count]) => {
+        totals[product] = (totals[product] || 0) + count;
+    });
+    updateDisplay(totals);
+    
+    // 新規注文: [商品, 都市名, 地域, 緯度, 経度]
+    (delta.o || []).forEach(([product, name, region, lat, lng]) => {
+        const location = {name, region, lat, lng};
+        addMarkerToMap(product, location);
+        addOrderToHeatmap(product, location);
+    });
+}
+
+// 全量スナップショットをサーバーに要求（応答を待つ間は繰り返し送らない）
+function requestSnapshot() {
+    if (snapshotTimer || !websocket || websocket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    // 地域別の累計件数（ヒートマップ）も初期データとして受け取る
+    websocket.send(JSON.stringify({action: 'getCurrentData', heatmap: true}));
+    // 応答がなければ（サーバー側の読み込み失敗など）もう一度要求
+    snapshotTimer = setTimeout(() => {
+        snapshotTimer = null;
+        if (currentVersions === null) {
+            requestSnapshot();
+        }
+    }, SNAPSHOT_RETRY_MS);
+}
+
+// 欠番の差分をサーバーに要求
+function requestMissingDeltas() {
+    gapTimer = null;
+    if (websocket && websocket.readyState === WebSocket.OPEN) {
+        websocket.send(JSON.stringify({action: 'getCurrentData', sinceVersion: currentVersions}));
+    }
+}
+
 // 接続状況の表示更新
 function updateConnectionStatus(status) {
     console.log('updateConnectionStatus called with status:', status);
@@ -219,30 +404,57 @@ function initEventListeners() {
     });
 }
 
-// 商品購入処理
-async function purchaseProduct(product) {
+// 商品購入処理（クリックはORDER_BATCH_DELAY_MS待ってからまとめて送信）
+function purchaseProduct(product) {
+    // ランダムな日本の都市を選択
+    const location = getWeightedRandomCity();
+    
+    pendingOrders.push({
+        product: product,
+        timestamp: new Date().toISOString(),
+        location: location
+    });
+    
+    if (pendingOrders.length >= ORDER_BATCH_MAX) {
+        flushOrders();
+    } else if (!orderBatchTimer) {
+        orderBatchTimer = setTimeout(flushOrders, ORDER_BATCH_DELAY_MS);
+    }
+}
+
+// まとめた注文を1回のリクエストで送信
+async function flushOrders() {
+    clearTimeout(orderBatchTimer);
+    orderBatchTimer = null;
+    const orders = pendingOrders;
+    pendingOrders = [];
+    if (orders.length === 0) {
+        return;
+    }
+    
     try {
-        // ランダムな日本の都市を選択
-        const location = getWeightedRandomCity();
-        
         const response = await fetch(`${API_ENDPOINT}/purchase`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({
-                product: product,
-                timestamp: new Date().toISOString(),
-                location: location
-            })
+            body: JSON.stringify({ orders: orders })
         });
         
+        // 一部の注文だけ失敗した場合は207（注文ごとの結果を確認）
         if (response.ok) {
             const result = await response.json();
             console.log('購入成功:', result);
             
-            // 即座に地図にマーカーを追加
-            addMarkerToMap(product, location);
+            // 送信できた注文だけ即座に地図にマーカーを追加
+            result.orders.forEach((orderResult) => {
+                const order = orders[orderResult.index];
+                if (orderResult.success) {
+                    addMarkerToMap(order.product, order.location);
+                } else {
+                    console.error('購入エラー:', order.product, orderResult.error);
+                }
+            });
         } else {
             console.error('購入エラー:', response.statusText);
         }